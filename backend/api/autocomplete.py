@@ -0,0 +1,108 @@
+from bisect import bisect_left
+from threading import Lock
+
+from django.conf import settings
+from django.db.models import Case, IntegerField, Value, When
+
+from food.catalog import get_catalog_version
+from food.models import Ingredient
+
+# Символ, который больше любого символа в названиях:
+# граница диапазона ключей с заданным префиксом.
+MAX_CHAR = '\U0010ffff'
+
+
+class IngredientIndex:
+    """Отсортированный по названию каталог продуктов в памяти процесса.
+
+    Совпадения по началу названия ищутся бинарным поиском, по подстроке —
+    проходом по списку (в каталоге несколько тысяч строк).
+    """
+
+    def __init__(self, ingredients, version=None):
+        self.version = version
+        self.entries = sorted(
+            (name.casefold(), pk, name, measurement_unit)
+            for pk, name, measurement_unit in ingredients
+        )
+        self.keys = [entry[0] for entry in self.entries]
+        self.by_id = {entry[1]: entry for entry in self.entries}
+
+    @classmethod
+    def from_db(cls):
+        version = get_catalog_version()
+        return cls(
+            Ingredient.objects.values_list('id', 'name', 'measurement_unit'),
+            version=version
+        )
+
+    @staticmethod
+    def to_ingredient(entry):
+        _, pk, name, measurement_unit = entry
+        return Ingredient(id=pk, name=name,
+                          measurement_unit=measurement_unit)
+
+    def search(self, query, limit):
+        query = query.strip().casefold()
+        start = bisect_left(self.keys, query)
+        end = bisect_left(self.keys, query + MAX_CHAR, lo=start)
+        found = self.entries[start:min(end, start + limit)]
+        if len(found) < limit:
+            found += [
+                entry for entry in self.entries
+                if query in entry[0] and not entry[0].startswith(query)
+            ][:limit - len(found)]
+        return [self.to_ingredient(entry) for entry in found]
+
+
+_index = None
+_index_lock = Lock()
+
+
+def get_index():
+    """Индекс актуальной версии каталога (см. food.catalog)."""
+    global _index
+    version = get_catalog_version()
+    index = _index
+    if index is None or index.version != version:
+        with _index_lock:
+            if _index is None or _index.version != version:
+                _index = IngredientIndex.from_db()
+            index = _index
+    return index
+
+
+def resolve_ingredients(ids):
+    """Продукты с id из ids: из индекса, если он уже построен для текущей
+    версии каталога, иначе одним запросом."""
+    index = _index
+    if index is None or index.version != get_catalog_version():
+        return Ingredient.objects.in_bulk(ids)
+    return {pk: index.to_ingredient(index.by_id[pk])
+            for pk in ids if pk in index.by_id}
+
+
+def invalidate_index():
+    global _index
+    _index = None
+
+
+def search_in_db(query, limit):
+    query = query.strip()
+    return list(
+        Ingredient.objects.filter(name__icontains=query).annotate(
+            is_substring=Case(
+                When(name__istartswith=query, then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField(),
+            )
+        ).order_by('is_substring', 'name')[:limit]
+    )
+
+
+def search_ingredients(query, limit=None):
+    """Продукты, совпавшие с началом названия, затем — с его частью."""
+    limit = limit or settings.INGREDIENT_SEARCH_LIMIT
+    if settings.INGREDIENT_SEARCH_IN_MEMORY:
+        return get_index().search(query, limit)
+    return search_in_db(query, limit)
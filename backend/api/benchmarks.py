@@ -0,0 +1,274 @@
+import base64
+import io
+import statistics
+import tracemalloc
+from time import perf_counter
+
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.autocomplete import search_ingredients
+from api.filters import RecipeFilter
+from api.pantry import get_index as get_pantry_index
+from api.serializers import (FollowedUserSerializer, RecipeReadSerializer,
+                             RecipeWriteSerializer, get_recipes_limit)
+from api.views import (RecipeViewSet, build_recipe_queryset,
+                       build_subscriptions_queryset)
+from food.models import Follow, Ingredient, Recipe, Tag, User
+
+PAGE_SIZE = 6
+
+factory = APIRequestFactory()
+
+
+class Rollback(Exception):
+    pass
+
+
+def make_request(user, path='/api/recipes/', data=None, method='get'):
+    request = Request(getattr(factory, method)(path, data))
+    request.user = user
+    return request
+
+
+def run_rolled_back(function):
+    try:
+        with transaction.atomic():
+            function()
+            raise Rollback
+    except Rollback:
+        pass
+
+
+def small_image():
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), 'green').save(buffer, format='PNG')
+    return ('data:image/png;base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
+
+
+class Dataset:
+    """Самые активные пользователи и популярные объекты набора данных."""
+
+    def __init__(self):
+        self.reader = User.objects.annotate(
+            carts=Count('shoppingcartitems')).order_by('-carts', 'id').first()
+        self.follower = User.objects.order_by(
+            '-following_count', 'id').first()
+        self.author = User.objects.order_by('-recipes_count', 'id').first()
+        self.recipe = Recipe.objects.filter(
+            author=self.author).order_by('-id').first()
+        self.tags = list(Tag.objects.annotate(
+            recipes_total=Count('recipes')
+        ).order_by('-recipes_total').values_list('slug', 'id')[:2])
+        self.ingredients = list(Ingredient.objects.annotate(
+            recipes_total=Count('ingredients_in_recipe')
+        ).order_by('-recipes_total').values_list('id', 'name')[:5])
+
+    @property
+    def sizes(self):
+        return {
+            'users': User.objects.count(),
+            'recipes': Recipe.objects.count(),
+            'follows': Follow.objects.count(),
+        }
+
+
+def recipe_list(data):
+    request = make_request(data.reader)
+
+    def run():
+        RecipeReadSerializer(
+            build_recipe_queryset(data.reader).order_by(
+                '-pub_date', '-id')[:PAGE_SIZE],
+            many=True, context={'request': request}
+        ).data
+    return run
+
+
+def recipe_detail(data):
+    request = make_request(data.reader)
+
+    def run():
+        RecipeReadSerializer(
+            build_recipe_queryset(data.reader).get(pk=data.recipe.pk),
+            context={'request': request}
+        ).data
+    return run
+
+
+def subscriptions(data):
+    request = make_request(data.follower, '/api/users/subscriptions/',
+                           {'recipes_limit': 3})
+
+    def run():
+        authors = build_subscriptions_queryset(
+            data.follower, get_recipes_limit(request)
+        ).order_by('username', 'id')[:PAGE_SIZE]
+        FollowedUserSerializer(authors, many=True,
+                               context={'request': request}).data
+    return run
+
+
+def recipe_payload(data):
+    return {
+        'name': 'Рецепт для замера',
+        'text': 'Описание',
+        'cooking_time': 15,
+        'image': small_image(),
+        'tags': [tag_id for _, tag_id in data.tags],
+        'ingredients': [{'id': ingredient_id, 'amount': 100}
+                        for ingredient_id, _ in data.ingredients],
+    }
+
+
+def recipe_create(data):
+    request = make_request(data.author, method='post')
+
+    def save():
+        serializer = RecipeWriteSerializer(
+            data=recipe_payload(data), context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+    return lambda: run_rolled_back(save)
+
+
+def recipe_update(data):
+    request = make_request(data.author, method='patch')
+
+    def save():
+        serializer = RecipeWriteSerializer(
+            Recipe.objects.get(pk=data.recipe.pk), data=recipe_payload(data),
+            partial=True, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+    return lambda: run_rolled_back(save)
+
+
+def recipe_filter(get_params):
+    def case(data):
+        request = make_request(data.reader, data=get_params(data))
+
+        def run():
+            list(RecipeFilter(
+                data=request.query_params,
+                queryset=build_recipe_queryset(data.reader).order_by(
+                    '-pub_date', '-id'),
+                request=request,
+            ).qs[:PAGE_SIZE])
+        return run
+    return case
+
+
+def feed(data):
+    view = RecipeViewSet.as_view({'get': 'feed'})
+
+    def run():
+        request = factory.get('/api/recipes/feed/')
+        force_authenticate(request, data.follower)
+        view(request)
+    return run
+
+
+def what_to_cook(data):
+    ingredient_ids = [ingredient_id for ingredient_id, _ in data.ingredients]
+
+    def run():
+        found = get_pantry_index().search(ingredient_ids, missing=3)
+        list(build_recipe_queryset(data.reader).filter(
+            pk__in=[recipe_id for recipe_id, _, _ in found[:PAGE_SIZE]]))
+    return run
+
+
+def download_shopping_cart(data):
+    view = RecipeViewSet.as_view({'get': 'download_shopping_cart'})
+
+    def run():
+        request = factory.get('/api/recipes/download_shopping_cart/',
+                              {'file_format': 'txt'})
+        force_authenticate(request, data.reader)
+        b''.join(view(request).streaming_content)
+    return run
+
+
+def ingredient_search(data):
+    queries = [name[:length] for _, name in data.ingredients
+               for length in (1, 3)]
+
+    def run():
+        for query in queries:
+            search_ingredients(query)
+    return run
+
+
+# Имя случая -> фабрика, которая по набору данных строит замеряемую функцию.
+CASES = {
+    'recipe_list': recipe_list,
+    'recipe_detail': recipe_detail,
+    'subscriptions': subscriptions,
+    'recipe_create': recipe_create,
+    'recipe_update': recipe_update,
+    'filter_tags': recipe_filter(lambda data: {
+        'tags': [slug for slug, _ in data.tags]}),
+    'filter_author': recipe_filter(lambda data: {'author': data.author.pk}),
+    'filter_favorited': recipe_filter(lambda data: {'is_favorited': 1}),
+    'filter_cart': recipe_filter(lambda data: {'is_in_shopping_cart': 1}),
+    'filter_tags_favorited': recipe_filter(lambda data: {
+        'tags': [slug for slug, _ in data.tags], 'is_favorited': 1}),
+    # Слово из названия: в generate_dataset это блюдо («суп», «плов»).
+    'search': recipe_filter(lambda data: {
+        'search': data.recipe.name.split()[1]}),
+    'popular': recipe_filter(lambda data: {'ordering': 'popular'}),
+    'feed': feed,
+    'what_to_cook': what_to_cook,
+    'download_shopping_cart': download_shopping_cart,
+    'ingredient_search': ingredient_search,
+}
+
+
+def measure(run, repeat):
+    """Медиана и минимум времени, число SQL-запросов и пик памяти."""
+    run()  # прогрев: кэши, индекс продуктов, соединение
+    timings = []
+    for _ in range(repeat):
+        started = perf_counter()
+        run()
+        timings.append((perf_counter() - started) * 1000)
+    with CaptureQueriesContext(connection) as context:
+        run()
+    # Отдельный прогон: трассировка памяти искажает время.
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'time_ms': round(statistics.median(timings), 3),
+        'min_ms': round(min(timings), 3),
+        'queries': len(context),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def compare(base, new, threshold):
+    """Строки сравнения и список регрессий (рост времени или памяти
+    больше threshold, любой рост числа запросов)."""
+    rows, regressions = [], []
+    for name, result in new['cases'].items():
+        old = base['cases'].get(name)
+        if old is None:
+            rows.append((name, result, None, []))
+            continue
+        problems = [
+            metric for metric in ('time_ms', 'peak_kb')
+            if result[metric] > old[metric] * (1 + threshold)
+        ]
+        if result['queries'] > old['queries']:
+            problems.append('queries')
+        rows.append((name, result, old, problems))
+        if problems:
+            regressions.append(name)
+    return rows, regressions
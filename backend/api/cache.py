@@ -0,0 +1,57 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from food.catalog import get_catalog_cache, get_catalog_version
+
+
+class CatalogCacheMixin:
+    """Кэширует ответы list/retrieve справочников по версии каталога.
+
+    Ответ хранится вместе с сильным ETag; при совпадении If-None-Match
+    возвращается 304 без тела.
+    """
+
+    def get_cache_key(self, request):
+        return (f'catalog:{get_catalog_version()}:'
+                f'{request.accepted_renderer.format}:'
+                f'{request.get_full_path()}')
+
+    def cached_response(self, request, build_response):
+        cache = get_catalog_cache()
+        key = self.get_cache_key(request)
+        cached = cache.get(key)
+        if cached is None:
+            response = build_response()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            content = json.dumps(response.data, ensure_ascii=False,
+                                 sort_keys=True, default=str)
+            cached = (
+                response.data,
+                quote_etag(hashlib.sha256(
+                    f'{key}:{content}'.encode()).hexdigest()),
+            )
+            cache.set(key, cached, settings.CATALOG_CACHE_TIMEOUT)
+
+        data, etag = cached
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(CatalogCacheMixin, self).list(
+                request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(CatalogCacheMixin, self).retrieve(
+                request, *args, **kwargs))
@@ -0,0 +1,91 @@
+from collections.abc import Mapping
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField, который в списке получает объекты всех id
+    одним запросом, а не запросом на каждый элемент.
+
+    Объекты загружает prefetch (его вызывают BulkManyRelatedField и
+    BulkListSerializer) через resolve(ids) -> {id: объект}: так их можно
+    брать из кэша справочников; id, которых там нет, ищутся в базе одним
+    запросом. Каждый элемент затем проверяется как обычно, поэтому ошибки
+    те же, что у PrimaryKeyRelatedField.
+    """
+
+    def __init__(self, resolve=None, **kwargs):
+        self.resolve = resolve
+        self.resolved = None
+        super().__init__(**kwargs)
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def to_pk(self, data):
+        if self.pk_field is not None:
+            return self.pk_field.to_internal_value(data)
+        return self.get_queryset().model._meta.pk.to_python(data)
+
+    def prefetch(self, values):
+        pks = set()
+        for value in values:
+            try:
+                pks.add(self.to_pk(value))
+            except (TypeError, ValueError, DjangoValidationError,
+                    serializers.ValidationError):
+                # Ошибку сообщит проверка самого элемента.
+                continue
+        if not self.resolve:
+            self.resolved = self.get_queryset().in_bulk(pks)
+            return
+        self.resolved = dict(self.resolve(pks))
+        # resolve берёт объекты из кэша, который может отставать от базы:
+        # добавленные после его построения ищем одним запросом.
+        missing = pks - self.resolved.keys()
+        if missing:
+            self.resolved.update(self.get_queryset().in_bulk(missing))
+
+    def to_internal_value(self, data):
+        if self.resolved is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = self.to_pk(data)
+        except (TypeError, ValueError, DjangoValidationError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in self.resolved:
+            self.fail('does_not_exist', pk_value=data)
+        return self.resolved[pk]
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+
+    def to_internal_value(self, data):
+        if isinstance(data, (list, tuple)):
+            self.child_relation.prefetch(data)
+        return super().to_internal_value(data)
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    """Загружает объекты полей BulkPrimaryKeyRelatedField всех элементов
+    списка до их проверки."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            for field in self.child.fields.values():
+                if isinstance(field, BulkPrimaryKeyRelatedField):
+                    field.prefetch(
+                        item.get(field.field_name) for item in data
+                        if isinstance(item, Mapping)
+                        and field.field_name in item
+                    )
+        return super().to_internal_value(data)
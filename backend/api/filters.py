@@ -1,8 +1,16 @@
 # backend/api/filters.py
 
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as filters
 
-from food.models import Recipe, Tag
+from food.catalog import get_tag_ids
+from food.models import Favorite, Recipe, ShoppingCartItem
+from food.popularity import ORDERINGS, order_by_popularity
+from food.search import search_recipes
+
+
+def tag_choices():
+    return [(slug, slug) for slug in get_tag_ids()]
 
 
 class RecipeFilter(filters.FilterSet):
@@ -10,26 +18,58 @@ class RecipeFilter(filters.FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
+    # Слаги проверяются по закэшированному словарю slug -> id, а фильтр
+    # строится как EXISTS: несколько тегов не размножают строки рецептов
+    # и не требуют DISTINCT.
+    tags = filters.MultipleChoiceFilter(
         label='tags',
-        to_field_name='slug',
-        queryset=Tag.objects.all(),
+        choices=tag_choices,
+        method='filter_tags',
+    )
+    # Сортирует по релевантности; в режиме курсора порядок остаётся
+    # хронологическим (релевантность не поле модели).
+    search = filters.CharFilter(method='filter_search')
+    # Порядок по оценкам из RecipePopularity (refresh_popularity):
+    # popular — затухание за месяцы, trending — за дни. Как и search,
+    # в режиме курсора не действует.
+    ordering = filters.ChoiceFilter(
+        choices=[(name, name) for name in ORDERINGS],
+        method='filter_ordering',
     )
 
     class Meta:
         model = Recipe
         fields = ['author', 'tags']
 
-    def filter_is_favorited(self, recipes, name, value):
+    def filter_tags(self, recipes, name, slugs):
+        if not slugs:
+            return recipes
+        tag_ids = get_tag_ids()
+        return recipes.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'),
+            tag_id__in=[tag_ids[slug] for slug in slugs],
+        )))
+
+    def filter_search(self, recipes, name, query):
+        return search_recipes(recipes, query)
+
+    def filter_ordering(self, recipes, name, ordering):
+        return order_by_popularity(recipes, ordering)
+
+    def filter_user_relation(self, recipes, model, annotation, value):
         user = self.request.user
-        if value and not user.is_anonymous:
+        if not value or user.is_anonymous:
+            return recipes
+        # build_recipe_queryset уже вычисляет этот EXISTS для ответа.
+        if annotation in recipes.query.annotations:
+            return recipes.filter(**{annotation: True})
+        return recipes.filter(Exists(model.objects.filter(
+            user=user, recipe=OuterRef('pk'))))
 
-            return recipes.filter(favorites__user=user)
-        return recipes
+    def filter_is_favorited(self, recipes, name, value):
+        return self.filter_user_relation(
+            recipes, Favorite, 'is_favorited', value)
 
     def filter_is_in_shopping_cart(self, recipes, name, value):
-        user = self.request.user
-        if value and not user.is_anonymous:
-            return recipes.filter(shoppingcartitems__user=user)
-        return recipes
+        return self.filter_user_relation(
+            recipes, ShoppingCartItem, 'is_in_shopping_cart', value)
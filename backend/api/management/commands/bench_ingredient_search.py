@@ -0,0 +1,59 @@
+import random
+import statistics
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.autocomplete import IngredientIndex, search_in_db
+from food.models import Ingredient
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = ('Сравнение задержки поиска продуктов: istartswith по БД, '
+            'ранжированный поиск по БД и индекс в памяти.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--names', type=int, default=200,
+                            help='Сколько названий «набрать» по буквам')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        names = list(Ingredient.objects.values_list('name', flat=True))
+        if not names:
+            raise CommandError('Каталог продуктов пуст, загрузите его '
+                               'командой load_ingredients_json.')
+        generator = random.Random(options['seed'])
+        # Запросы как при наборе в автодополнении: префиксы в 1-6 букв.
+        queries = [
+            name[:length]
+            for name in generator.sample(names,
+                                         min(options['names'], len(names)))
+            for length in range(1, min(len(name), 6) + 1)
+        ]
+        limit = settings.INGREDIENT_SEARCH_LIMIT
+        index = IngredientIndex.from_db()
+        strategies = {
+            'istartswith (текущий)': lambda query: list(
+                Ingredient.objects.filter(name__istartswith=query)),
+            'БД, префикс + подстрока': lambda query: search_in_db(
+                query, limit),
+            'индекс в памяти': lambda query: index.search(query, limit),
+        }
+        self.stdout.write(
+            f'{len(queries)} запросов, каталог {len(names)} продуктов')
+        for title, search in strategies.items():
+            timings = []
+            for query in queries:
+                started = perf_counter()
+                search(query)
+                timings.append((perf_counter() - started) * 1000)
+            self.stdout.write(
+                f'{title:<26} p50={statistics.median(timings):.3f} мс '
+                f'p99={percentile(timings, 0.99):.3f} мс'
+            )
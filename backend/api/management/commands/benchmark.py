@@ -0,0 +1,92 @@
+import json
+import platform
+import shutil
+import tempfile
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+
+from api.benchmarks import CASES, Dataset, compare, measure
+
+
+class Command(BaseCommand):
+    help = ('Микробенчмарки сериализаторов, фильтров, списка покупок и '
+            'поиска продуктов на наборе данных generate_dataset. '
+            'С --compare сравнивает два сохранённых прогона.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Сохранить результаты в JSON')
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--case', action='append', choices=list(CASES),
+                            help='Запустить только эти случаи')
+        parser.add_argument('--compare', nargs=2,
+                            metavar=('BASE', 'NEW'),
+                            help='Сравнить два JSON-файла результатов')
+        parser.add_argument(
+            '--threshold', type=float, default=10,
+            help='Допустимый рост времени и памяти, %% (для --compare)'
+        )
+
+    def handle(self, *args, **options):
+        if options['compare']:
+            return self.compare(*options['compare'], options['threshold'])
+        data = Dataset()
+        if data.recipe is None or data.reader is None:
+            raise CommandError('Нет данных: сначала выполните '
+                               'generate_dataset.')
+        media_root = tempfile.mkdtemp()
+        results = {}
+        try:
+            # Замеры записи сохраняют картинки: не засоряем MEDIA_ROOT.
+            # Запросы строит APIRequestFactory с хостом testserver.
+            with override_settings(
+                    MEDIA_ROOT=media_root,
+                    ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                for name in options['case'] or CASES:
+                    results[name] = measure(CASES[name](data),
+                                            options['repeat'])
+                    self.stdout.write(self.format_row(name, results[name]))
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump({
+                    'created': datetime.now(timezone.utc).isoformat(),
+                    'python': platform.python_version(),
+                    'database': connection.vendor,
+                    'dataset': data.sizes,
+                    'repeat': options['repeat'],
+                    'cases': results,
+                }, file, ensure_ascii=False, indent=2)
+
+    def format_row(self, name, result, old=None, problems=()):
+        row = (f'{name:<24} {result["time_ms"]:>9.2f} мс '
+               f'{result["queries"]:>4} запр. {result["peak_kb"]:>9.1f} КБ')
+        if old is not None:
+            change = (result['time_ms'] / old['time_ms'] - 1) * 100 if (
+                old['time_ms']) else 0
+            row += (f'  (было {old["time_ms"]:.2f} мс, {old["queries"]} '
+                    f'запр., {old["peak_kb"]:.1f} КБ; {change:+.0f}%)')
+        if problems:
+            row = self.style.ERROR(f'{row}  РЕГРЕССИЯ: {", ".join(problems)}')
+        return row
+
+    def compare(self, base_path, new_path, threshold):
+        runs = []
+        for path in (base_path, new_path):
+            with open(path, encoding='utf-8') as file:
+                runs.append(json.load(file))
+        base, new = runs
+        if base.get('dataset') != new.get('dataset'):
+            self.stderr.write(self.style.WARNING(
+                'Прогоны сделаны на разных наборах данных.'))
+        rows, regressions = compare(base, new, threshold / 100)
+        for name, result, old, problems in rows:
+            self.stdout.write(self.format_row(name, result, old, problems))
+        if regressions:
+            raise CommandError(
+                f'Регрессии больше {threshold:g}%: {", ".join(regressions)}')
+        self.stdout.write(self.style.SUCCESS('Регрессий нет.'))
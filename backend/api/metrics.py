@@ -0,0 +1,224 @@
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from threading import Lock
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+# Границы корзин гистограмм: секунды для времени, штуки для запросов.
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+HISTOGRAMS = {
+    'total': ('foodgram_request_duration_seconds',
+              'Полное время обработки запроса', TIME_BUCKETS),
+    'db': ('foodgram_db_duration_seconds',
+           'Время SQL-запросов за запрос', TIME_BUCKETS),
+    'serialize': ('foodgram_serialize_duration_seconds',
+                  'Время сериализации и рендеринга ответа', TIME_BUCKETS),
+    'queries': ('foodgram_db_queries',
+                'Число SQL-запросов за запрос', QUERY_BUCKETS),
+}
+
+current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    __slots__ = ('started', 'queries', 'db', 'serialize')
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Обёртка connection.execute_wrapper: учитывает каждый запрос.
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += perf_counter() - started
+            self.queries += 1
+
+    def server_timing(self, total):
+        return (
+            f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries", '
+            f'serialize;dur={self.serialize * 1000:.1f}, '
+            f'total;dur={total * 1000:.1f}'
+        )
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Гистограммы по (view, action) в памяти процесса."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.histograms = {}
+
+    def observe(self, labels, values):
+        with self.lock:
+            for name, value in values.items():
+                key = (name, labels)
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(
+                        HISTOGRAMS[name][2])
+                histogram.observe(value)
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus (версия 0.0.4)."""
+        with self.lock:
+            items = sorted(
+                (key, histogram.counts[:], histogram.sum, histogram.count)
+                for key, histogram in self.histograms.items()
+            )
+        lines = []
+        for name, (metric, help_text, buckets) in HISTOGRAMS.items():
+            lines += [f'# HELP {metric} {help_text}',
+                      f'# TYPE {metric} histogram']
+            for (item_name, (view, action)), counts, total, count in items:
+                if item_name != name:
+                    continue
+                labels = f'view="{view}",action="{action}"'
+                cumulative = 0
+                for bound, bucket_count in zip(
+                        (*buckets, '+Inf'), counts):
+                    cumulative += bucket_count
+                    lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} '
+                                 f'{cumulative}')
+                lines.append(f'{metric}_sum{{{labels}}} {total}')
+                lines.append(f'{metric}_count{{{labels}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+@contextmanager
+def measure_serialize():
+    metrics = current.get()
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            metrics.serialize += perf_counter() - started
+
+
+def get_labels(request):
+    match = request.resolver_match
+    if match is None:
+        return 'unresolved', request.method.lower()
+    view = getattr(match.func, 'cls', None)
+    if view is None:
+        return match.view_name, request.method.lower()
+    actions = getattr(match.func, 'actions', None) or {}
+    return (view.__name__,
+            actions.get(request.method.lower(), request.method.lower()))
+
+
+class MetricsMiddleware:
+    """Запросы к БД, сериализация и полное время каждого запроса.
+
+    Значения отдаются клиенту заголовком Server-Timing и копятся в
+    гистограммах для /api/metrics/.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        metrics = RequestMetrics()
+        token = current.set(metrics)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            current.reset(token)
+        total = perf_counter() - metrics.started
+        response['Server-Timing'] = metrics.server_timing(total)
+        registry.observe(get_labels(request), {
+            'total': total,
+            'db': metrics.db,
+            'serialize': metrics.serialize,
+            'queries': metrics.queries,
+        })
+        return response
+
+    def process_template_response(self, request, response):
+        # Рендеринг ответа DRF (JSON) — тоже часть сериализации.
+        metrics = current.get()
+        if metrics is not None:
+            started = perf_counter()
+
+            def rendered(response):
+                metrics.serialize += perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+
+class MetricsViewMixin:
+    """Учитывает в метрике serialize время serializer.data."""
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        to_representation = serializer.to_representation
+
+        @wraps(to_representation)
+        def timed(*args, **kwargs):
+            with measure_serialize():
+                return to_representation(*args, **kwargs)
+
+        serializer.to_representation = timed
+        return serializer
+
+
+class PrometheusRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            # Ответы об ошибках DRF: {'detail': ...}.
+            data = '\n'.join(f'{key}: {value}' for key, value in data.items())
+        return data
+
+
+class MetricsView(APIView):
+    permission_classes = [IsAdminUser]
+    renderer_classes = [PrometheusRenderer]
+
+    def get(self, request):
+        return Response(registry.render(),
+                        content_type='text/plain; version=0.0.4')
@@ -1,7 +1,259 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import EmptyPage, Page, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination, PageNumberPagination,
+                                       replace_query_param)
+from rest_framework.response import Response
+
+COUNT_EXACT = 'exact'
+COUNT_ESTIMATE = 'estimate'
+COUNT_NONE = 'none'
+
+
+def estimate_count(queryset):
+    """Оценка числа строк по плану запроса (только PostgreSQL).
+
+    На остальных СУБД возвращает точный COUNT(*).
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class LazyCountPage(Page):
+    def has_next(self):
+        return self.has_more
+
+
+class LazyCountPaginator(Paginator):
+    """Пагинатор без COUNT(*).
+
+    Наличие следующей страницы определяется по лишней строке выборки,
+    поэтому страницы за пределами приблизительного count не теряются.
+    """
+
+    current_pages = 1
+
+    @cached_property
+    def count(self):
+        return None
+
+    @property
+    def num_pages(self):
+        return self.current_pages
+
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise EmptyPage('Номер страницы должен быть целым числом.')
+        if number < 1:
+            raise EmptyPage('Номер страницы меньше 1.')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage('На этой странице нет результатов.')
+        page = LazyCountPage(rows[:self.per_page], number, self)
+        page.has_more = len(rows) > self.per_page
+        self.current_pages = number + page.has_more
+        return page
+
+
+class EstimatedCountPaginator(LazyCountPaginator):
+    @cached_property
+    def count(self):
+        return estimate_count(self.object_list)
+
+
+class KeysetPagination(BasePagination):
+    """Пагинация по ключу (курсору) без OFFSET и COUNT(*).
+
+    Курсор хранит значения полей ordering у последней строки страницы,
+    следующая страница выбирается условием «строго после курсора».
+    Последнее поле ordering должно быть уникальным.
+    """
+
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def __init__(self, ordering, page_size, count_mode=COUNT_NONE):
+        self.ordering = ordering
+        self.page_size = page_size
+        self.count_mode = count_mode
+
+    @staticmethod
+    def parse_ordering(ordering):
+        return [
+            (name.lstrip('-'), name.startswith('-')) for name in ordering
+        ]
+
+    def decode_cursor(self, queryset, encoded):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            fields = self.parse_ordering(self.ordering)
+            if not isinstance(values, list) or len(values) != len(fields):
+                raise ValueError
+            return [
+                queryset.model._meta.get_field(name).to_python(value)
+                for (name, _), value in zip(fields, values)
+            ]
+        except (TypeError, ValueError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, obj):
+        values = []
+        for name, _ in self.parse_ordering(self.ordering):
+            value = getattr(obj, name)
+            values.append(
+                value.isoformat() if hasattr(value, 'isoformat') else value)
+        return base64.urlsafe_b64encode(
+            json.dumps(values).encode()).decode()
+
+    def after_cursor(self, values):
+        condition = Q()
+        equal = Q()
+        for (name, descending), value in zip(
+                self.parse_ordering(self.ordering), values):
+            lookup = 'lt' if descending else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.count = None
+        if self.count_mode == COUNT_EXACT:
+            self.count = queryset.count()
+        elif self.count_mode == COUNT_ESTIMATE:
+            self.count = estimate_count(queryset)
+
+        queryset = queryset.order_by(*self.ordering)
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            queryset = queryset.filter(
+                self.after_cursor(self.decode_cursor(queryset, encoded)))
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.page[-1])
+        )
+
+    def get_paginated_response(self, data):
+        payload = {
+            'next': self.get_next_link(),
+            'previous': None,
+            'results': data,
+        }
+        if self.count_mode != COUNT_NONE:
+            payload = {'count': self.count, **payload}
+        return Response(payload)
 
 
 class RecipePagination(PageNumberPagination):
+    """Постраничная пагинация с опциональным режимом курсора.
+
+    ?pagination=cursor (или наличие ?cursor=) включает KeysetPagination,
+    ?count=estimate|none заменяет точный COUNT(*) оценкой или отключает его.
+    """
+
+    page_size = 6
+    max_page_size = 100
+    page_size_query_param = 'limit'
+    mode_query_param = 'pagination'
+    count_query_param = 'count'
+    keyset_ordering = ('-pub_date', '-id')
+    paginator_classes = {
+        COUNT_EXACT: Paginator,
+        COUNT_ESTIMATE: EstimatedCountPaginator,
+        COUNT_NONE: LazyCountPaginator,
+    }
+    keyset = None
+
+    def get_count_mode(self, request, default):
+        mode = request.query_params.get(self.count_query_param, default)
+        return mode if mode in self.paginator_classes else default
+
+    def uses_keyset(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or KeysetPagination.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.uses_keyset(request):
+            self.keyset = KeysetPagination(
+                ordering=self.keyset_ordering,
+                page_size=self.get_page_size(request),
+                count_mode=self.get_count_mode(request, COUNT_NONE),
+            )
+            return self.keyset.paginate_queryset(queryset, request, view)
+        self.django_paginator_class = self.paginator_classes[
+            self.get_count_mode(request, COUNT_EXACT)]
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class SubscriptionPagination(RecipePagination):
+    keyset_ordering = ('username', 'id')
+
+
+class PantryPagination(PageNumberPagination):
+    """Страницы ранжированного списка из индекса продуктов."""
+
     page_size = 6
     max_page_size = 100
     page_size_query_param = 'limit'
+
+
+class FeedPagination(KeysetPagination):
+    """Курсорная пагинация ленты подписок по ключам (pub_date, id).
+
+    Ключи страницы выдаёт функция get_keys(limit, after), объекты по ним
+    загружает load(ids): так ленту можно слить из нескольких выборок.
+    """
+
+    def __init__(self, page_size):
+        super().__init__(ordering=('-pub_date', '-id'), page_size=page_size)
+
+    def paginate_keys(self, queryset, request, get_keys, load):
+        self.request = request
+        self.count = None
+        encoded = request.query_params.get(self.cursor_query_param)
+        after = self.decode_cursor(queryset, encoded) if encoded else None
+        keys = get_keys(self.page_size + 1, after)
+        self.has_next = len(keys) > self.page_size
+        objects = load([recipe_id for _, recipe_id in keys[:self.page_size]])
+        self.page = [objects[recipe_id]
+                     for _, recipe_id in keys[:self.page_size]
+                     if recipe_id in objects]
+        return self.page
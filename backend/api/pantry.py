@@ -0,0 +1,161 @@
+import time
+from array import array
+from collections import Counter
+from threading import Lock
+
+from django.db import transaction
+
+from food.catalog import get_catalog_cache
+from food.models import RecipeIngredient
+
+PANTRY_VERSION_KEY = 'pantry:version'
+# Сколько изменений процесс догоняет по журналу, а не перестройкой.
+MAX_CHANGES = 1000
+CHANGE_TIMEOUT = 60 * 60
+MAX_PANTRY_INGREDIENTS = 100
+
+
+def change_key(version):
+    return f'pantry:change:{version}'
+
+
+class PantryIndex:
+    """Инвертированный индекс продукт -> рецепты в памяти процесса.
+
+    Списки рецептов хранятся компактными массивами int64; для
+    инкрементальных изменений индекс помнит состав каждого рецепта.
+    """
+
+    def __init__(self, rows=(), version=None):
+        self.version = version
+        self.postings = {}
+        self.recipes = {}
+        ingredients = {}
+        for recipe_id, ingredient_id in rows:
+            ingredients.setdefault(recipe_id, []).append(ingredient_id)
+        for recipe_id, ingredient_ids in ingredients.items():
+            self.add_recipe(recipe_id, ingredient_ids)
+
+    @staticmethod
+    def load_rows(recipe_ids=None):
+        rows = RecipeIngredient.objects.values_list('recipe_id',
+                                                    'ingredient_id')
+        if recipe_ids is not None:
+            rows = rows.filter(recipe_id__in=recipe_ids)
+        return rows.order_by().iterator(chunk_size=10000)
+
+    @classmethod
+    def from_db(cls):
+        return cls(cls.load_rows(), version=get_pantry_version())
+
+    def add_recipe(self, recipe_id, ingredient_ids):
+        ingredient_ids = tuple(set(ingredient_ids))
+        self.recipes[recipe_id] = ingredient_ids
+        for ingredient_id in ingredient_ids:
+            posting = self.postings.get(ingredient_id)
+            if posting is None:
+                posting = self.postings[ingredient_id] = array('q')
+            posting.append(recipe_id)
+
+    def remove_recipe(self, recipe_id):
+        for ingredient_id in self.recipes.pop(recipe_id, ()):
+            self.postings[ingredient_id].remove(recipe_id)
+
+    def reload(self, recipe_ids):
+        """Перечитывает состав рецептов из БД (удалённые — убирает)."""
+        ingredients = dict.fromkeys(recipe_ids, ())
+        for recipe_id, ingredient_id in self.load_rows(recipe_ids):
+            ingredients[recipe_id] += (ingredient_id,)
+        for recipe_id, ingredient_ids in ingredients.items():
+            self.remove_recipe(recipe_id)
+            if ingredient_ids:
+                self.add_recipe(recipe_id, ingredient_ids)
+
+    def search(self, ingredient_ids, missing=None):
+        """Рецепты, в которых есть хотя бы один из продуктов, по убыванию
+        доли имеющихся продуктов: список (id, есть, всего).
+
+        missing ограничивает число недостающих продуктов.
+        """
+        matched = Counter()
+        for ingredient_id in set(ingredient_ids):
+            matched.update(self.postings.get(ingredient_id, ()))
+        found = []
+        for recipe_id, count in matched.items():
+            # Рецепт мог исчезнуть при синхронизации в другом потоке.
+            total = len(self.recipes.get(recipe_id) or ())
+            if total and (missing is None or total - count <= missing):
+                found.append((recipe_id, min(count, total), total))
+        found.sort(key=lambda item: (-item[1] / item[2],
+                                     item[2] - item[1], -item[0]))
+        return found
+
+
+def get_pantry_version():
+    cache = get_catalog_cache()
+    version = cache.get(PANTRY_VERSION_KEY)
+    if version is None:
+        cache.add(PANTRY_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(PANTRY_VERSION_KEY)
+    return version
+
+
+def bump_pantry_version():
+    cache = get_catalog_cache()
+    try:
+        return cache.incr(PANTRY_VERSION_KEY)
+    except ValueError:
+        # Ключ вытеснен: новая версия без журнала, все перестраиваются.
+        cache.set(PANTRY_VERSION_KEY, time.time_ns(), timeout=None)
+        return None
+
+
+_index = None
+_index_lock = Lock()
+
+
+def sync(index, version):
+    """Догоняет версию по журналу изменений; False — нужна перестройка."""
+    if version < index.version or version - index.version > MAX_CHANGES:
+        return False
+    keys = [change_key(number)
+            for number in range(index.version + 1, version + 1)]
+    changes = get_catalog_cache().get_many(keys)
+    if len(changes) != len(keys):
+        return False
+    index.reload(set(changes.values()))
+    index.version = version
+    return True
+
+
+def get_index():
+    """Индекс, догнавший текущую версию (см. recipe_changed)."""
+    global _index
+    version = get_pantry_version()
+    index = _index
+    if index is None or index.version != version:
+        with _index_lock:
+            if _index is None or not (_index.version == version
+                                      or sync(_index, version)):
+                _index = PantryIndex.from_db()
+            index = _index
+    return index
+
+
+def invalidate_index():
+    global _index
+    _index = None
+
+
+def recipe_changed(recipe_id):
+    """Отмечает изменение состава рецепта после коммита транзакции.
+
+    Номер версии и id рецепта попадают в журнал в кэше, по которому
+    индексы всех процессов обновляются без полной перестройки.
+    """
+    def publish():
+        version = bump_pantry_version()
+        if version is not None:
+            get_catalog_cache().set(change_key(version), recipe_id,
+                                    CHANGE_TIMEOUT)
+    transaction.on_commit(publish)
@@ -0,0 +1,87 @@
+import json
+import re
+
+from django.db import connections
+
+from food.models import (Favorite, Follow, Recipe, RecipeIngredient,
+                         ShoppingCartItem, User)
+
+# Таблицы, которые растут вместе с числом пользователей и рецептов.
+LARGE_TABLES = frozenset(model._meta.db_table for model in (
+    Recipe, Recipe.tags.through, RecipeIngredient,
+    Favorite, ShoppingCartItem, Follow, User,
+))
+
+SQLITE_SCAN = re.compile(r'^SCAN (\w+)(?: AS (\w+))?( USING .*INDEX .*)?$')
+SQL_ALIAS = re.compile(r'"(\w+)" (\w+)\b')
+INDEX_SCANS = frozenset(('Index Scan', 'Index Only Scan'))
+
+
+def sqlite_full_scans(cursor, sql):
+    """«SCAN таблица» — чтение таблицы целиком; «SCAN ... USING INDEX»
+    тоже, если сортировку всё равно делает временное B-дерево."""
+    aliases = dict(
+        (alias, table) for table, alias in SQL_ALIAS.findall(sql)
+    )
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+    details = [row[-1] for row in cursor.fetchall()]
+    sorts = 'USE TEMP B-TREE FOR ORDER BY' in details
+    scans = []
+    for detail in details:
+        match = SQLITE_SCAN.match(detail)
+        if match and (not match[3] or sorts):
+            scans.append(aliases.get(match[1], match[1]))
+    return scans
+
+
+def postgresql_full_scans(cursor, sql):
+    # Настройки планировщика не трогаем: запрет Seq Scan спрятал бы как
+    # раз те полные чтения, которые ищет проверка. Поэтому таблицы должны
+    # быть реалистичного размера и со статистикой (analyze).
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    scans = []
+    nodes = [(plan[0]['Plan'], False)]
+    while nodes:
+        node, sorted_above = nodes.pop()
+        node_type = node['Node Type']
+        # Обход индекса без условия под Sort — та же полная выборка.
+        if node_type == 'Seq Scan' or (
+                node_type in INDEX_SCANS and sorted_above
+                and 'Index Cond' not in node):
+            scans.append(node['Relation Name'])
+        nodes.extend(
+            (child, sorted_above or node_type in ('Sort', 'Incremental Sort'))
+            for child in node.get('Plans', ())
+        )
+    return scans
+
+
+def analyze(using='default'):
+    """Обновляет статистику больших таблиц для планировщика PostgreSQL."""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for table in sorted(LARGE_TABLES):
+            cursor.execute(f'ANALYZE {connection.ops.quote_name(table)}')
+
+
+def full_scans(sql, using='default'):
+    """Большие таблицы, которые план запроса sql читает целиком.
+
+    Подсчёт строк для пагинации (обход индекса без сортировки) полной
+    выборкой не считается: его стоимость регулирует ?count=.
+
+    На PostgreSQL план зависит от размера таблиц: проверять стоит на
+    данных реалистичного объёма после analyze. На SQLite план от
+    статистики не зависит, и проверяется, что чтение идёт по индексу.
+    """
+    connection = connections[using]
+    explain = (postgresql_full_scans if connection.vendor == 'postgresql'
+               else sqlite_full_scans)
+    with connection.cursor() as cursor:
+        return sorted(
+            table for table in explain(cursor, sql) if table in LARGE_TABLES)
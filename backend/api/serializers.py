@@ -4,13 +4,31 @@ from django.contrib.auth import get_user_model
 from djoser.serializers import UserSerializer as DjoserUserSerializer
 from rest_framework import serializers
 
-from food.constants import INGREDIENT_MIN_AMOUNT, RECIPE_MIN_COOKING_TIME
+from api.autocomplete import resolve_ingredients
+from api.fields import BulkListSerializer, BulkPrimaryKeyRelatedField
+from api.pantry import recipe_changed
+from food.catalog import resolve_tags
+from food.constants import (BULK_RECIPES_MAX, INGREDIENT_MIN_AMOUNT,
+                            RECIPE_MIN_COOKING_TIME, RECIPES_LIMIT_MAX)
 from food.models import (Favorite, Follow, Ingredient, Recipe,
                          RecipeIngredient, ShoppingCartItem, Tag)
 from library.base64ImageField import Base64ImageField
+from library.images import variant_urls
 
 User = get_user_model()
 
+RECIPE_IMAGE_VARIANTS = ('card', 'thumbnail')
+
+
+def get_recipes_limit(request):
+    """Значение recipes_limit из запроса, ограниченное RECIPES_LIMIT_MAX."""
+    try:
+        limit = int(request.query_params.get(
+            'recipes_limit', RECIPES_LIMIT_MAX))
+    except ValueError:
+        return RECIPES_LIMIT_MAX
+    return max(0, min(limit, RECIPES_LIMIT_MAX))
+
 
 class FoodgramUserSerializer(DjoserUserSerializer):
     avatar = Base64ImageField(required=False, allow_null=True)
@@ -22,6 +40,9 @@ class FoodgramUserSerializer(DjoserUserSerializer):
         read_only_fields = fields
 
     def get_is_subscribed(self, author):
+        # Значение может быть заранее вычислено аннотацией в queryset.
+        if hasattr(author, 'is_subscribed'):
+            return author.is_subscribed
         request = self.context.get('request')
         return (
             request
@@ -56,8 +77,10 @@ class RecipeIngredientReadSerializer(serializers.ModelSerializer):
 
 
 class RecipeIngredientWriteSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
+    # Продукты всего списка — одним запросом или из индекса в памяти.
+    id = BulkPrimaryKeyRelatedField(
         queryset=Ingredient.objects.all(),
+        resolve=resolve_ingredients,
         source='ingredient'
     )
     amount = serializers.IntegerField(
@@ -67,6 +90,7 @@ class RecipeIngredientWriteSerializer(serializers.ModelSerializer):
     class Meta:
         model = RecipeIngredient
         fields = ('id', 'amount')
+        list_serializer_class = BulkListSerializer
 
 
 class RecipeReadSerializer(serializers.ModelSerializer):
@@ -80,14 +104,24 @@ class RecipeReadSerializer(serializers.ModelSerializer):
 
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
                   'is_in_shopping_cart', 'name',
-                  'image', 'text', 'cooking_time')
+                  'image', 'image_variants', 'text', 'cooking_time')
         read_only_fields = fields
 
+    def get_image_variants(self, recipe):
+        return variant_urls(recipe.image, RECIPE_IMAGE_VARIANTS,
+                            self.context.get('request'))
+
+    def to_representation(self, recipe):
+        if hasattr(recipe, 'is_author_subscribed'):
+            recipe.author.is_subscribed = recipe.is_author_subscribed
+        return super().to_representation(recipe)
+
     def check_user_status(self, recipe, model_class):
         request = self.context.get('request')
         return (
@@ -98,9 +132,13 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         )
 
     def get_is_favorited(self, recipe):
+        if hasattr(recipe, 'is_favorited'):
+            return recipe.is_favorited
         return self.check_user_status(recipe, Favorite)
 
     def get_is_in_shopping_cart(self, recipe):
+        if hasattr(recipe, 'is_in_shopping_cart'):
+            return recipe.is_in_shopping_cart
         return self.check_user_status(recipe, ShoppingCartItem)
 
 
@@ -110,8 +148,9 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         required=True,
         label='Ингредиенты',
     )
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = BulkPrimaryKeyRelatedField(
         queryset=Tag.objects.all(),
+        resolve=resolve_tags,
         many=True,
         required=True,
         label='Теги',
@@ -155,34 +194,89 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         validated_data['author'] = self.context['request'].user
         recipe = super().create(validated_data)
 
-        recipe.tags.set(tags)
+        # У нового рецепта тегов нет: set() лишь перечитал бы их.
+        recipe.tags.add(*tags)
         self.create_ingredients(ingredients, recipe)
+        recipe_changed(recipe.pk)
 
         return recipe
 
-    def update(self, instance, validated_data):
-        ingredients_data = validated_data.pop('ingredients', [])
-        tags_data = validated_data.pop('tags', [])
+    def update_ingredients(self, recipe, ingredients):
+        """Приводит состав рецепта к ingredients, затрагивая только
+        отличающиеся строки; True — изменился набор продуктов."""
+        amounts = {item['ingredient'].id: item['amount']
+                   for item in ingredients}
+        existing = {row.ingredient_id: row
+                    for row in recipe.ingredients_in_recipe.all()}
+        removed = [row.pk for ingredient_id, row in existing.items()
+                   if ingredient_id not in amounts]
+        changed = []
+        for ingredient_id, row in existing.items():
+            amount = amounts.get(ingredient_id, row.amount)
+            if amount != row.amount:
+                row.amount = amount
+                changed.append(row)
+        added = [ingredient_id for ingredient_id in amounts
+                 if ingredient_id not in existing]
+        if removed:
+            RecipeIngredient.objects.filter(pk__in=removed).delete()
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        if added:
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id,
+                                 amount=amounts[ingredient_id])
+                for ingredient_id in added
+            )
+        return bool(removed or added)
+
+    def update_tags(self, recipe, tags):
+        """Как tags.set, но сообщает, изменился ли набор тегов."""
+        tag_ids = {tag.id for tag in tags}
+        existing = set(recipe.tags.values_list('id', flat=True))
+        if existing - tag_ids:
+            recipe.tags.remove(*existing - tag_ids)
+        if tag_ids - existing:
+            recipe.tags.add(*tag_ids - existing)
+        return tag_ids != existing
 
-        instance.tags.set(tags_data)
-        instance.ingredients_in_recipe.all().delete()
-        self.create_ingredients(ingredients_data, instance)
-        return super().update(instance, validated_data)
+    def update(self, instance, validated_data):
+        ingredients = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
+
+        # Пересохраняются только изменившиеся строки и столбцы:
+        # правка одного количества — один UPDATE.
+        fields = [name for name, value in validated_data.items()
+                  if getattr(instance, name) != value]
+        for name in fields:
+            setattr(instance, name, validated_data[name])
+        ingredients_changed = (ingredients is not None
+                               and self.update_ingredients(instance,
+                                                           ingredients))
+        tags_changed = tags is not None and self.update_tags(instance, tags)
+        if ingredients_changed:
+            recipe_changed(instance.pk)
+        # Похожие рецепты зависят только от набора продуктов и тегов.
+        if ingredients_changed or tags_changed:
+            instance.similar_stale = True
+            fields.append('similar_stale')
+        if fields:
+            instance.save(update_fields=fields)
+        return instance
 
     def validate_ingredients(self, ingredients):
         if not ingredients:
             raise serializers.ValidationError(
                 'Необходимо указать хотя бы один ингредиент.')
-        duplicate_ids = {
-            id_ for id_, count in
-            Counter(item['ingredient'].id for item in ingredients).items()
+        duplicates = [
+            ingredient for ingredient, count in
+            Counter(item['ingredient'] for item in ingredients).items()
             if count > 1
-        }
-        if not duplicate_ids:
+        ]
+        if not duplicates:
             return ingredients
 
-        names = Ingredient.objects.filter(
-            id__in=duplicate_ids).values_list('name', flat=True)
+        names = ', '.join(ingredient.name for ingredient in duplicates)
 
         raise serializers.ValidationError(
             f'Ингредиенты не должны повторяться: {names}.')
@@ -192,16 +286,13 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 'Нужно выбрать хотя бы один тег.')
 
-        duplicate_ids = {
-            id_ for id_, count in
-            Counter(getattr(tag, 'id') for tag in tags).items()
-            if count > 1
-        }
-        if not duplicate_ids:
+        duplicates = [
+            tag for tag, count in Counter(tags).items() if count > 1
+        ]
+        if not duplicates:
             return tags
 
-        names = (Tag.objects.filter(id__in=duplicate_ids)
-                 .values_list('name', flat=True))
+        names = ', '.join(tag.name for tag in duplicates)
         raise serializers.ValidationError(
             f'Теги не должны повторяться: {names}.'
         )
@@ -221,16 +312,45 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
 
 
 class ShortRecipeSerializer(serializers.ModelSerializer):
+    image_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
         read_only_fields = fields
 
+    def get_image_variants(self, recipe):
+        return variant_urls(recipe.image, RECIPE_IMAGE_VARIANTS,
+                            self.context.get('request'))
+
+
+class SimilarRecipeSerializer(ShortRecipeSerializer):
+    score = serializers.FloatField(read_only=True)
+
+    class Meta(ShortRecipeSerializer.Meta):
+        fields = (*ShortRecipeSerializer.Meta.fields, 'score')
+        read_only_fields = fields
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетных операций с корзиной и избранным."""
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BULK_RECIPES_MAX,
+    )
+
+    def validate_recipes(self, recipe_ids):
+        return list(dict.fromkeys(recipe_ids))
+
 
 class UserSerializer(DjoserUserSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
     def get_is_subscribed(self, followed_user):
+        if hasattr(followed_user, 'is_subscribed'):
+            return followed_user.is_subscribed
         user = self.context['request'].user
         return user.is_authenticated and Follow.objects.filter(
             follower=user, author=followed_user
@@ -245,10 +365,7 @@ class UserSerializer(DjoserUserSerializer):
 
 class FollowedUserSerializer(UserSerializer):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.IntegerField(
-        source='recipes.count',
-        read_only=True
-    )
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
@@ -257,11 +374,13 @@ class FollowedUserSerializer(UserSerializer):
         read_only_fields = fields
 
     def get_recipes(self, obj):
+        # recent_recipes заранее загружает UserWithSubscriptionViewSet.
+        recipes = getattr(obj, 'recent_recipes', None)
+        if recipes is None:
+            recipes = obj.recipes.all()[
+                :get_recipes_limit(self.context['request'])]
         return ShortRecipeSerializer(
-            obj.recipes.all()[
-                :int(self.context['request'].
-                     GET.get('recipes_limit', 10 ** 10))
-            ],
+            recipes,
             many=True,
             context=self.context
         ).data
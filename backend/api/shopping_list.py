@@ -0,0 +1,138 @@
+import csv
+import hashlib
+import io
+import json
+
+from django.conf import settings
+from django.db.models import Sum
+from django.utils.timezone import now
+
+from food.models import Recipe, RecipeIngredient
+
+PDF_CHUNK_SIZE = 64 * 1024
+
+
+class ShoppingList:
+    """Данные списка покупок пользователя: два запроса на весь список."""
+
+    def __init__(self, user):
+        self.user = user
+        self.date = now().date()
+        self.ingredients = list(
+            RecipeIngredient.objects.filter(
+                recipe__shoppingcartitems__user=user
+            ).values(
+                'ingredient__name', 'ingredient__measurement_unit'
+            ).annotate(
+                total_amount=Sum('amount')
+            ).order_by('ingredient__name')
+        )
+        self.recipes = list(
+            Recipe.objects.filter(
+                shoppingcartitems__user=user
+            ).values_list('name', 'author__username').order_by('name')
+        )
+
+    @property
+    def owner(self):
+        return self.user.get_full_name() or self.user.username
+
+    def etag(self, file_format):
+        content = json.dumps(
+            [file_format, str(self.date), self.owner,
+             self.ingredients, self.recipes],
+            ensure_ascii=False, default=str
+        )
+        return hashlib.sha256(content.encode()).hexdigest()
+
+
+class Echo:
+    """Псевдо-файл для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def render_txt(shopping_list):
+    yield (f'Список покупок для {shopping_list.owner}\n'
+           f'Дата: {shopping_list.date}\n\n'
+           '🛒 Ингредиенты:\n')
+    for number, item in enumerate(shopping_list.ingredients, start=1):
+        name = item['ingredient__name']
+        yield (f'{number}. {name[:1].upper()}{name[1:]} '
+               f'({item["ingredient__measurement_unit"]}) — '
+               f'{item["total_amount"]}\n')
+    yield '\n📖 Рецепты:\n'
+    for name, username in shopping_list.recipes:
+        yield f'• {name} — @{username}\n'
+
+
+def render_csv(shopping_list):
+    writer = csv.writer(Echo())
+    yield writer.writerow(['№', 'Продукт', 'Единица измерения', 'Количество'])
+    for number, item in enumerate(shopping_list.ingredients, start=1):
+        yield writer.writerow([
+            number,
+            item['ingredient__name'],
+            item['ingredient__measurement_unit'],
+            item['total_amount'],
+        ])
+
+
+class ShoppingListError(Exception):
+    pass
+
+
+def get_pdf_font():
+    """Регистрирует шрифт для PDF (один раз на процесс); возвращает его имя.
+    """
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFError, TTFont
+
+    font = 'ShoppingListFont'
+    if font not in pdfmetrics.getRegisteredFontNames():
+        try:
+            pdfmetrics.registerFont(
+                TTFont(font, settings.SHOPPING_LIST_PDF_FONT))
+        except (OSError, TTFError) as error:
+            raise ShoppingListError(
+                f'Не удалось загрузить шрифт для PDF: {error}')
+    return font
+
+
+def render_pdf(shopping_list):
+    """Строит PDF сразу, а не при отдаче ответа: ошибка (например,
+    шрифта) должна стать ответом с ошибкой, а не оборванным файлом после
+    уже отправленного статуса 200.
+
+    PDF пишется целиком (таблица ссылок в конце файла), поэтому в ответ
+    отдаётся уже готовый документ кусками.
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    font = get_pdf_font()
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    top = height - 50
+    text = pdf.beginText(40, top)
+    text.setFont(font, 12)
+    for line in ''.join(render_txt(shopping_list)).splitlines():
+        if text.getY() < 50:
+            pdf.drawText(text)
+            pdf.showPage()
+            text = pdf.beginText(40, top)
+            text.setFont(font, 12)
+        text.textLine(line.replace('🛒 ', '').replace('📖 ', ''))
+    pdf.drawText(text)
+    pdf.save()
+    buffer.seek(0)
+    return iter(lambda: buffer.read(PDF_CHUNK_SIZE), b'')
+
+
+FORMATS = {
+    'txt': (render_txt, 'text/plain; charset=utf-8'),
+    'csv': (render_csv, 'text/csv; charset=utf-8'),
+    'pdf': (render_pdf, 'application/pdf'),
+}
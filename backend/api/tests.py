@@ -0,0 +1,1487 @@
+import base64
+import io
+import json
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.db.models import F
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework import status
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.test import APIClient, APITestCase
+from rest_framework.views import APIView
+
+from api.autocomplete import invalidate_index, search_ingredients
+from api.benchmarks import CASES
+from api.metrics import registry
+from api.pantry import PantryIndex
+from api.pantry import get_index as get_pantry_index
+from api.pantry import invalidate_index as invalidate_pantry_index
+from api.query_plans import analyze, full_scans
+from api.views import RecipeViewSet
+from food.catalog import (CATALOG_VERSION_KEY, get_catalog_cache,
+                          get_catalog_version, get_tags)
+from food.constants import BULK_RECIPES_MAX
+from food.counters import COUNTERS, recount
+from food.models import (CatalogVersion, Favorite, Follow, Ingredient, Recipe,
+                         RecipeIngredient, ShoppingCartItem, Tag,
+                         TimelineEntry)
+from library.images import FORMATS, get_executor, has_variants, variant_name
+
+User = get_user_model()
+
+RECIPES_URL = '/api/recipes/'
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+
+original_dispatch = APIView.dispatch
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def budgeted_dispatch(view, request, *args, **kwargs):
+    with CaptureQueriesContext(connection) as context:
+        response = original_dispatch(view, request, *args, **kwargs)
+    budget = getattr(view, 'query_budget', {}).get(
+        getattr(view, 'action', None))
+    if budget is not None and len(context) > budget:
+        raise QueryBudgetExceeded(
+            f'{type(view).__name__}.{view.action}: {len(context)} '
+            f'SQL-запросов при бюджете {budget}:\n'
+            + '\n'.join(query['sql'] for query in context.captured_queries)
+        )
+    return response
+
+
+def enforce_query_budgets(test):
+    """Проверяет, что API-вьюхи укладываются в свой query_budget."""
+    return mock.patch.object(APIView, 'dispatch', budgeted_dispatch)(test)
+
+
+def make_image(size=(2, 2)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'red').save(buffer, format='PNG')
+    return ('data:image/png;base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
+
+
+class RecipeDataMixin:
+    recipes_total = 30
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Тестовый', password='pass'
+        )
+        cls.authors = [
+            User.objects.create_user(
+                username=f'author{index}',
+                email=f'author{index}@example.com',
+                first_name='Автор', last_name=str(index), password='pass'
+            )
+            for index in range(3)
+        ]
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {index}', slug=f'tag{index}')
+            for index in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Продукт {index}',
+                                      measurement_unit='г')
+            for index in range(5)
+        ]
+        cls.recipes = []
+        for index in range(cls.recipes_total):
+            recipe = Recipe.objects.create(
+                author=cls.authors[index % len(cls.authors)],
+                name=f'Рецепт {index}',
+                text='Описание',
+                image='recipes/test.png',
+                cooking_time=10 + index,
+            )
+            recipe.tags.set(cls.tags[:index % len(cls.tags) + 1])
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=index + 1)
+                for ingredient in cls.ingredients[:index % 4 + 1]
+            )
+            cls.recipes.append(recipe)
+        Favorite.objects.create(user=cls.user, recipe=cls.recipes[0])
+        ShoppingCartItem.objects.create(user=cls.user, recipe=cls.recipes[1])
+        Follow.objects.create(follower=cls.user, author=cls.authors[0])
+        for model in COUNTERS:
+            list(recount(model))
+
+
+@enforce_query_budgets
+class RecipeListQueriesTest(RecipeDataMixin, APITestCase):
+    # COUNT(*), страница рецептов, prefetch тегов и продуктов в рецептах.
+    list_queries = 4
+
+    def count_list_queries(self, limit):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(RECIPES_URL, {'limit': limit})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), limit)
+        return len(context.captured_queries)
+
+    def test_list_queries_do_not_depend_on_page_size(self):
+        for authenticated in (False, True):
+            with self.subTest(authenticated=authenticated):
+                if authenticated:
+                    self.client.force_authenticate(self.user)
+                self.assertEqual(self.count_list_queries(3),
+                                 self.list_queries)
+                self.assertEqual(
+                    self.count_list_queries(self.recipes_total),
+                    self.list_queries
+                )
+
+    def test_user_flags(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(RECIPES_URL,
+                                   {'limit': self.recipes_total})
+        results = {item['id']: item for item in response.data['results']}
+        for recipe in self.recipes:
+            item = results[recipe.id]
+            self.assertEqual(item['is_favorited'],
+                             recipe == self.recipes[0])
+            self.assertEqual(item['is_in_shopping_cart'],
+                             recipe == self.recipes[1])
+            self.assertEqual(item['author']['is_subscribed'],
+                             recipe.author == self.authors[0])
+
+    def test_anonymous_flags(self):
+        response = self.client.get(RECIPES_URL)
+        for item in response.data['results']:
+            self.assertIs(item['is_favorited'], False)
+            self.assertIs(item['is_in_shopping_cart'], False)
+            self.assertIs(item['author']['is_subscribed'], False)
+
+    def test_detail_flags(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(f'{RECIPES_URL}{self.recipes[0].id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIs(response.data['is_favorited'], True)
+        self.assertIs(response.data['is_in_shopping_cart'], False)
+        self.assertIs(response.data['author']['is_subscribed'], True)
+
+
+@enforce_query_budgets
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, IMAGE_VARIANTS_SYNC=True)
+class RecipeWriteQueriesTest(RecipeDataMixin, APITestCase):
+    recipes_total = 3
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def payload(self, ingredients=2):
+        return {
+            'name': 'Новый рецепт',
+            'text': 'Описание',
+            'cooking_time': 5,
+            'image': make_image(),
+            'tags': [tag.id for tag in self.tags[:2]],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': 10}
+                for ingredient in self.ingredients[:ingredients]
+            ],
+        }
+
+    def test_create_response(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post(RECIPES_URL, self.payload(),
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['ingredients']), 2)
+        self.assertEqual(len(response.data['tags']), 2)
+        self.assertIs(response.data['is_favorited'], False)
+        self.assertIs(response.data['author']['is_subscribed'], False)
+
+    def test_update_response(self):
+        recipe = self.recipes[0]
+        self.client.force_authenticate(recipe.author)
+        response = self.client.patch(f'{RECIPES_URL}{recipe.id}/',
+                                     self.payload(ingredients=3),
+                                     format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['ingredients']), 3)
+        self.assertEqual(response.data['name'], 'Новый рецепт')
+
+    def test_validation_resolves_ids_in_bulk(self):
+        self.client.force_authenticate(self.user)
+        payload = self.payload(ingredients=5)
+        payload['tags'] = [tag.id for tag in self.tags]
+        for in_memory in (False, True):
+            with self.subTest(in_memory=in_memory):
+                invalidate_index()
+                # Теги всегда из кэша справочников, продукты — из индекса
+                # поиска, если он построен, иначе одним запросом.
+                get_tags()
+                if in_memory:
+                    search_ingredients('Продукт')
+                with CaptureQueriesContext(connection) as context:
+                    response = self.client.post(RECIPES_URL, payload,
+                                                format='json')
+                self.assertEqual(response.status_code,
+                                 status.HTTP_201_CREATED)
+                lookups = [
+                    query['sql'] for query in context.captured_queries
+                    if query['sql'].startswith(('SELECT "food_ingredient"',
+                                                'SELECT "food_tag"'))
+                ]
+                self.assertEqual(len(lookups), 0 if in_memory else 1)
+
+    def test_missing_ids_errors(self):
+        self.client.force_authenticate(self.user)
+        message = PrimaryKeyRelatedField.default_error_messages[
+            'does_not_exist'].format(pk_value=10 ** 6)
+        payload = self.payload()
+        payload['ingredients'][1]['id'] = 10 ** 6
+        payload['tags'].append(10 ** 6)
+        response = self.client.post(RECIPES_URL, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['ingredients'],
+                         [{}, {'id': [message]}])
+        self.assertEqual(response.data['tags'], [message])
+        payload = self.payload()
+        payload['tags'] = ['первый']
+        response = self.client.post(RECIPES_URL, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['tags'][0].code, 'incorrect_type')
+        # true не должен совпасть с тегом id=1.
+        payload['tags'] = [True]
+        response = self.client.post(RECIPES_URL, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['tags'][0].code, 'incorrect_type')
+
+    def test_ids_added_after_cache_built(self):
+        self.client.force_authenticate(self.user)
+        get_tags()
+        search_ingredients('Продукт')
+        # bulk_create не шлёт сигналов: кэш справочников отстаёт от базы.
+        tag = Tag.objects.bulk_create([Tag(name='Новый', slug='new')])[0]
+        ingredient = Ingredient.objects.bulk_create(
+            [Ingredient(name='Новый продукт', measurement_unit='г')])[0]
+        payload = self.payload()
+        payload['tags'] = [Tag.objects.get(slug='new').id]
+        payload['ingredients'].append({
+            'id': Ingredient.objects.get(name=ingredient.name).id,
+            'amount': 1})
+        response = self.client.post(RECIPES_URL, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([item['slug'] for item in response.data['tags']],
+                         [tag.slug])
+
+    def test_ids_deleted_after_validation(self):
+        self.client.force_authenticate(self.user)
+        with mock.patch.object(RecipeIngredient.objects, 'bulk_create',
+                               side_effect=IntegrityError):
+            response = self.client.post(RECIPES_URL, self.payload(),
+                                        format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_update_writes_only_diff(self):
+        # Рецепт 1: теги 0–1, продукты 0–1 по 2 г.
+        recipe = self.recipes[1]
+        row_ids = set(recipe.ingredients_in_recipe.values_list('id',
+                                                               flat=True))
+        self.client.force_authenticate(recipe.author)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(f'{RECIPES_URL}{recipe.id}/', {
+                'name': recipe.name, 'text': recipe.text,
+                'cooking_time': recipe.cooking_time,
+                'tags': [tag.id for tag in self.tags[:2]],
+                'ingredients': [{'id': self.ingredients[0].id, 'amount': 2},
+                                {'id': self.ingredients[1].id, 'amount': 7}],
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        writes = [query['sql'] for query in context.captured_queries
+                  if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0].startswith('UPDATE "food_recipeingredient"'))
+        self.assertEqual(
+            set(recipe.ingredients_in_recipe.values_list('id', flat=True)),
+            row_ids)
+        self.assertEqual(
+            [item['amount'] for item in response.data['ingredients']], [2, 7])
+
+    def test_update_replaces_changed_rows(self):
+        recipe = self.recipes[1]
+        self.client.force_authenticate(recipe.author)
+        response = self.client.patch(f'{RECIPES_URL}{recipe.id}/', {
+            'cooking_time': 20,
+            'tags': [self.tags[2].id],
+            'ingredients': [{'id': self.ingredients[1].id, 'amount': 2},
+                            {'id': self.ingredients[3].id, 'amount': 4}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.cooking_time, 20)
+        self.assertTrue(recipe.similar_stale)
+        self.assertEqual(list(recipe.tags.values_list('id', flat=True)),
+                         [self.tags[2].id])
+        self.assertEqual(
+            sorted(recipe.ingredients_in_recipe.values_list(
+                'ingredient_id', 'amount')),
+            [(self.ingredients[1].id, 2), (self.ingredients[3].id, 4)])
+
+
+class QueryBudgetTest(RecipeDataMixin, APITestCase):
+    recipes_total = 3
+
+    def test_budget_overrun_fails(self):
+        with mock.patch.dict(RecipeViewSet.query_budget, {'list': 1}):
+            with self.assertRaises(QueryBudgetExceeded), \
+                    self.assertLogs('django.request', 'ERROR'):
+                enforce_query_budgets(
+                    lambda: self.client.get(RECIPES_URL))()
+
+
+class RecipePaginationTest(RecipeDataMixin, APITestCase):
+    recipes_total = 10
+
+    def collect(self, params):
+        ids = []
+        url = RECIPES_URL
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(item['id'] for item in response.data['results'])
+            url, params = response.data['next'], None
+        return ids, response
+
+    def test_cursor_walks_same_order_as_pages(self):
+        # Одинаковые даты проверяют досортировку по id.
+        Recipe.objects.filter(id__in=[recipe.id for recipe in
+                                      self.recipes[:5]]).update(
+            pub_date=self.recipes[0].pub_date)
+        page_ids, _ = self.collect({'limit': 3})
+        cursor_ids, response = self.collect(
+            {'limit': 3, 'pagination': 'cursor'})
+        self.assertEqual(cursor_ids, page_ids)
+        self.assertEqual(len(set(cursor_ids)), self.recipes_total)
+        self.assertNotIn('count', response.data)
+
+    def test_cursor_with_exact_count(self):
+        response = self.client.get(
+            RECIPES_URL, {'pagination': 'cursor', 'count': 'exact'})
+        self.assertEqual(response.data['count'], self.recipes_total)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(RECIPES_URL, {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_pages_without_count(self):
+        ids, response = self.collect({'limit': 4, 'count': 'none'})
+        self.assertEqual(len(ids), self.recipes_total)
+        self.assertIsNone(response.data['count'])
+
+    def test_estimated_count(self):
+        response = self.client.get(RECIPES_URL, {'count': 'estimate'})
+        self.assertEqual(response.data['count'], self.recipes_total)
+
+    def test_subscriptions_cursor(self):
+        for author in self.authors[1:]:
+            Follow.objects.create(follower=self.user, author=author)
+        self.client.force_authenticate(self.user)
+        url, params, usernames = ('/api/users/subscriptions/',
+                                  {'limit': 2, 'pagination': 'cursor'}, [])
+        while url:
+            response = self.client.get(url, params)
+            usernames.extend(item['username']
+                             for item in response.data['results'])
+            url, params = response.data['next'], None
+        self.assertEqual(usernames,
+                         sorted(author.username for author in self.authors))
+
+
+class RecipeFilterTest(RecipeDataMixin, APITestCase):
+    recipes_total = 9
+
+    def filtered_ids(self, params):
+        response = self.client.get(RECIPES_URL, {**params, 'limit': 100})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = [item['id'] for item in response.data['results']]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(response.data['count'], len(ids))
+        return set(ids)
+
+    def test_tags_match_join_with_distinct(self):
+        for slugs in (['tag0'], ['tag1', 'tag2'], ['tag0', 'tag1', 'tag2']):
+            with self.subTest(slugs=slugs):
+                self.assertEqual(
+                    self.filtered_ids({'tags': slugs}),
+                    set(Recipe.objects.filter(
+                        tags__slug__in=slugs
+                    ).distinct().values_list('id', flat=True))
+                )
+
+    def test_user_relations_with_tags(self):
+        self.client.force_authenticate(self.user)
+        for recipe in self.recipes[:6]:
+            Favorite.objects.get_or_create(user=self.user, recipe=recipe)
+        ShoppingCartItem.objects.create(user=self.user,
+                                        recipe=self.recipes[4])
+        self.assertEqual(
+            self.filtered_ids({'is_favorited': 1, 'tags': ['tag1', 'tag2']}),
+            set(Recipe.objects.filter(
+                favorites__user=self.user, tags__slug__in=['tag1', 'tag2']
+            ).distinct().values_list('id', flat=True))
+        )
+        self.assertEqual(
+            self.filtered_ids({'is_favorited': 1, 'is_in_shopping_cart': 1}),
+            {self.recipes[1].id, self.recipes[4].id}
+        )
+
+    def test_no_distinct_and_cached_tags(self):
+        self.client.get(RECIPES_URL, {'tags': ['tag0', 'tag1']})
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(RECIPES_URL, {'tags': ['tag0', 'tag1']})
+        sql = ' '.join(query['sql'] for query in context.captured_queries)
+        self.assertNotIn('DISTINCT', sql)
+        self.assertNotIn('FROM "food_tag" WHERE', sql)
+
+    def test_unknown_tag(self):
+        response = self.client.get(RECIPES_URL, {'tags': ['missing']})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_popular_ordering(self):
+        # Уже есть: recipes[0] в избранном, recipes[1] в корзине.
+        for recipe in self.recipes[2:5]:
+            Favorite.objects.create(user=self.user, recipe=recipe)
+        ShoppingCartItem.objects.create(user=self.user,
+                                        recipe=self.recipes[2])
+        call_command('refresh_popularity', stdout=io.StringIO())
+        response = self.client.get(RECIPES_URL, {'ordering': 'popular',
+                                                 'limit': 100})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = [item['id'] for item in response.data['results']]
+        self.assertEqual(ids[0], self.recipes[2].id)
+        self.assertEqual(set(ids[1:4]), {
+            self.recipes[0].id, self.recipes[3].id, self.recipes[4].id})
+        self.assertEqual(ids[4], self.recipes[1].id)
+        self.assertEqual(len(ids), self.recipes_total)
+        response = self.client.get(RECIPES_URL, {'ordering': 'pub_date'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeSearchTest(RecipeDataMixin, APITestCase):
+    recipes_total = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.borscht, cls.salad = cls.recipes[:2]
+        cls.borscht.name, cls.borscht.text = 'Борщ', 'Свёкла и капуста'
+        cls.borscht.save()
+        cls.salad.name, cls.salad.text = 'Салат', 'Подавать к борщу'
+        cls.salad.save()
+
+    def search(self, query, **params):
+        response = self.client.get(RECIPES_URL, {'search': query, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['id'] for item in response.data['results']]
+
+    def test_ranked_by_name_then_text(self):
+        self.assertEqual(self.search('борщ'),
+                         [self.borscht.id, self.salad.id])
+        self.assertEqual(self.search('БОРЩ свёкла'), [self.borscht.id])
+
+    def test_index_follows_changes(self):
+        self.borscht.name = 'Щи'
+        self.borscht.save()
+        self.assertEqual(self.search('борщ'), [self.salad.id])
+        self.assertEqual(self.search('щи'), [self.borscht.id])
+        self.salad.delete()
+        self.assertEqual(self.search('борщ'), [])
+
+    def test_with_filters(self):
+        self.assertEqual(
+            self.search('борщ', tags=[self.tags[1].slug]), [self.salad.id])
+
+    def test_query_syntax_is_escaped(self):
+        self.assertEqual(self.search('"борщ* OR'), [])
+        self.assertEqual(self.search('!!!'), [])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, IMAGE_VARIANTS_SYNC=True)
+class WhatToCookTest(RecipeDataMixin, APITestCase):
+    recipes_total = 8
+    url = f'{RECIPES_URL}what-to-cook/'
+
+    def setUp(self):
+        invalidate_pantry_index()
+
+    def ingredient_ids(self, *indexes):
+        return ','.join(str(self.ingredients[index].id)
+                        for index in indexes)
+
+    def find(self, *indexes, **params):
+        response = self.client.get(self.url, {
+            'ingredients': self.ingredient_ids(*indexes), 'limit': 100,
+            **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(item['id'], item['coverage'], item['missing_ingredients'])
+                for item in response.data['results']]
+
+    def expected(self, indexes, missing=None):
+        pantry = {self.ingredients[index].id for index in indexes}
+        found = []
+        for recipe in Recipe.objects.prefetch_related('ingredients'):
+            ingredients = {item.id for item in recipe.ingredients.all()}
+            have = len(ingredients & pantry)
+            lack = len(ingredients) - have
+            if have and (missing is None or lack <= missing):
+                found.append((recipe.id, round(have / len(ingredients), 3),
+                              lack))
+        return sorted(found, key=lambda item: (-item[1], item[2], -item[0]))
+
+    def test_ranked_by_coverage(self):
+        self.assertEqual(self.find(0, 1), self.expected([0, 1]))
+        self.assertEqual(self.find(1, 2, missing=1),
+                         self.expected([1, 2], missing=1))
+        self.assertEqual(self.find(0, missing=0), self.expected([0], 0))
+
+    def test_index_follows_api_writes(self):
+        get_pantry_index()
+        self.client.force_authenticate(self.user)
+        payload = {
+            'name': 'Из кладовки', 'text': 'Описание', 'cooking_time': 5,
+            'image': make_image(), 'tags': [self.tags[0].id],
+            'ingredients': [{'id': self.ingredients[4].id, 'amount': 1}],
+        }
+        with mock.patch.object(PantryIndex, 'from_db',
+                               side_effect=AssertionError('rebuild')):
+            with self.captureOnCommitCallbacks(execute=True):
+                recipe_id = self.client.post(
+                    RECIPES_URL, payload, format='json').data['id']
+            self.assertEqual(self.find(4), [(recipe_id, 1.0, 0)])
+
+            payload['ingredients'].append(
+                {'id': self.ingredients[3].id, 'amount': 1})
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.patch(f'{RECIPES_URL}{recipe_id}/', payload,
+                                  format='json')
+            self.assertEqual(self.find(4), [(recipe_id, 0.5, 1)])
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.delete(f'{RECIPES_URL}{recipe_id}/')
+            self.assertEqual(self.find(4), [])
+
+    def test_invalid_params(self):
+        for params in ({}, {'ingredients': 'abc'},
+                       {'ingredients': '1', 'missing': '-1'}):
+            with self.subTest(params=params):
+                response = self.client.get(self.url, params)
+                self.assertEqual(response.status_code,
+                                 status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, IMAGE_VARIANTS_SYNC=True)
+class FeedTest(RecipeDataMixin, APITestCase):
+    recipes_total = 12
+    url = f'{RECIPES_URL}feed/'
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Follow.objects.create(follower=cls.user, author=cls.authors[1])
+        for model in COUNTERS:
+            list(recount(model))
+        for author in cls.authors:
+            author.refresh_from_db()
+        call_command('backfill_timeline', stdout=io.StringIO())
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def collect(self, limit=2):
+        ids, url, params = [], self.url, {'limit': limit}
+        while url:
+            response = enforce_query_budgets(
+                lambda: self.client.get(url, params))()
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(item['id'] for item in response.data['results'])
+            url, params = response.data['next'], None
+        return ids
+
+    def expected(self):
+        return list(Recipe.objects.filter(
+            author__author_followes__follower=self.user
+        ).order_by('-pub_date', '-id').values_list('id', flat=True))
+
+    def create_recipe(self, author):
+        payload = {
+            'name': 'Свежий', 'text': 'Описание', 'cooking_time': 5,
+            'image': make_image(), 'tags': [self.tags[0].id],
+            'ingredients': [{'id': self.ingredients[0].id, 'amount': 1}],
+        }
+        self.client.force_authenticate(author)
+        response = enforce_query_budgets(lambda: self.client.post(
+            RECIPES_URL, payload, format='json'))()
+        self.client.force_authenticate(self.user)
+        return response.data['id']
+
+    def test_pages_follow_recipes_order(self):
+        # Одинаковые даты проверяют досортировку по id.
+        Recipe.objects.filter(author=self.authors[0]).update(
+            pub_date=self.recipes[0].pub_date)
+        TimelineEntry.objects.filter(author=self.authors[0]).update(
+            pub_date=self.recipes[0].pub_date)
+        self.assertEqual(self.collect(), self.expected())
+        self.assertEqual(len(self.expected()), 8)
+
+    def test_fan_out_on_create(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe_id = self.create_recipe(self.authors[0])
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.user, recipe_id=recipe_id).exists())
+        self.assertEqual(self.collect(limit=6)[0], recipe_id)
+
+    def test_follow_backfills_and_unfollow_removes(self):
+        author = self.authors[2]
+        self.client.post(f'/api/users/{author.id}/subscribe/')
+        self.assertEqual(self.collect(), self.expected())
+        self.assertEqual(len(self.expected()), 12)
+        self.client.delete(f'/api/users/{author.id}/subscribe/')
+        self.assertFalse(TimelineEntry.objects.filter(
+            user=self.user, author=author).exists())
+        self.assertEqual(self.collect(), self.expected())
+
+    @override_settings(FEED_FANOUT_MAX_FOLLOWERS=0)
+    def test_popular_authors_merged_on_read(self):
+        recipe_id = self.create_recipe(self.authors[1])
+        self.assertFalse(TimelineEntry.objects.filter(
+            recipe_id=recipe_id).exists())
+        self.assertEqual(self.collect(), self.expected())
+        self.assertIn(recipe_id, self.expected())
+
+    @override_settings(FEED_FANOUT_MAX_FOLLOWERS=1)
+    def test_recipes_merged_after_author_drops_below_limit(self):
+        author = self.authors[1]
+        other = User.objects.create_user(
+            username='other', email='other@example.com', password='pass')
+        Follow.objects.create(follower=other, author=author)
+        User.objects.filter(pk=author.pk).update(followers_count=2)
+        author.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe_id = self.create_recipe(author)
+        self.assertFalse(TimelineEntry.objects.filter(
+            recipe_id=recipe_id).exists())
+        self.client.force_authenticate(other)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/users/{author.id}/subscribe/')
+        self.client.force_authenticate(self.user)
+        # Запрос отписки не раздаёт рецепты: их подмешивает чтение ленты.
+        self.assertFalse(TimelineEntry.objects.filter(
+            recipe_id=recipe_id).exists())
+        self.assertIn(recipe_id, self.collect())
+        self.assertEqual(self.collect(), self.expected())
+        # Новые рецепты снова раздаются.
+        author.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            later_id = self.create_recipe(author)
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.user, recipe_id=later_id).exists())
+        self.assertEqual(self.collect(limit=20)[0], later_id)
+
+    def test_requires_authentication(self):
+        self.client.force_authenticate(None)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class SimilarRecipesEndpointTest(RecipeDataMixin, APITestCase):
+    recipes_total = 8
+
+    def url(self, recipe_id):
+        return f'{RECIPES_URL}{recipe_id}/similar/'
+
+    def test_precomputed_neighbours(self):
+        call_command('build_similar_recipes', '--full', stdout=io.StringIO())
+        recipe = self.recipes[0]
+        response = enforce_query_budgets(
+            lambda: self.client.get(self.url(recipe.id)))()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        scores = [item['score'] for item in response.data]
+        self.assertTrue(scores)
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertNotIn(recipe.id, [item['id'] for item in response.data])
+        self.assertEqual(
+            len(self.client.get(self.url(recipe.id), {'limit': 1}).data), 1)
+
+    def test_not_built_and_missing(self):
+        self.assertEqual(self.client.get(self.url(self.recipes[0].id)).data,
+                         [])
+        self.assertEqual(self.client.get(self.url(10 ** 6)).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, IMAGE_VARIANTS_SYNC=True)
+    def test_update_marks_stale(self):
+        recipe = self.recipes[0]
+        Recipe.objects.update(similar_stale=False)
+        self.client.force_authenticate(recipe.author)
+        self.client.patch(f'{RECIPES_URL}{recipe.id}/', {
+            'name': 'Новый состав', 'text': 'Описание', 'cooking_time': 5,
+            'image': make_image(), 'tags': [self.tags[0].id],
+            'ingredients': [{'id': self.ingredients[4].id, 'amount': 1}],
+        }, format='json')
+        self.assertEqual(
+            list(Recipe.objects.filter(similar_stale=True).values_list(
+                'id', flat=True)), [recipe.id])
+
+
+class ShoppingListDownloadTest(RecipeDataMixin, APITestCase):
+    recipes_total = 4
+    url = f'{RECIPES_URL}download_shopping_cart/'
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+        for recipe in self.recipes[2:]:
+            ShoppingCartItem.objects.create(user=self.user, recipe=recipe)
+
+    def download(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content)
+
+    def test_txt_totals(self):
+        # В корзине рецепты 1, 2 и 3: продукт 0 входит во все три.
+        with self.assertNumQueries(2):
+            content = self.download().decode()
+        self.assertIn('1. Продукт 0 (г) — 9', content)
+        self.assertIn('4. Продукт 3 (г) — 4', content)
+        self.assertIn(f'• Рецепт 3 — @{self.recipes[3].author.username}',
+                      content)
+
+    def test_csv(self):
+        rows = self.download(file_format='csv').decode().splitlines()
+        self.assertEqual(rows[0], '№,Продукт,Единица измерения,Количество')
+        self.assertEqual(rows[1], '1,Продукт 0,г,9')
+        self.assertEqual(len(rows), 5)
+
+    def test_pdf(self):
+        self.assertTrue(self.download(file_format='pdf').startswith(b'%PDF'))
+
+    @override_settings(SHOPPING_LIST_PDF_FONT='/nonexistent/font.ttf')
+    def test_pdf_font_missing(self):
+        # Шрифт мог быть уже зарегистрирован другим тестом.
+        with mock.patch('reportlab.pdfbase.pdfmetrics.'
+                        'getRegisteredFontNames', return_value=[]):
+            response = self.client.get(self.url, {'file_format': 'pdf'})
+        self.assertEqual(response.status_code,
+                         status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertFalse(response.streaming)
+        self.assertIn('шрифт', response.data['detail'])
+
+    def test_unknown_format(self):
+        response = self.client.get(self.url, {'file_format': 'doc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        ShoppingCartItem.objects.filter(recipe=self.recipes[3]).delete()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@enforce_query_budgets
+class IngredientSearchTest(APITestCase):
+    url = '/api/ingredients/'
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г') for name in (
+                'сахар', 'сахарная пудра', 'ванильный сахар', 'соль',
+                'тростниковый сахар', 'сахарин',
+            )
+        )
+
+    def setUp(self):
+        invalidate_index()
+        get_catalog_cache().clear()
+        # Версию процесс перечитывает из базы раз в CATALOG_VERSION_TIMEOUT.
+        get_catalog_version()
+
+    def search(self, name):
+        response = self.client.get(self.url, {'name': name})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['name'] for item in response.data]
+
+    def test_prefix_matches_first(self):
+        for in_memory in (True, False):
+            with self.subTest(in_memory=in_memory), override_settings(
+                    INGREDIENT_SEARCH_IN_MEMORY=in_memory):
+                self.assertEqual(self.search('сахар'), [
+                    'сахар', 'сахарин', 'сахарная пудра',
+                    'ванильный сахар', 'тростниковый сахар',
+                ])
+
+    def test_in_memory_ignores_case(self):
+        # LIKE в SQLite регистронезависим только для латиницы.
+        self.assertEqual(self.search('САХАРИН'), ['сахарин'])
+
+    @override_settings(INGREDIENT_SEARCH_LIMIT=2)
+    def test_limit(self):
+        self.assertEqual(self.search('сахар'), ['сахар', 'сахарин'])
+
+    def test_index_rebuilt_on_change(self):
+        self.assertEqual(self.search('мёд'), [])
+        Ingredient.objects.create(name='мёд', measurement_unit='г')
+        self.assertEqual(self.search('мёд'), ['мёд'])
+
+    def test_without_name_returns_catalog(self):
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.data), 6)
+
+
+class CatalogCacheTest(APITestCase):
+    url = '/api/tags/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+
+    def setUp(self):
+        get_catalog_cache().clear()
+
+    def test_cached_list(self):
+        response = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url)
+        self.assertEqual(cached.data, response.data)
+        self.assertEqual(cached['ETag'], response['ETag'])
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_version_bumped_on_change(self):
+        etag = self.client.get(self.url)['ETag']
+        Tag.objects.create(name='Обед', slug='lunch')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
+
+    def test_version_bumped_by_load_command(self):
+        version = get_catalog_version()
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as file:
+            file.write('[{"name": "Ужин", "slug": "dinner"}]')
+            file.flush()
+            call_command('load_tags_json', file.name, stdout=io.StringIO())
+        self.assertNotEqual(get_catalog_version(), version)
+
+    def test_version_changed_by_other_process(self):
+        self.assertEqual(len(self.client.get(self.url).data), 1)
+        # Загрузка в другом процессе: меняет базу, но не кэш этого.
+        Tag.objects.bulk_create([Tag(name='Обед', slug='lunch')])
+        CatalogVersion.objects.update(version=F('version') + 1)
+        self.assertEqual(len(self.client.get(self.url).data), 1)
+        # Истёк CATALOG_VERSION_TIMEOUT.
+        get_catalog_cache().delete(CATALOG_VERSION_KEY)
+        self.assertEqual(len(self.client.get(self.url).data), 2)
+
+    def test_detail_not_found_not_cached(self):
+        response = self.client.get(f'{self.url}{self.tag.id + 1}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CountersTest(RecipeDataMixin, APITestCase):
+    recipes_total = 3
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_favorite_and_cart_counters(self):
+        recipe = self.recipes[2]
+        for action, field in (('favorite', 'favorites_count'),
+                              ('shopping_cart', 'carts_count')):
+            url = f'{RECIPES_URL}{recipe.id}/{action}/'
+            self.client.post(url)
+            self.client.post(url)
+            recipe.refresh_from_db()
+            self.assertEqual(getattr(recipe, field), 1)
+            self.client.delete(url)
+            recipe.refresh_from_db()
+            self.assertEqual(getattr(recipe, field), 0)
+
+    def test_follow_counters(self):
+        author = self.authors[1]
+        url = f'/api/users/{author.id}/subscribe/'
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['recipes_count'], 1)
+        author.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(author.followers_count, 1)
+        self.assertEqual(self.user.following_count, 2)
+        self.client.delete(url)
+        author.refresh_from_db()
+        self.assertEqual(author.followers_count, 0)
+
+    def test_recipe_counter(self):
+        author = self.recipes[0].author
+        self.client.force_authenticate(author)
+        self.client.delete(f'{RECIPES_URL}{self.recipes[0].id}/')
+        author.refresh_from_db()
+        self.assertEqual(author.recipes_count, 0)
+
+    def test_remove_relation_created_outside_api(self):
+        recipe, author = self.recipes[2], self.authors[1]
+        Favorite.objects.create(user=self.user, recipe=recipe)
+        Follow.objects.create(follower=self.user, author=author)
+        for url in (f'{RECIPES_URL}{recipe.id}/favorite/',
+                    f'/api/users/{author.id}/subscribe/'):
+            self.assertEqual(self.client.delete(url).status_code,
+                             status.HTTP_204_NO_CONTENT)
+        recipe.refresh_from_db()
+        author.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+        self.assertEqual(author.followers_count, 0)
+
+    def test_admin_keeps_counters(self):
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass')
+        self.client.force_login(admin)
+        recipe = self.recipes[2]
+        self.client.post('/admin/food/favorite/add/', {
+            'user': self.user.id, 'recipe': recipe.id,
+            'created_at_0': '2024-01-01', 'created_at_1': '00:00:00'})
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+        favorite = Favorite.objects.get(user=self.user, recipe=recipe)
+        self.client.post(f'/admin/food/favorite/{favorite.id}/change/', {
+            'user': self.user.id, 'recipe': self.recipes[1].id,
+            'created_at_0': '2024-01-01', 'created_at_1': '00:00:00'})
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+        self.assertEqual(Recipe.objects.get(
+            pk=self.recipes[1].pk).favorites_count, 1)
+        self.client.post('/admin/food/favorite/', {
+            'action': 'delete_selected', '_selected_action': [favorite.id],
+            'post': 'yes'})
+        self.assertFalse(Favorite.objects.filter(pk=favorite.pk).exists())
+        self.assertEqual(Recipe.objects.get(
+            pk=self.recipes[1].pk).favorites_count, 0)
+        self.client.post(f'/admin/food/user/{self.authors[0].id}/delete/',
+                         {'post': 'yes'})
+        self.assertEqual(User.objects.get(
+            pk=self.user.pk).following_count, 0)
+        # Избранное и корзина удалённого пользователя.
+        self.client.post(f'/admin/food/user/{self.user.id}/delete/',
+                         {'post': 'yes'})
+        self.assertEqual(
+            Recipe.objects.get(pk=self.recipes[1].pk).carts_count, 0)
+
+    def test_recount_repairs_drift(self):
+        Recipe.objects.update(favorites_count=7)
+        User.objects.update(recipes_count=0)
+        call_command('recount', '--batch-size', '2', stdout=io.StringIO())
+        self.assertEqual(
+            Recipe.objects.get(pk=self.recipes[0].pk).favorites_count, 1)
+        self.assertEqual(
+            Recipe.objects.get(pk=self.recipes[1].pk).favorites_count, 0)
+        self.assertEqual(
+            User.objects.get(pk=self.authors[0].pk).recipes_count, 1)
+        self.assertEqual(
+            User.objects.get(pk=self.user.pk).following_count, 1)
+
+
+class ToggleTest(RecipeDataMixin, APITestCase):
+    recipes_total = 3
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def statements(self, method, url):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url)
+        return response, [
+            query['sql'] for query in context.captured_queries
+            if '"food_favorite"' in query['sql']
+        ]
+
+    def test_single_statement(self):
+        url = f'{RECIPES_URL}{self.recipes[2].id}/favorite/'
+        response, sql = self.statements('post', url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['id'], self.recipes[2].id)
+        self.assertEqual(len(sql), 1)
+        self.assertIn('ON CONFLICT DO NOTHING', sql[0])
+        response, sql = self.statements('delete', url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(len(sql), 1)
+        self.assertTrue(sql[0].startswith('DELETE'))
+
+    def test_subscribe_loads_author_once(self):
+        url = f'/api/users/{self.authors[0].id}/subscribe/'
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len([
+            query for query in context.captured_queries
+            if query['sql'].startswith('SELECT')
+        ]), 1)
+
+    def test_statuses(self):
+        url = f'{RECIPES_URL}{self.recipes[0].id}/favorite/'
+        self.assertEqual(self.client.post(url).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        missing = f'{RECIPES_URL}{10 ** 6}/shopping_cart/'
+        self.assertEqual(self.client.post(missing).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.delete(missing).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertFalse(ShoppingCartItem.objects.filter(
+            recipe_id=10 ** 6).exists())
+        for method, expected in (('post', status.HTTP_404_NOT_FOUND),
+                                 ('delete', status.HTTP_404_NOT_FOUND)):
+            response = getattr(self.client, method)(
+                f'/api/users/{10 ** 6}/subscribe/')
+            self.assertEqual(response.status_code, expected)
+        url = f'/api/users/{self.authors[0].id}/subscribe/'
+        self.assertEqual(self.client.post(url).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post(
+            f'/api/users/{self.user.id}/subscribe/').status_code,
+            status.HTTP_400_BAD_REQUEST)
+
+
+@enforce_query_budgets
+class BulkRelationsTest(RecipeDataMixin, APITestCase):
+    # В фикстуре: recipes[0] в избранном, recipes[1] в корзине.
+    recipes_total = 4
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def bulk(self, path, recipe_ids=None):
+        response = self.client.post(
+            f'{RECIPES_URL}{path}/',
+            None if recipe_ids is None else {'recipes': recipe_ids},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(item['id'], item['status'])
+                for item in response.data['results']]
+
+    def counters(self, field):
+        return dict(Recipe.objects.values_list('id', field))
+
+    def test_add_and_remove(self):
+        first, second, third, fourth = (recipe.id for recipe in self.recipes)
+        self.assertEqual(
+            self.bulk('shopping_cart/add', [third, second, 10 ** 6, third]),
+            [(third, 'added'), (second, 'exists'), (10 ** 6, 'not_found')])
+        self.assertEqual(self.counters('carts_count'),
+                         {first: 0, second: 1, third: 1, fourth: 0})
+        self.assertEqual(
+            self.bulk('shopping_cart/remove', [second, fourth]),
+            [(second, 'removed'), (fourth, 'not_found')])
+        self.assertEqual(
+            self.bulk('favorite/add', [first, fourth]),
+            [(first, 'exists'), (fourth, 'added')])
+        self.assertEqual(self.bulk('favorite/remove', [first]),
+                         [(first, 'removed')])
+        self.assertEqual(self.counters('favorites_count'),
+                         {first: 0, second: 0, third: 0, fourth: 1})
+        self.assertEqual(
+            set(ShoppingCartItem.objects.values_list('recipe_id', flat=True)),
+            {third})
+
+    def test_queries_do_not_depend_on_size(self):
+        counts = []
+        # В обоих наборах есть уже добавленный recipes[0].
+        for recipes in (self.recipes[:2], self.recipes):
+            with CaptureQueriesContext(connection) as context:
+                self.bulk('favorite/add', [recipe.id for recipe in recipes])
+            counts.append(len(context.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_favorites_to_cart_and_clear(self):
+        first, second, third, _ = (recipe.id for recipe in self.recipes)
+        Favorite.objects.create(user=self.user, recipe=self.recipes[1])
+        self.assertEqual(self.bulk('shopping_cart/from-favorites'),
+                         [(first, 'added'), (second, 'exists')])
+        self.assertEqual(self.bulk('shopping_cart/clear'),
+                         [(first, 'removed'), (second, 'removed')])
+        self.assertFalse(ShoppingCartItem.objects.exists())
+        self.assertEqual(set(self.counters('carts_count').values()), {0})
+        self.assertEqual(self.bulk('shopping_cart/clear'), [])
+
+    def test_invalid_payload(self):
+        url = f'{RECIPES_URL}shopping_cart/add/'
+        for recipe_ids in ([], ['первый'], [1] * (BULK_RECIPES_MAX + 1)):
+            with self.subTest(recipe_ids=recipe_ids[:2]):
+                response = self.client.post(url, {'recipes': recipe_ids},
+                                            format='json')
+                self.assertEqual(response.status_code,
+                                 status.HTTP_400_BAD_REQUEST)
+        self.client.force_authenticate(None)
+        self.assertEqual(
+            self.client.post(url, {'recipes': [1]}, format='json')
+            .status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ToggleConcurrencyTest(TransactionTestCase):
+    """Одновременные повторные нажатия: одна строка и верные статусы.
+
+    Нужна PostgreSQL или тестовая БД SQLite в файле (см. settings).
+    """
+
+    threads = 8
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Описание',
+            image='recipes/test.png', cooking_time=10)
+
+    def hammer(self, method, url):
+        barrier = threading.Barrier(self.threads)
+        statuses = []
+
+        def tap():
+            client = APIClient()
+            client.force_authenticate(self.user)
+            try:
+                barrier.wait()
+                statuses.append(getattr(client, method)(url).status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=tap) for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sorted(statuses)
+
+    def assert_once(self, statuses, success, repeat):
+        self.assertEqual(statuses,
+                         sorted([success] + [repeat] * (self.threads - 1)))
+
+    def test_favorite(self):
+        url = f'{RECIPES_URL}{self.recipe.id}/favorite/'
+        self.assert_once(self.hammer('post', url), status.HTTP_201_CREATED,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Favorite.objects.count(), 1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assert_once(self.hammer('delete', url),
+                         status.HTTP_204_NO_CONTENT,
+                         status.HTTP_404_NOT_FOUND)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+
+    def test_subscribe(self):
+        url = f'/api/users/{self.author.id}/subscribe/'
+        self.assert_once(self.hammer('post', url), status.HTTP_201_CREATED,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Follow.objects.count(), 1)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 1)
+
+
+@enforce_query_budgets
+class SubscriptionsTest(RecipeDataMixin, APITestCase):
+    recipes_total = 9
+    url = '/api/users/subscriptions/'
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url, {'recipes_limit': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries), response
+
+    def test_queries_do_not_depend_on_subscriptions(self):
+        one, _ = self.count_queries()
+        for author in self.authors[1:]:
+            Follow.objects.create(follower=self.user, author=author)
+        many, response = self.count_queries()
+        self.assertEqual(many, one)
+        self.assertEqual(len(response.data['results']), 3)
+        for item in response.data['results']:
+            self.assertIs(item['is_subscribed'], True)
+            self.assertEqual(item['recipes_count'], 3)
+            self.assertEqual(len(item['recipes']), 2)
+
+    def test_recent_recipes_first(self):
+        _, response = self.count_queries()
+        author_recipes = sorted(
+            (recipe for recipe in self.recipes
+             if recipe.author == self.authors[0]),
+            key=lambda recipe: recipe.pub_date, reverse=True
+        )
+        self.assertEqual(
+            [item['id'] for item in response.data['results'][0]['recipes']],
+            [recipe.id for recipe in author_recipes[:2]]
+        )
+
+    def test_recipes_limit_is_capped(self):
+        for value, expected in (('1000', 3), ('abc', 3), ('-1', 0)):
+            response = self.client.get(self.url, {'recipes_limit': value})
+            self.assertEqual(
+                len(response.data['results'][0]['recipes']), expected)
+
+    def test_anonymous(self):
+        self.client.force_authenticate(None)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+
+
+IMAGES_MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=IMAGES_MEDIA_ROOT, IMAGE_VARIANTS_SYNC=True)
+class ImagePipelineTest(RecipeDataMixin, APITestCase):
+    recipes_total = 2
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(IMAGES_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def create_recipe(self, image):
+        self.client.force_authenticate(self.user)
+        return self.client.post(RECIPES_URL, {
+            'name': 'Рецепт с фото',
+            'text': 'Описание',
+            'cooking_time': 5,
+            'image': image,
+            'tags': [self.tags[0].id],
+            'ingredients': [{'id': self.ingredients[0].id, 'amount': 1}],
+        }, format='json')
+
+    def test_variants_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.create_recipe(make_image((900, 300)))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIsNone(response.data['image_variants'])
+        response = self.client.get(f'{RECIPES_URL}{response.data["id"]}/')
+        variants = response.data['image_variants']
+        self.assertEqual(set(variants), {'card', 'thumbnail'})
+        self.assertTrue(variants['card']['webp'].endswith('_card.webp'))
+        recipe = Recipe.objects.get(pk=response.data['id'])
+        for variant, size in (('card', (600, 200)),
+                              ('thumbnail', (150, 150))):
+            for ext in FORMATS:
+                with recipe.image.storage.open(variant_name(
+                        recipe.image.name, variant, ext)) as file:
+                    self.assertEqual(Image.open(file).size, size)
+
+    @override_settings(IMAGE_MAX_SIDE=100)
+    def test_too_large_image_rejected(self):
+        response = self.create_recipe(make_image((101, 10)))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('image', response.data)
+
+    def test_invalid_image_rejected(self):
+        response = self.create_recipe('data:image/png;base64,bm90IGltYWdl')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_backfill_command(self):
+        recipe = self.recipes[0]
+        buffer = io.BytesIO()
+        Image.new('RGB', (300, 300), 'blue').save(buffer, format='PNG')
+        recipe.image.save('old.png', io.BytesIO(buffer.getvalue()))
+        self.assertFalse(has_variants(recipe.image))
+        call_command('make_image_variants', stdout=io.StringIO())
+        recipe.refresh_from_db()
+        self.assertTrue(has_variants(recipe.image))
+
+    def test_urls_without_storage_lookups(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_recipe(make_image((300, 300)))
+        with mock.patch('django.core.files.storage.FileSystemStorage.exists',
+                        side_effect=AssertionError):
+            response = self.client.get(RECIPES_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(response.data['results'][0]['image_variants'])
+
+    def test_old_variants_deleted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.create_recipe(make_image((300, 300)))
+        recipe = Recipe.objects.get(pk=response.data['id'])
+        old_name = recipe.image.name
+        storage = recipe.image.storage
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'{RECIPES_URL}{recipe.id}/', {
+                'image': make_image((200, 200)),
+                'tags': [self.tags[0].id],
+                'ingredients': [{'id': self.ingredients[0].id, 'amount': 1}],
+            }, format='json')
+        recipe.refresh_from_db()
+        self.assertTrue(has_variants(recipe.image))
+        self.assertFalse(storage.exists(
+            variant_name(old_name, 'card', 'jpg')))
+        new_variant = variant_name(recipe.image.name, 'card', 'jpg')
+        self.assertTrue(storage.exists(new_variant))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'{RECIPES_URL}{recipe.id}/')
+        self.assertFalse(storage.exists(new_variant))
+
+    @override_settings(IMAGE_MAX_BYTES=100)
+    def test_too_large_file_rejected(self):
+        with mock.patch('library.images.get_decode_executor') as executor:
+            response = self.create_recipe(make_image((300, 300)))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        executor.assert_not_called()
+
+    @override_settings(IMAGE_DECODE_TIMEOUT=1)
+    def test_decode_not_blocked_by_variant_backlog(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def busy():
+            started.set()
+            release.wait(10)
+
+        # Все потоки фонового пула заняты.
+        for _ in range(settings.IMAGE_WORKERS):
+            get_executor().submit(busy)
+        started.wait(1)
+        try:
+            response = self.create_recipe(make_image())
+        finally:
+            release.set()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class MetricsTest(RecipeDataMixin, APITestCase):
+    recipes_total = 3
+
+    def setUp(self):
+        registry.clear()
+
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(RECIPES_URL)
+        timing = response['Server-Timing']
+        self.assertIn(f'desc="{len(context)} queries"', timing)
+        for metric in ('db;dur=', 'serialize;dur=', 'total;dur='):
+            self.assertIn(metric, timing)
+
+    def test_metrics_endpoint(self):
+        self.client.get(RECIPES_URL)
+        self.client.get(RECIPES_URL)
+        self.client.get(f'{RECIPES_URL}{self.recipes[0].id}/')
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass')
+        self.client.force_authenticate(admin)
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        text = response.content.decode()
+        self.assertIn('# TYPE foodgram_request_duration_seconds histogram',
+                      text)
+        self.assertIn('foodgram_request_duration_seconds_count'
+                      '{view="RecipeViewSet",action="list"} 2', text)
+        self.assertIn('foodgram_db_queries_bucket{view="RecipeViewSet",'
+                      'action="retrieve",le="+Inf"} 1', text)
+
+    def test_metrics_for_admins_only(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class BenchmarkTest(RecipeDataMixin, APITestCase):
+    recipes_total = 6
+
+    def test_run_and_compare(self):
+        base = tempfile.NamedTemporaryFile(suffix='.json')
+        self.addCleanup(base.close)
+        call_command('benchmark', '--repeat', '1', '--output', base.name,
+                     stdout=io.StringIO())
+        with open(base.name, encoding='utf-8') as file:
+            result = json.load(file)
+        self.assertEqual(set(result['cases']), set(CASES))
+        self.assertEqual(result['cases']['subscriptions']['queries'], 2)
+
+        result['cases']['recipe_list']['queries'] += 1
+        result['cases']['recipe_detail']['time_ms'] *= 2
+        new = tempfile.NamedTemporaryFile('w', suffix='.json')
+        self.addCleanup(new.close)
+        json.dump(result, new)
+        new.flush()
+        with self.assertRaisesMessage(CommandError,
+                                      'recipe_list, recipe_detail'):
+            call_command('benchmark', '--compare', base.name, new.name,
+                         stdout=io.StringIO())
+
+
+class QueryPlanTest(RecipeDataMixin, APITestCase):
+    """Основные запросы эндпоинтов не читают большие таблицы целиком
+    (EXPLAIN на PostgreSQL, EXPLAIN QUERY PLAN на SQLite)."""
+
+    recipes_total = 12
+    # На PostgreSQL план выбирается по статистике: на дюжине строк любой
+    # запрос дешевле прочитать целиком, поэтому данные — как под нагрузкой.
+    postgresql_scale = '5'
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        if connection.vendor == 'postgresql':
+            call_command('generate_dataset', '--scale', cls.postgresql_scale,
+                         stdout=io.StringIO())
+            analyze()
+
+    def assert_no_full_scans(self, url, user=None):
+        self.client.force_authenticate(user or self.user)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for query in context.captured_queries:
+            if query['sql'].startswith('SELECT'):
+                with self.subTest(url=url, sql=query['sql']):
+                    self.assertEqual(full_scans(query['sql']), [])
+
+    def test_recipe_endpoints(self):
+        recipe = self.recipes[0]
+        for url in (
+            RECIPES_URL,
+            f'{RECIPES_URL}?pagination=cursor',
+            f'{RECIPES_URL}?author={self.authors[0].id}',
+            f'{RECIPES_URL}?tags={self.tags[0].slug}',
+            f'{RECIPES_URL}?is_favorited=1',
+            f'{RECIPES_URL}?is_in_shopping_cart=1',
+            f'{RECIPES_URL}{recipe.id}/',
+            f'{RECIPES_URL}download_shopping_cart/',
+        ):
+            self.assert_no_full_scans(url)
+
+    def test_user_endpoints(self):
+        for url in ('/api/users/subscriptions/?recipes_limit=2',
+                    f'/api/users/{self.authors[0].id}/',
+                    '/api/users/me/'):
+            self.assert_no_full_scans(url)
@@ -2,6 +2,7 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from api.metrics import MetricsView
 from api.views import (IngredientViewSet, RecipeViewSet, TagViewSet,
                        UserWithSubscriptionViewSet)
 
@@ -15,5 +16,6 @@ api.register(r'users', UserWithSubscriptionViewSet, basename='users')
 
 urlpatterns = [
     path('auth/', include('djoser.urls.authtoken')),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('', include(api.urls)),
 ]
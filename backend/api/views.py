@@ -1,84 +1,168 @@
 import os
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
-from django.db.models import Exists, OuterRef
-from django.http import FileResponse
-from django.template.loader import render_to_string
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef, Prefetch, Value
+from django.http import Http404, HttpResponseNotModified, StreamingHttpResponse
 from django.urls import reverse
-from django.utils.timezone import now
-from django_filters.filters import CharFilter
-from django_filters.filterset import FilterSet
+from django.utils.http import parse_etags, quote_etag
 from django_filters.rest_framework.backends import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import APIException, ValidationError
 from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import (AllowAny, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 
+from api.autocomplete import search_ingredients
+from api.cache import CatalogCacheMixin
 from api.filters import RecipeFilter
-from api.pagination import RecipePagination
+from api.metrics import MetricsViewMixin, measure_serialize
+from api.pagination import (FeedPagination, PantryPagination, RecipePagination,
+                            SubscriptionPagination)
+from api.pantry import MAX_PANTRY_INGREDIENTS
+from api.pantry import get_index as get_pantry_index
+from api.pantry import recipe_changed
 from api.permissions import IsAuthorOrReadOnly
 from api.serializers import (FollowedUserSerializer, FoodgramUserSerializer,
-                             IngredientSerializer, RecipeReadSerializer,
-                             RecipeWriteSerializer, ShortRecipeSerializer,
-                             TagSerializer)
+                             IngredientSerializer, RecipeIdsSerializer,
+                             RecipeReadSerializer, RecipeWriteSerializer,
+                             ShortRecipeSerializer, SimilarRecipeSerializer,
+                             TagSerializer, get_recipes_limit)
+from api.shopping_list import FORMATS as SHOPPING_LIST_FORMATS
+from api.shopping_list import ShoppingList, ShoppingListError
+from food import relations, timeline
+from food.counters import change_counter, change_counters
 from food.models import (Favorite, Follow, Ingredient, Recipe,
                          RecipeIngredient, ShoppingCartItem, Tag)
 
 User = get_user_model()
 
+# Исходы пакетных операций с корзиной и избранным для каждого id.
+ADDED = 'added'
+EXISTS = 'exists'
+REMOVED = 'removed'
+NOT_FOUND = 'not_found'
+# Теги и продукты проверяются по кэшу справочников: удалённые после его
+# обновления проходят проверку, но нарушают внешний ключ при записи.
+CATALOG_CHANGED = ('Некоторые теги или продукты уже удалены. '
+                   'Обновите страницу и повторите.')
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+
+class TagViewSet(MetricsViewMixin, CatalogCacheMixin,
+                 viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [AllowAny]
     pagination_class = None
+    query_budget = {'list': 1, 'retrieve': 1}
 
 
-class IngredientFilter(FilterSet):
-    name = CharFilter(field_name='name', lookup_expr='istartswith')
-
-    class Meta:
-        model = Ingredient
-        fields = ['name']
-
-
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(MetricsViewMixin, CatalogCacheMixin,
+                        viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = [AllowAny]
     pagination_class = None
-    filterset_class = IngredientFilter
+    query_budget = {'list': 1, 'retrieve': 1}
+
+    def filter_queryset(self, queryset):
+        name = self.request.query_params.get('name')
+        if self.action == 'list' and name:
+            return search_ingredients(name)
+        return super().filter_queryset(queryset)
+
+
+def build_recipe_queryset(user, recipes=None):
+    """Рецепты со всем необходимым для RecipeReadSerializer."""
+    recipes = (Recipe.objects.all() if recipes is None else recipes)
+    recipes = recipes.select_related('author').prefetch_related(
+        Prefetch('tags', queryset=Tag.objects.all()),
+        Prefetch(
+            'ingredients_in_recipe',
+            queryset=RecipeIngredient.objects.select_related('ingredient')
+        ),
+    )
+    if not user.is_authenticated:
+        return recipes.annotate(
+            is_favorited=Value(False),
+            is_in_shopping_cart=Value(False),
+            is_author_subscribed=Value(False),
+        )
+    return recipes.annotate(
+        is_favorited=Exists(Favorite.objects.filter(
+            user=user, recipe=OuterRef('pk'))),
+        is_in_shopping_cart=Exists(ShoppingCartItem.objects.filter(
+            user=user, recipe=OuterRef('pk'))),
+        is_author_subscribed=Exists(Follow.objects.filter(
+            follower=user, author=OuterRef('author'))),
+    )
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+def build_subscriptions_queryset(user, recipes_limit):
+    """Авторы, на которых подписан user, с recipes_limit последних
+    рецептов каждого в recent_recipes."""
+    # Последние рецепты всех авторов страницы загружаются одним
+    # запросом: срез в Prefetch Django строит через
+    # ROW_NUMBER() OVER (PARTITION BY author_id).
+    return User.objects.filter(
+        author_followes__follower=user
+    ).annotate(
+        is_subscribed=Value(True)
+    ).prefetch_related(Prefetch(
+        'recipes',
+        queryset=Recipe.objects.order_by('-pub_date', '-id')[:recipes_limit],
+        to_attr='recent_recipes'
+    ))
+
+
+class RecipeViewSet(MetricsViewMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
+    lookup_value_regex = r'\d+'
+    # Допустимое число SQL-запросов на действие (проверяется в тестах).
+    query_budget = {
+        'list': 5,
+        'retrieve': 4,
+        # Раздача в ленты подписчиков — два запроса на пакет.
+        'create': 16,
+        # Транзакция: в тестах — SAVEPOINT и RELEASE.
+        'partial_update': 17,
+        'update': 17,
+        'what_to_cook': 5,
+        'feed': 5,
+        'similar': 1,
+        # Пакетные операции: запросы не зависят от числа рецептов.
+        'add_to_shopping_cart': 5,
+        'remove_from_shopping_cart': 4,
+        'add_to_favorites': 5,
+        'remove_from_favorites': 4,
+        'clear_shopping_cart': 4,
+        'favorites_to_shopping_cart': 6,
+    }
 
     permission_classes = [IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly]
 
     def get_queryset(self):
+        if self.action not in ('list', 'retrieve'):
+            return super().get_queryset()
         user = self.request.user
-        queryset = super().get_queryset()
+        queryset = build_recipe_queryset(user, super().get_queryset())
 
-        is_in_cart = self.request.query_params.get('is_in_shopping_cart')
-        if is_in_cart and user.is_authenticated:
-            cart_subquery = ShoppingCartItem.objects.filter(
-                user=user,
-                recipe=OuterRef('pk')
-            )
-            queryset = queryset.annotate(
-                in_cart=Exists(cart_subquery)
-            ).filter(in_cart=True)
+        if (user.is_authenticated
+                and self.request.query_params.get('is_in_shopping_cart')):
+            queryset = queryset.filter(is_in_shopping_cart=True)
 
-        queryset = queryset.order_by('-pub_date')
+        queryset = queryset.order_by('-pub_date', '-id')
         return queryset
 
+    def get_read_instance(self, recipe):
+        return build_recipe_queryset(self.request.user).get(pk=recipe.pk)
+
     def get_serializer_class(self):
         if self.request.method in ['POST', 'PUT', 'PATCH', 'DELETE']:
             return RecipeWriteSerializer
@@ -135,32 +219,140 @@ class RecipeViewSet(viewsets.ModelViewSet):
         )
 
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        try:
+            with transaction.atomic():
+                serializer.save(author=self.request.user)
+                change_counter(User, self.request.user.pk, 'recipes_count', 1)
+                recipe = serializer.instance
+                transaction.on_commit(lambda: timeline.fan_out(recipe))
+        except IntegrityError:
+            raise ValidationError(CATALOG_CHANGED)
+        serializer.instance = self.get_read_instance(serializer.instance)
+
+    def perform_destroy(self, recipe):
+        with transaction.atomic():
+            recipe_id = recipe.pk
+            recipe.delete()
+            change_counter(User, recipe.author_id, 'recipes_count', -1)
+            recipe_changed(recipe_id)
+
+    def perform_update(self, serializer):
+        try:
+            with transaction.atomic():
+                serializer.save()
+        except IntegrityError:
+            raise ValidationError(CATALOG_CHANGED)
+        serializer.instance = self.get_read_instance(serializer.instance)
 
     @action(detail=False, methods=['get'],
             permission_classes=[IsAuthenticated])
     def download_shopping_cart(self, request):
-        user = request.user
-        recipes = Recipe.objects.filter(
-            shoppingcartitems__user=user)
-
-        content = render_to_string('shopping_list.txt', {
-            'user': user,
-            'date': now().date(),
-            'ingredients': (
-                RecipeIngredient.objects.filter(
-                    recipe__in=recipes
-                ).values(
-                    'ingredient__name', 'ingredient__measurement_unit'
-                ).annotate(
-                    total_amount=models.Sum('amount')
-                ).order_by('ingredient__name')
-            ),
-            'recipes': recipes,
-        })
-
-        return FileResponse(
-            content, as_attachment=True, filename='shopping_list.txt')
+        file_format = request.query_params.get('file_format', 'txt')
+        if file_format not in SHOPPING_LIST_FORMATS:
+            raise ValidationError(
+                {'file_format': f'Доступные форматы: '
+                                f'{", ".join(SHOPPING_LIST_FORMATS)}.'})
+        render, content_type = SHOPPING_LIST_FORMATS[file_format]
+
+        shopping_list = ShoppingList(request.user)
+        etag = quote_etag(shopping_list.etag(file_format))
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        else:
+            try:
+                content = render(shopping_list)
+            except ShoppingListError as error:
+                raise APIException(str(error))
+            response = StreamingHttpResponse(
+                content, content_type=content_type)
+            response['Content-Disposition'] = (
+                f'attachment; filename="shopping_list.{file_format}"')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    @action(detail=False, methods=['get'],
+            permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        """Рецепты авторов, на которых подписан пользователь."""
+        paginator = FeedPagination(
+            page_size=RecipePagination().get_page_size(request))
+        page = paginator.paginate_keys(
+            Recipe.objects.all(), request,
+            get_keys=lambda limit, after: timeline.feed_keys(
+                request.user, limit, after),
+            load=build_recipe_queryset(request.user).in_bulk,
+        )
+        with measure_serialize():
+            data = RecipeReadSerializer(
+                page, many=True, context={'request': request}).data
+        return paginator.get_paginated_response(data)
+
+    @action(detail=True, methods=['get'], permission_classes=[AllowAny])
+    def similar(self, request, pk=None):
+        """Похожие по составу рецепты (build_similar_recipes)."""
+        try:
+            limit = min(int(request.query_params.get('limit', '')),
+                        settings.SIMILAR_RECIPES_LIMIT)
+        except ValueError:
+            limit = settings.SIMILAR_RECIPES_LIMIT
+        recipes = list(Recipe.objects.filter(
+            similar_to__recipe_id=pk
+        ).annotate(
+            score=F('similar_to__score')
+        ).order_by('-score', 'id')[:max(limit, 0)])
+        if not recipes:
+            get_object_or_404(Recipe, pk=pk)
+        return Response(SimilarRecipeSerializer(
+            recipes, many=True, context={'request': request}).data)
+
+    def get_pantry_params(self, request):
+        try:
+            ingredient_ids = {
+                int(value)
+                for values in request.query_params.getlist('ingredients')
+                for value in values.split(',') if value.strip()
+            }
+            missing = request.query_params.get('missing')
+            missing = None if missing in (None, '') else int(missing)
+        except ValueError:
+            raise ValidationError('id продуктов и missing должны быть '
+                                  'целыми числами.')
+        if not ingredient_ids:
+            raise ValidationError({'ingredients': 'Это поле обязательно.'})
+        if len(ingredient_ids) > MAX_PANTRY_INGREDIENTS:
+            raise ValidationError({'ingredients': (
+                f'Не больше {MAX_PANTRY_INGREDIENTS} продуктов.')})
+        if missing is not None and missing < 0:
+            raise ValidationError({'missing': 'Не может быть меньше 0.'})
+        return ingredient_ids, missing
+
+    @action(detail=False, methods=['get'], url_path='what-to-cook',
+            permission_classes=[AllowAny])
+    def what_to_cook(self, request):
+        """Рецепты из имеющихся продуктов: ?ingredients=1,2&missing=1.
+
+        Сортировка по доле продуктов рецепта, которые есть у пользователя;
+        missing ограничивает число недостающих.
+        """
+        found = get_pantry_index().search(*self.get_pantry_params(request))
+        paginator = PantryPagination()
+        page = paginator.paginate_queryset(found, request, view=self)
+        recipes = build_recipe_queryset(request.user).in_bulk(
+            [recipe_id for recipe_id, _, _ in page])
+        # Рецепт, удалённый в обход API, пропадёт из индекса при
+        # следующей перестройке; до тех пор просто пропускаем его.
+        page = [item for item in page if item[0] in recipes]
+        with measure_serialize():
+            data = RecipeReadSerializer(
+                [recipes[recipe_id] for recipe_id, _, _ in page],
+                many=True, context={'request': request}
+            ).data
+        return paginator.get_paginated_response([
+            {**recipe, 'coverage': round(matched / total, 3),
+             'missing_ingredients': total - matched}
+            for recipe, (_, matched, total) in zip(data, page)
+        ])
 
     def handle_add_or_remove(self, model, recipe_id, request):
         if request.method not in {'POST', 'DELETE'}:
@@ -169,23 +361,34 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_405_METHOD_NOT_ALLOWED
             )
 
+        relation_name = model._meta.verbose_name_plural.lower()
         if request.method == 'DELETE':
-            get_object_or_404(
-                model,
-                user=request.user,
-                recipe_id=recipe_id
-            ).delete()
+            with transaction.atomic():
+                if not relations.delete(model, user=request.user,
+                                        recipe_id=recipe_id):
+                    raise Http404(
+                        f'Рецепта с id={recipe_id} нет в {relation_name}.')
+                change_counter(Recipe, recipe_id, model.counter_field, -1)
             return Response(status=status.HTTP_204_NO_CONTENT)
 
         # if request.method == 'POST':
-        recipe = get_object_or_404(Recipe, pk=recipe_id)
-        obj, created = model.objects.get_or_create(user=request.user,
-                                                   recipe=recipe)
+        # Один INSERT ... ON CONFLICT: повторное нажатие не даёт ни
+        # дубликата, ни IntegrityError.
+        try:
+            with transaction.atomic():
+                created = relations.insert(
+                    model(user=request.user, recipe_id=recipe_id), 'recipe')
+                if created:
+                    change_counter(Recipe, recipe_id, model.counter_field, 1)
+        except (Recipe.DoesNotExist, IntegrityError):
+            # IntegrityError — рецепт удалён до фиксации транзакции.
+            raise Http404(f'Рецепт с id={recipe_id} не найден.')
         if not created:
             raise ValidationError(
-                f'Рецепт с id={recipe.id} '
-                f'уже добавлен в {model._meta.verbose_name_plural.lower()}.')
+                f'Рецепт с id={recipe_id} уже добавлен в {relation_name}.')
 
+        recipe = get_object_or_404(Recipe.objects.only(
+            'name', 'image', 'cooking_time'), pk=recipe_id)
         return Response(
             ShortRecipeSerializer(
                 recipe,
@@ -211,11 +414,96 @@ class RecipeViewSet(viewsets.ModelViewSet):
             request=request,
         )
 
+    def get_bulk_recipe_ids(self, request):
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['recipes']
+
+    @staticmethod
+    def bulk_response(recipe_ids, outcomes):
+        return Response({'results': [
+            {'id': recipe_id, 'status': outcomes.get(recipe_id, NOT_FOUND)}
+            for recipe_id in recipe_ids
+        ]})
+
+    def add_many(self, model, user, recipe_ids):
+        """Добавляет рецепты набором запросов, не зависящим от их числа:
+        {id: ADDED или EXISTS}; несуществующих рецептов в словаре нет."""
+        with transaction.atomic():
+            added = relations.insert_many(model(user=user), 'recipe',
+                                          recipe_ids)
+            change_counters(Recipe, added, model.counter_field, 1)
+        outcomes = dict.fromkeys(added, ADDED)
+        rest = set(recipe_ids) - added
+        if rest:
+            outcomes.update(dict.fromkeys(Recipe.objects.filter(
+                pk__in=rest).values_list('pk', flat=True), EXISTS))
+        return outcomes
+
+    def remove_many(self, model, user, recipe_ids=None):
+        """Удаляет рецепты (без recipe_ids — все): {id: REMOVED}."""
+        with transaction.atomic():
+            removed = relations.delete_many(model, 'recipe', recipe_ids,
+                                            user=user)
+            change_counters(Recipe, removed, model.counter_field, -1)
+        return dict.fromkeys(removed, REMOVED)
+
+    def bulk_add(self, model, request):
+        recipe_ids = self.get_bulk_recipe_ids(request)
+        return self.bulk_response(
+            recipe_ids, self.add_many(model, request.user, recipe_ids))
+
+    def bulk_remove(self, model, request):
+        recipe_ids = self.get_bulk_recipe_ids(request)
+        return self.bulk_response(
+            recipe_ids, self.remove_many(model, request.user, recipe_ids))
+
+    @action(detail=False, methods=['post'], url_path='shopping_cart/add',
+            permission_classes=[IsAuthenticated])
+    def add_to_shopping_cart(self, request):
+        return self.bulk_add(ShoppingCartItem, request)
+
+    @action(detail=False, methods=['post'], url_path='shopping_cart/remove',
+            permission_classes=[IsAuthenticated])
+    def remove_from_shopping_cart(self, request):
+        return self.bulk_remove(ShoppingCartItem, request)
+
+    @action(detail=False, methods=['post'], url_path='favorite/add',
+            permission_classes=[IsAuthenticated])
+    def add_to_favorites(self, request):
+        return self.bulk_add(Favorite, request)
+
+    @action(detail=False, methods=['post'], url_path='favorite/remove',
+            permission_classes=[IsAuthenticated])
+    def remove_from_favorites(self, request):
+        return self.bulk_remove(Favorite, request)
+
+    @action(detail=False, methods=['post'], url_path='shopping_cart/clear',
+            permission_classes=[IsAuthenticated])
+    def clear_shopping_cart(self, request):
+        outcomes = self.remove_many(ShoppingCartItem, request.user)
+        return self.bulk_response(sorted(outcomes), outcomes)
 
-class UserWithSubscriptionViewSet(UserViewSet):
+    @action(detail=False, methods=['post'],
+            url_path='shopping_cart/from-favorites',
+            permission_classes=[IsAuthenticated])
+    def favorites_to_shopping_cart(self, request):
+        recipe_ids = list(Favorite.objects.filter(
+            user=request.user).order_by('recipe_id').values_list(
+            'recipe_id', flat=True))
+        outcomes = {}
+        if recipe_ids:
+            outcomes = self.add_many(ShoppingCartItem, request.user,
+                                     recipe_ids)
+        return self.bulk_response(recipe_ids, outcomes)
+
+
+class UserWithSubscriptionViewSet(MetricsViewMixin, UserViewSet):
     queryset = User.objects.all()
     serializer_class = FoodgramUserSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    lookup_value_regex = r'\d+'
+    query_budget = {'subscriptions': 4}
 
     @action(['get'],
             detail=False,
@@ -267,24 +555,36 @@ class UserWithSubscriptionViewSet(UserViewSet):
             permission_classes=[IsAuthenticated]
             )
     def subscribe(self, request, **kwargs):
-        pk = kwargs['id']
+        pk = int(kwargs['id'])
         user = request.user
 
         if request.method == 'DELETE':
-            get_object_or_404(Follow,
-                              follower=request.user,
-                              author_id=pk
-                              ).delete()
+            with transaction.atomic():
+                if not relations.delete(Follow, follower=user, author_id=pk):
+                    raise Http404('Вы не подписаны на этого пользователя.')
+                change_counter(User, pk, 'followers_count', -1)
+                change_counter(User, user.pk, 'following_count', -1)
+                timeline.remove(user.pk, pk)
+                timeline.unfollowed(pk)
             return Response(status=status.HTTP_204_NO_CONTENT)
 
         # if request.method == 'POST':
-        author = get_object_or_404(User, pk=pk)
-
-        if user.id == author.id:
+        if user.id == pk:
             raise ValidationError('Нельзя подписаться на самого себя')
 
-        _, created = Follow.objects.get_or_create(
-            follower=user, author=author)
+        # Автор нужен для ответа: загружаем один раз до вставки.
+        author = get_object_or_404(User, pk=pk)
+        try:
+            with transaction.atomic():
+                created = bool(relations.insert_many(
+                    Follow(follower=user, author=author), 'author', [pk]))
+                if created:
+                    change_counter(User, pk, 'followers_count', 1)
+                    change_counter(User, user.pk, 'following_count', 1)
+                    timeline.backfill(user.pk, pk)
+        except IntegrityError:
+            # Автора удалили одновременно с подпиской.
+            raise Http404('Пользователь не найден.')
         if not created:
             raise ValidationError(
                 f'Вы уже подписаны на пользователя {author.username}')
@@ -295,18 +595,17 @@ class UserWithSubscriptionViewSet(UserViewSet):
         )
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-    @action(detail=False, methods=['get'], permission_classes=[AllowAny])
+    @action(detail=False, methods=['get'],
+            permission_classes=[IsAuthenticated])
     def subscriptions(self, request):
-        authors = User.objects.filter(
-            pk__in=Follow.objects
-            .filter(follower=request.user)
-            .values_list('author__id', flat=True)
-        )
-        paginator = RecipePagination()
-        return paginator.get_paginated_response(
-            FollowedUserSerializer(
-                paginator.paginate_queryset(authors, request),
+        authors = build_subscriptions_queryset(
+            request.user, get_recipes_limit(request))
+        paginator = SubscriptionPagination()
+        page = paginator.paginate_queryset(authors, request)
+        with measure_serialize():
+            data = FollowedUserSerializer(
+                page,
                 many=True,
                 context={'request': request}
             ).data
-        )
+        return paginator.get_paginated_response(data)
@@ -37,6 +37,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -83,9 +84,27 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            # Тестовая БД в файле, а не в памяти: там SQLite ждёт снятия
+            # блокировок, и тесты одновременных запросов проходят.
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
         }
     }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    }
+}
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = int(os.getenv('CATALOG_CACHE_TIMEOUT', 60 * 60))
+# Как долго процесс не перечитывает версию справочников из базы, с:
+# за это время до него доходят изменения из других процессов.
+CATALOG_VERSION_TIMEOUT = int(os.getenv('CATALOG_VERSION_TIMEOUT', 30))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -129,9 +148,46 @@ REST_FRAMEWORK = {
     ],
 }
 
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 50))
+INGREDIENT_SEARCH_IN_MEMORY = (
+    os.getenv('INGREDIENT_SEARCH_IN_MEMORY', 'True') == 'True')
+
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+IMAGE_DECODE_WORKERS = int(os.getenv('IMAGE_DECODE_WORKERS', 2))
+IMAGE_DECODE_TIMEOUT = int(os.getenv('IMAGE_DECODE_TIMEOUT', 10))
+IMAGE_MAX_SIDE = int(os.getenv('IMAGE_MAX_SIDE', 6000))
+IMAGE_MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', 24_000_000))
+IMAGE_MAX_BYTES = int(os.getenv('IMAGE_MAX_BYTES', 10 * 1024 * 1024))
+IMAGE_VARIANTS_SYNC = os.getenv('IMAGE_VARIANTS_SYNC', 'False') == 'True'
+
+# Рецепты авторов с большим числом подписчиков не раздаются по лентам,
+# а подмешиваются при чтении.
+FEED_FANOUT_MAX_FOLLOWERS = int(os.getenv('FEED_FANOUT_MAX_FOLLOWERS', 5000))
+FEED_FANOUT_BATCH_SIZE = int(os.getenv('FEED_FANOUT_BATCH_SIZE', 1000))
+FEED_BACKFILL_LIMIT = int(os.getenv('FEED_BACKFILL_LIMIT', 100))
+
+SIMILAR_RECIPES_LIMIT = int(os.getenv('SIMILAR_RECIPES_LIMIT', 10))
+
+# Периоды полураспада весов для ?ordering=popular и trending, дни.
+# После изменения нужен refresh_popularity --full.
+POPULAR_HALF_LIFE_DAYS = float(os.getenv('POPULAR_HALF_LIFE_DAYS', 30))
+TRENDING_HALF_LIFE_DAYS = float(os.getenv('TRENDING_HALF_LIFE_DAYS', 3))
+# Вес добавления в корзину относительно добавления в избранное.
+POPULARITY_CART_WEIGHT = float(os.getenv('POPULARITY_CART_WEIGHT', 0.5))
+# Добавления моложе этого (с) пересчитываются заново при каждом
+# refresh_popularity: их транзакции могли ещё не завершиться.
+POPULARITY_REFRESH_GRACE = int(os.getenv('POPULARITY_REFRESH_GRACE', 600))
+
 DJOSER = {
     "SERIALIZERS": {
         "user": "api.serializers.FoodgramUserSerializer",
@@ -1,9 +1,13 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import Group
-from django.db.models import Count
+from django.db import transaction
+from django.db.models import Count, Q
 from django.utils.safestring import mark_safe
 
+from food.counters import relation_counters, relations_changed
+from library.images import variant_url
+
 from .models import (Favorite, Follow, Ingredient, Recipe, RecipeIngredient,
                      ShoppingCartItem, Tag, User)
 
@@ -54,13 +58,48 @@ class HasRecipesFilter(HasRelatedObjectsFilter):
 class RecipesCountMixin:
     list_display = ('recipes_count',)
 
-    @admin.display(description='В рецептах')
-    def recipes_count(self, user):
-        return user.recipes.count()
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            _recipes_count=Count('recipes', distinct=True)
+        )
+
+    @admin.display(description='В рецептах',
+                   ordering='_recipes_count')
+    def recipes_count(self, obj):
+        return obj._recipes_count
+
+
+class CountersAdminMixin:
+    """Поддерживает счётчики (food.counters.COUNTERS) при изменениях
+    через админку: API меняет их сам, а здесь объекты сохраняются и
+    удаляются в обход него."""
+
+    def cascaded(self, objects):
+        """Связи, которые удалятся каскадом вместе с objects."""
+        return []
+
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            if change and relation_counters(obj):
+                relations_changed(
+                    [type(obj).objects.get(pk=obj.pk)], -1)
+            super().save_model(request, obj, form, change)
+            relations_changed([obj], 1)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            relations_changed([obj, *self.cascaded([obj])], -1)
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            objects = list(queryset)
+            relations_changed([*objects, *self.cascaded(objects)], -1)
+            super().delete_queryset(request, queryset)
 
 
 @admin.register(User)
-class UserProfileAdmin(UserAdmin, RecipesCountMixin,):
+class UserProfileAdmin(CountersAdminMixin, UserAdmin):
     model = User
 
     list_display = (
@@ -72,7 +111,7 @@ class UserProfileAdmin(UserAdmin, RecipesCountMixin,):
         'following_count',
         'followers_count',
         'is_staff',
-        *RecipesCountMixin.list_display,
+        'recipes_count',
     )
     list_filter = (
         'is_staff',
@@ -84,14 +123,6 @@ class UserProfileAdmin(UserAdmin, RecipesCountMixin,):
         HasSubscribersFilter,  # кто читает пользователя
     )
 
-    @admin.display(description='Подписок')
-    def following_count(self, user):
-        return user.follower_followes.count()
-
-    @admin.display(description='Подписчиков')
-    def followers_count(self, author):
-        return author.author_followes.count()
-
     @admin.display(description='Полное имя')
     def full_name(self, user):
         return f'{user.first_name} {user.last_name}'
@@ -117,25 +148,34 @@ class UserProfileAdmin(UserAdmin, RecipesCountMixin,):
     search_fields = ('username', 'email', 'first_name', 'last_name')
     ordering = ('id',)
 
+    def cascaded(self, users):
+        return [
+            *Follow.objects.filter(
+                Q(follower__in=users) | Q(author__in=users)),
+            *Favorite.objects.filter(user__in=users),
+            *ShoppingCartItem.objects.filter(user__in=users),
+        ]
+
     @admin.display(description='Аватар')
     def avatar_preview(self, user):
         if user.avatar:
             return mark_safe(
-                f'<img src="{user.avatar.url}" width="40" height="40" '
+                f'<img src="{variant_url(user.avatar, "avatar")}" '
+                f'width="40" height="40" '
                 f'style="object-fit: cover; border-radius: 4px;" />'
             )
         return '-'
 
 
 @admin.register(Follow)
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(CountersAdminMixin, admin.ModelAdmin):
     list_display = ('follower', 'author')
     search_fields = ('follower__username', 'aurhor__username')
     list_filter = ('follower', 'author')
 
 
 @admin.register(Tag)
-class TagAdmin(admin.ModelAdmin, RecipesCountMixin):
+class TagAdmin(RecipesCountMixin, admin.ModelAdmin):
     list_display = ('id', 'name', 'slug', *RecipesCountMixin.list_display)
     search_fields = ('name', 'slug')
 
@@ -147,14 +187,10 @@ class IngredientAdmin(RecipesCountMixin, admin.ModelAdmin):
     search_fields = ('name', 'measurement_unit')
     list_filter = ('measurement_unit', HasRecipesFilter)
 
-    def get_queryset(self, request):
-        queryset = super().get_queryset(request)
-        return queryset.prefetch_related('recipes')
-
 
 @admin.register(Favorite, ShoppingCartItem)
-class UserRecipeRelationAdmin(admin.ModelAdmin):
-    list_display = ('user', 'recipe')
+class UserRecipeRelationAdmin(CountersAdminMixin, admin.ModelAdmin):
+    list_display = ('user', 'recipe', 'created_at')
     search_fields = ('user__username', 'recipe__name')
     list_filter = ('user',)
 
@@ -221,7 +257,7 @@ class CookingTimeFilter(admin.SimpleListFilter):
 
 
 @admin.register(Recipe)
-class RecipeAdmin(admin.ModelAdmin):
+class RecipeAdmin(CountersAdminMixin, admin.ModelAdmin):
     list_display = (
         'id', 'name', 'cooking_time', 'author',
         'favorites_count', 'products_list', 'tags_list', 'image_tag'
@@ -230,17 +266,6 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('author', CookingTimeFilter, 'tags')
     inlines = (RecipeIngredientInline,)
 
-    def get_queryset(self, request):
-        qs = super().get_queryset(request)
-        return qs.annotate(
-            _favorites_count=Count(
-                'favorites', distinct=True)
-        )
-
-    @admin.display(description='В избранном')
-    def favorites_count(self, recipe):
-        return recipe._favorites_count
-
     @admin.display(description='Продукты')
     def products_list(self, recipe):
         return mark_safe('<br>'.join([
@@ -256,7 +281,7 @@ class RecipeAdmin(admin.ModelAdmin):
     @admin.display(description='Изображение')
     def image_tag(self, recipe):
         return mark_safe(
-            f'<img src="{recipe.image.url}" '
+            f'<img src="{variant_url(recipe.image, "thumbnail")}" '
             f'style="height: 50px; object-fit: cover; border-radius: 4px;" />'
         )
         return ''
@@ -1,7 +1,18 @@
 # backend/food/apps.py
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'food'
+
+    def ready(self):
+        from food import catalog  # noqa: F401
+        from food.models import Recipe, User
+        from food.search import install_sqlite_search
+        from library.images import register
+
+        register(Recipe, 'image', ('card', 'thumbnail'))
+        register(User, 'avatar', ('avatar', 'thumbnail'))
+        post_migrate.connect(install_sqlite_search, sender=self)
@@ -0,0 +1,79 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from food.models import CatalogVersion, Ingredient, Tag
+
+CATALOG_VERSION_KEY = 'food:catalog-version'
+
+
+def get_catalog_cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def get_catalog_version():
+    """Версия справочников тегов и продуктов.
+
+    Меняется при любом изменении справочников, поэтому входит в ключи
+    кэша: устаревшие записи просто перестают запрашиваться. Сама версия
+    хранится в базе (CatalogVersion), а в кэше — лишь на
+    CATALOG_VERSION_TIMEOUT секунд: так изменения из других процессов
+    доходят и при кэше в памяти процесса.
+    """
+    cache = get_catalog_cache()
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        version = CatalogVersion.objects.filter(pk=1).values_list(
+            'version', flat=True).first()
+        if version is None:
+            # Начальное значение от времени, чтобы после пересоздания
+            # строки не вернуться к уже использованному номеру версии.
+            version = CatalogVersion.objects.get_or_create(
+                pk=1, defaults={'version': time.time_ns()})[0].version
+        cache.set(CATALOG_VERSION_KEY, version,
+                  settings.CATALOG_VERSION_TIMEOUT)
+    return version
+
+
+def bump_catalog_version():
+    if not CatalogVersion.objects.filter(pk=1).update(
+            version=F('version') + 1):
+        CatalogVersion.objects.get_or_create(
+            pk=1, defaults={'version': time.time_ns()})
+    version = CatalogVersion.objects.values_list(
+        'version', flat=True).get(pk=1)
+    get_catalog_cache().set(CATALOG_VERSION_KEY, version,
+                            settings.CATALOG_VERSION_TIMEOUT)
+    return version
+
+
+def get_tags():
+    """Словарь id -> тег всех тегов из кэша справочников."""
+    cache = get_catalog_cache()
+    key = f'food:tags:{get_catalog_version()}'
+    tags = cache.get(key)
+    if tags is None:
+        tags = Tag.objects.in_bulk()
+        cache.set(key, tags, settings.CATALOG_CACHE_TIMEOUT)
+    return tags
+
+
+def get_tag_ids():
+    """Словарь slug -> id всех тегов из кэша справочников."""
+    return {tag.slug: pk for pk, tag in get_tags().items()}
+
+
+def resolve_tags(ids):
+    """Теги с id из ids (для BulkPrimaryKeyRelatedField)."""
+    tags = get_tags()
+    return {pk: tags[pk] for pk in ids if pk in tags}
+
+
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+def catalog_changed(**kwargs):
+    bump_catalog_version()
@@ -11,3 +11,5 @@ USER_USERNAME_LENGTH = 150
 
 RECIPE_MIN_COOKING_TIME = 1  # in minutes
 INGREDIENT_MIN_AMOUNT = 1  # minimum amount of ingredient in a recipe
+RECIPES_LIMIT_MAX = 100  # maximum recipes per author in subscriptions
+BULK_RECIPES_MAX = 100  # maximum recipes per bulk cart/favorites request
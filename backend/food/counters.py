@@ -0,0 +1,95 @@
+from collections import Counter
+
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+
+from food.models import Favorite, Follow, Recipe, ShoppingCartItem, User
+
+# Модель со счётчиком -> {поле счётчика: (связанная модель, поле связи)}.
+COUNTERS = {
+    Recipe: {
+        'favorites_count': (Favorite, 'recipe'),
+        'carts_count': (ShoppingCartItem, 'recipe'),
+    },
+    User: {
+        'recipes_count': (Recipe, 'author'),
+        'followers_count': (Follow, 'author'),
+        'following_count': (Follow, 'follower'),
+    },
+}
+
+
+def counter_value(field, delta):
+    # Счётчик мог отстать (связь создана в обход API): не уходим ниже нуля,
+    # точное значение восстановит recount.
+    return Greatest(F(field) + delta, 0)
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно изменяет счётчик одной строки выражением F()."""
+    model.objects.filter(pk=pk).update(**{field: counter_value(field, delta)})
+
+
+def change_counters(model, pks, field, delta):
+    """Изменяет счётчик строк pks одним UPDATE."""
+    if pks:
+        model.objects.filter(pk__in=pks).update(
+            **{field: counter_value(field, delta)})
+
+
+def relation_counters(obj):
+    """Счётчики, которые учитывают obj: [(модель, pk, поле счётчика)]."""
+    return [
+        (model, getattr(obj, f'{relation}_id'), field)
+        for model, fields in COUNTERS.items()
+        for field, (related_model, relation) in fields.items()
+        if isinstance(obj, related_model)
+    ]
+
+
+def relations_changed(objects, delta):
+    """Изменяет счётчики после добавления (delta=1) или удаления (-1)
+    objects в обход API: по UPDATE на каждый затронутый счётчик."""
+    totals = Counter(
+        counter for obj in objects for counter in relation_counters(obj))
+    for (model, pk, field), count in totals.items():
+        change_counter(model, pk, field, count * delta)
+
+
+def recount_batch(model, pks):
+    """Пересчитывает счётчики строк pks; возвращает число исправленных."""
+    fields = COUNTERS[model]
+    objects = list(model.objects.filter(pk__in=pks).only('pk', *fields))
+    actual = {}
+    for field, (related_model, relation) in fields.items():
+        actual[field] = dict(
+            related_model.objects.filter(**{f'{relation}__in': pks})
+            .values_list(relation).annotate(total=Count('pk'))
+            .order_by()
+        )
+    changed = []
+    for obj in objects:
+        drifted = False
+        for field in fields:
+            value = actual[field].get(obj.pk, 0)
+            if getattr(obj, field) != value:
+                setattr(obj, field, value)
+                drifted = True
+        if drifted:
+            changed.append(obj)
+    model.objects.bulk_update(changed, list(fields))
+    return len(changed)
+
+
+def recount(model, batch_size=1000):
+    """Пересчитывает счётчики модели пакетами по возрастанию pk."""
+    last_pk = 0
+    while True:
+        pks = list(
+            model.objects.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not pks:
+            return
+        yield len(pks), recount_batch(model, pks)
+        last_pk = pks[-1]
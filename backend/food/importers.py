@@ -0,0 +1,199 @@
+import csv
+import io
+import json
+from itertools import islice
+from time import perf_counter
+
+from django.db import connection, transaction
+
+READ_CHUNK_SIZE = 64 * 1024
+SEPARATORS = frozenset(', \t\r\n')
+
+
+def iter_json_array(file, chunk_size=READ_CHUNK_SIZE):
+    """Элементы JSON-массива верхнего уровня без загрузки файла целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+    started = False
+    while True:
+        while position < len(buffer) and buffer[position] in SEPARATORS:
+            if buffer[position] == ',' and not started:
+                break
+            position += 1
+        if position < len(buffer):
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError('Ожидался JSON-массив объектов.')
+                position += 1
+                started = True
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # Элемент в самом конце буфера мог быть прочитан не целиком.
+                if end < len(buffer) or eof:
+                    yield item
+                    position = end
+                    continue
+        if eof:
+            raise ValueError('Неожиданный конец JSON-файла.')
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def iter_csv_rows(file, fields):
+    for row in csv.reader(file):
+        if row:
+            yield dict(zip(fields, (value.strip() for value in row)))
+
+
+def iter_batches(items, batch_size):
+    items = iter(items)
+    while batch := list(islice(items, batch_size)):
+        yield batch
+
+
+class BatchImporter:
+    """Пакетная загрузка строк в модель с подсчётом реально добавленных.
+
+    Конфликты по unique_fields пропускаются либо, если заданы
+    update_fields, обновляют существующие строки (upsert). Строки, чьё
+    значение другого уникального поля уже занято строкой с другим
+    ключом, пропускаются и попадают в skipped как (строка, поле).
+    На PostgreSQL пакет может грузиться через COPY во временную таблицу
+    и INSERT ... ON CONFLICT из неё.
+    """
+
+    def __init__(self, model, fields, unique_fields, update_fields=(),
+                 batch_size=1000, use_copy=None, progress=None):
+        self.model = model
+        self.fields = list(fields)
+        self.unique_fields = list(unique_fields)
+        self.update_fields = list(update_fields)
+        self.batch_size = batch_size
+        if use_copy is None:
+            use_copy = connection.vendor == 'postgresql'
+        self.use_copy = use_copy
+        self.progress = progress
+        self.other_unique_fields = [
+            field.name for field in model._meta.concrete_fields
+            if field.unique and not field.primary_key
+            and field.name in self.fields
+            and field.name not in self.unique_fields
+        ]
+        self.skipped = []
+        self.processed = 0
+        self.inserted = 0
+        self.elapsed = 0.0
+
+    @property
+    def rate(self):
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    def run(self, rows):
+        started = perf_counter()
+        before = self.model.objects.count()
+        for batch in iter_batches(rows, self.batch_size):
+            self.processed += len(batch)
+            # Повтор ключа внутри одного INSERT ... ON CONFLICT DO UPDATE
+            # PostgreSQL не допускает: оставляем последнюю версию строки.
+            batch = list({
+                tuple(row.get(field) for field in self.unique_fields): row
+                for row in batch
+            }.values())
+            batch = self.skip_conflicts(batch)
+            with transaction.atomic():
+                if self.use_copy:
+                    self.copy_batch(batch)
+                else:
+                    self.insert_batch(batch)
+            self.elapsed = perf_counter() - started
+            if self.progress:
+                self.progress(self)
+        self.inserted = self.model.objects.count() - before
+        self.elapsed = perf_counter() - started
+        return self
+
+    def key(self, row):
+        return tuple(row.get(field) for field in self.unique_fields)
+
+    def skip_conflicts(self, batch):
+        """Убирает строки, которые нарушили бы уникальность полей, кроме
+        unique_fields: ON CONFLICT обрабатывает только один ключ, и такая
+        строка прервала бы загрузку."""
+        for field in self.other_unique_fields:
+            owners = {
+                value: tuple(key)
+                for value, *key in self.model.objects.filter(**{
+                    f'{field}__in': {row.get(field) for row in batch}
+                }).values_list(field, *self.unique_fields)
+            }
+            kept = []
+            for row in batch:
+                owner = owners.setdefault(row.get(field), self.key(row))
+                if owner == self.key(row):
+                    kept.append(row)
+                else:
+                    self.skipped.append((row, field))
+            batch = kept
+        return batch
+
+    def insert_batch(self, batch):
+        options = {'ignore_conflicts': True}
+        if self.update_fields:
+            options = {
+                'update_conflicts': True,
+                'unique_fields': self.unique_fields,
+                'update_fields': self.update_fields,
+            }
+        self.model.objects.bulk_create(
+            (self.model(**{field: row.get(field) for field in self.fields})
+             for row in batch),
+            **options
+        )
+
+    def quote_columns(self, fields):
+        return ', '.join(
+            connection.ops.quote_name(self.model._meta.get_field(field).column)
+            for field in fields
+        )
+
+    def copy_batch(self, batch):
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        columns = self.quote_columns(self.fields)
+        conflict = self.quote_columns(self.unique_fields)
+        if self.update_fields:
+            action = 'DO UPDATE SET ' + ', '.join(
+                f'{column} = EXCLUDED.{column}'
+                for column in self.quote_columns(
+                    self.update_fields).split(', ')
+            )
+        else:
+            action = 'DO NOTHING'
+        data = io.StringIO()
+        writer = csv.writer(data)
+        for row in batch:
+            writer.writerow(row.get(field) for field in self.fields)
+        data.seek(0)
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS import_batch')
+            cursor.execute(
+                'CREATE TEMP TABLE import_batch ON COMMIT DROP AS '
+                f'SELECT {columns} FROM {table} WITH NO DATA'
+            )
+            cursor.cursor.copy_expert(
+                f'COPY import_batch ({columns}) FROM STDIN WITH CSV', data)
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) '
+                f'SELECT {columns} FROM import_batch '
+                f'ON CONFLICT ({conflict}) {action}'
+            )
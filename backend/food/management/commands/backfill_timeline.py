@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from food import timeline
+from food.models import Follow, TimelineEntry
+
+
+class Command(BaseCommand):
+    help = ('Заполнение лент подписок последними рецептами авторов: '
+            'после массовой загрузки данных или для новых подписок, '
+            'созданных в обход API.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int,
+                            help='Только ленту этого пользователя (id)')
+        parser.add_argument('--author', type=int,
+                            help='Только рецепты этого автора (id)')
+        parser.add_argument('--limit', type=int,
+                            help='Рецептов каждого автора (по умолчанию '
+                                 'FEED_BACKFILL_LIMIT)')
+        parser.add_argument('--clear', action='store_true',
+                            help='Сначала удалить записи этих лент')
+
+    def handle(self, *args, **options):
+        follows = Follow.objects.order_by('pk')
+        entries = TimelineEntry.objects.all()
+        if options['user']:
+            follows = follows.filter(follower_id=options['user'])
+            entries = entries.filter(user_id=options['user'])
+        if options['author']:
+            follows = follows.filter(author_id=options['author'])
+            entries = entries.filter(author_id=options['author'])
+        with transaction.atomic():
+            if options['clear']:
+                entries.delete()
+            total = sum(
+                timeline.backfill(follower_id, author_id, options['limit'])
+                for follower_id, author_id in follows.values_list(
+                    'follower_id', 'author_id').iterator()
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Записей в лентах добавлено (с уже существующими): {total}'))
@@ -1,40 +1,106 @@
 # запускать команды для загрузки данных можно так:
 # python manage.py load_ingredients_json ../data/ingredients.json
+# python manage.py load_ingredients_json ../data/ingredients.csv
 # python manage.py load_tags_json ../data/tags.json
 
-import json
+from pathlib import Path
 
 from django.core.management.base import BaseCommand
 
+from food.catalog import bump_catalog_version
+from food.importers import BatchImporter, iter_csv_rows, iter_json_array
+
 
 class BaseLoadCommand(BaseCommand):
-    model = None  # установить в дочернем классе
+    help = 'Импорт данных из JSON- или CSV-файла'
+
+    # установить в дочернем классе
+    model = None
+    fields = ()  # порядок колонок в CSV
+    unique_fields = ()
+    update_fields = ()  # обновляются при конфликте по unique_fields
 
     def add_arguments(self, parser):
         parser.add_argument(
             'file_path',
             type=str,
-            help='Путь к JSON-файлу'
+            help='Путь к JSON- или CSV-файлу'
+        )
+        parser.add_argument(
+            '--format',
+            choices=('json', 'csv'),
+            help='Формат файла (по умолчанию — по расширению)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Сколько строк записывать за один запрос'
+        )
+        parser.add_argument(
+            '--progress-every',
+            type=int,
+            default=10000,
+            help='Как часто (в строках) сообщать о ходе загрузки'
+        )
+        parser.add_argument(
+            '--no-update',
+            action='store_true',
+            help='Не обновлять существующие записи, только добавлять новые'
+        )
+        parser.add_argument(
+            '--no-copy',
+            action='store_true',
+            help='Не использовать COPY на PostgreSQL'
         )
 
-    class Command(BaseCommand):
-        help = 'Импорт данных из JSON-файла'
+    def read_rows(self, file, file_format):
+        if file_format == 'csv':
+            return iter_csv_rows(file, self.fields)
+        return iter_json_array(file)
+
+    def report_progress(self, importer):
+        if importer.processed >= self.next_report:
+            self.next_report += self.progress_every
+            self.stdout.write(
+                f'Обработано {importer.processed} строк, '
+                f'{importer.rate:.0f} строк/с'
+            )
 
     def handle(self, *args, **options):
         file_path = options['file_path']
+        file_format = (options['format']
+                       or Path(file_path).suffix.lstrip('.').lower())
+        self.progress_every = self.next_report = options['progress_every']
+        importer = BatchImporter(
+            self.model,
+            fields=self.fields,
+            unique_fields=self.unique_fields,
+            update_fields=() if options['no_update'] else self.update_fields,
+            batch_size=options['batch_size'],
+            use_copy=False if options['no_copy'] else None,
+            progress=self.report_progress,
+        )
         try:
-            with open(file_path, encoding='utf-8') as file:
-                created = self.model.objects.bulk_create(
-                    (self.model(**item) for item in json.load(file)),
-                    ignore_conflicts=True
-                )
-                self.stdout.write(
-                    self.style.SUCCESS(
-                        f'Добавлено {len(created)}'
-                        f' объектов из файла "{file_path}"'
-                    )
-                )
+            with open(file_path, encoding='utf-8', newline='') as file:
+                importer.run(self.read_rows(file, file_format))
         except Exception as e:
             self.stderr.write(self.style.ERROR(
                 f'Ошибка при обработке файла {file_path}: {e}'
             ))
+            return
+        finally:
+            if importer.processed:
+                bump_catalog_version()
+        for row, field in importer.skipped:
+            self.stdout.write(self.style.WARNING(
+                f'Пропущена строка {row}: значение поля {field} уже занято'
+            ))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Добавлено {importer.inserted} объектов из файла '
+                f'"{file_path}" (обработано {importer.processed} строк '
+                f'за {importer.elapsed:.2f} с, '
+                f'{importer.rate:.0f} строк/с)'
+            )
+        )
@@ -0,0 +1,87 @@
+import json
+import os
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from food.importers import BatchImporter, iter_json_array
+from food.models import Ingredient
+
+
+class Rollback(Exception):
+    pass
+
+
+def load_whole_file(file_path):
+    # Прежняя реализация BaseLoadCommand: файл целиком и один bulk_create.
+    with open(file_path, encoding='utf-8') as file:
+        Ingredient.objects.bulk_create(
+            (Ingredient(**item) for item in json.load(file)),
+            ignore_conflicts=True
+        )
+
+
+def load_streaming(file_path, batch_size):
+    with open(file_path, encoding='utf-8') as file:
+        BatchImporter(
+            Ingredient,
+            fields=('name', 'measurement_unit'),
+            unique_fields=('name', 'measurement_unit'),
+            batch_size=batch_size,
+        ).run(iter_json_array(file))
+
+
+class Command(BaseCommand):
+    help = ('Сравнение прежней загрузки продуктов и потоковой '
+            'на синтетическом файле (изменения в БД откатываются).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--memory', action='store_true',
+                            help='Также измерить пик памяти (tracemalloc)')
+
+    def run_rolled_back(self, load):
+        started = perf_counter()
+        try:
+            with transaction.atomic():
+                load()
+                raise Rollback
+        except Rollback:
+            pass
+        return perf_counter() - started
+
+    def measure(self, title, load, rows, memory):
+        elapsed = self.run_rolled_back(load)
+        line = f'{title:<12} {elapsed:.2f} с, {rows / elapsed:.0f} строк/с'
+        if memory:
+            # Отдельный прогон: трассировка памяти сильно замедляет код.
+            tracemalloc.start()
+            self.run_rolled_back(load)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            line += f', пик памяти {peak / 2 ** 20:.1f} МБ'
+        self.stdout.write(line)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        with tempfile.NamedTemporaryFile(
+                'w', suffix='.json', encoding='utf-8', delete=False) as file:
+            json.dump(
+                [{'name': f'продукт {index}', 'measurement_unit': 'г'}
+                 for index in range(rows)],
+                file, ensure_ascii=False
+            )
+        try:
+            self.measure('json.load', lambda: load_whole_file(file.name),
+                         rows, options['memory'])
+            self.measure(
+                'потоковая',
+                lambda: load_streaming(file.name, options['batch_size']),
+                rows, options['memory']
+            )
+        finally:
+            os.remove(file.name)
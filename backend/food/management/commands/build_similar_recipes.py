@@ -0,0 +1,27 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from food.similarity import build
+
+
+class Command(BaseCommand):
+    help = ('Пересчёт похожих рецептов (MinHash и LSH по продуктам и '
+            'тегам). По умолчанию — только для изменённых рецептов; '
+            'запускается по расписанию.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Пересчитать все рецепты')
+        parser.add_argument('--limit', type=int,
+                            help='Соседей на рецепт (по умолчанию '
+                                 'SIMILAR_RECIPES_LIMIT)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = perf_counter()
+        total = build(full=options['full'], limit=options['limit'],
+                      batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано рецептов: {total} за '
+            f'{perf_counter() - started:.1f} с'))
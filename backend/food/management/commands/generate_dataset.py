@@ -0,0 +1,275 @@
+import random
+from datetime import timedelta
+from itertools import accumulate
+from time import perf_counter
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from food import popularity, timeline
+from food.catalog import bump_catalog_version
+from food.counters import COUNTERS, recount
+from food.importers import iter_batches
+from food.models import (Favorite, Follow, Ingredient, Recipe,
+                         RecipeIngredient, ShoppingCartItem, Tag, User)
+
+PREFIX = 'bench'
+PASSWORD = 'bench-password'
+
+# Объёмы на единицу --scale.
+USERS = 100
+RECIPES = 1000
+FAVORITES = 3000
+CART_ITEMS = 1000
+FOLLOWS = 500
+CATALOG_INGREDIENTS = 2000
+TAGS = 12
+# Показатель степенного распределения популярности (закон Ципфа).
+ZIPF_EXPONENT = 1.1
+
+FIRST_NAMES = ('Анна', 'Иван', 'Мария', 'Пётр', 'Ольга', 'Сергей',
+               'Елена', 'Дмитрий', 'Наталья', 'Алексей')
+LAST_NAMES = ('Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов',
+              'Лебедев', 'Козлов', 'Новиков', 'Морозов', 'Волков')
+DISHES = ('суп', 'салат', 'пирог', 'рагу', 'омлет', 'каша', 'запеканка',
+          'паста', 'плов', 'блины', 'котлеты', 'десерт')
+ADJECTIVES = ('домашний', 'быстрый', 'пряный', 'летний', 'зимний',
+              'лёгкий', 'сытный', 'бабушкин', 'острый', 'нежный')
+UNITS = ('г', 'кг', 'мл', 'л', 'шт.', 'ст. л.', 'ч. л.', 'по вкусу')
+
+
+class Zipf:
+    """Выбор элементов с вероятностью ~ 1 / ранг ** s.
+
+    Ранги перемешаны, поэтому популярность не связана с порядком id.
+    """
+
+    def __init__(self, items, rng, exponent=ZIPF_EXPONENT):
+        self.items = list(items)
+        rng.shuffle(self.items)
+        self.cum_weights = list(accumulate(
+            1 / rank ** exponent for rank in range(1, len(self.items) + 1)))
+        self.rng = rng
+
+    def choices(self, k):
+        return self.rng.choices(self.items, cum_weights=self.cum_weights,
+                                k=k)
+
+    def sample(self, k):
+        """До k различных элементов (популярные попадаются чаще)."""
+        return list(dict.fromkeys(self.choices(k * 2)))[:k]
+
+
+class Command(BaseCommand):
+    help = ('Генерация воспроизводимого синтетического набора данных для '
+            'нагрузочных тестов: пользователи, рецепты, продукты в '
+            'рецептах, подписки, избранное и корзины.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale', type=float, default=1,
+            help=f'Масштаб: {USERS} пользователей и {RECIPES} рецептов '
+                 'на единицу'
+        )
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--clear', action='store_true',
+            help=f'Сначала удалить ранее сгенерированные данные ({PREFIX}*)'
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        scale = options['scale']
+        if options['clear']:
+            self.clear()
+        if User.objects.filter(username__startswith=f'{PREFIX}_').exists():
+            self.stderr.write(self.style.ERROR(
+                'Набор данных уже сгенерирован; добавьте --clear.'))
+            return
+        started = perf_counter()
+        users = self.create_users(max(2, round(USERS * scale)))
+        tags = self.create_tags()
+        ingredients = self.get_ingredients(
+            max(10, round(CATALOG_INGREDIENTS * min(scale, 1))))
+        recipes = self.create_recipes(users, round(RECIPES * scale))
+        self.create_recipe_tags(recipes, tags)
+        self.create_recipe_ingredients(recipes, ingredients)
+        self.create_user_recipes(Favorite, users, recipes,
+                                 round(FAVORITES * scale))
+        self.create_user_recipes(ShoppingCartItem, users, recipes,
+                                 round(CART_ITEMS * scale))
+        self.create_follows(users, round(FOLLOWS * scale))
+        self.timed('Счётчики', self.recount)
+        # Ленты — после счётчиков: раздача зависит от числа подписчиков.
+        self.timed('Ленты подписок', self.backfill_timelines)
+        self.timed('Популярность', lambda: popularity.refresh(full=True))
+        # bulk_create не шлёт сигналов: сбрасываем кэш справочников сами.
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {perf_counter() - started:.1f} с. '
+            f'Пароль пользователей {PREFIX}_*: {PASSWORD}'
+        ))
+
+    def timed(self, title, create):
+        started = perf_counter()
+        with transaction.atomic():
+            rows = create()
+        elapsed = perf_counter() - started
+        self.stdout.write(
+            f'{title}: {rows or 0} за {elapsed:.1f} с'
+            + (f' ({rows / elapsed:.0f} строк/с)' if rows and elapsed else '')
+        )
+
+    def bulk_create(self, model, objects):
+        """Сохраняет объекты пакетами; objects может быть генератором:
+        в памяти тогда только текущий пакет."""
+        count = 0
+        for batch in iter_batches(objects, self.batch_size):
+            model.objects.bulk_create(batch, batch_size=self.batch_size)
+            count += len(batch)
+        return count
+
+    def clear(self):
+        users = User.objects.filter(username__startswith=f'{PREFIX}_')
+        self.timed('Удалено пользователей',
+                   lambda: users.delete()[1].get(User._meta.label, 0))
+        Tag.objects.filter(slug__startswith=f'{PREFIX}-').delete()
+        Ingredient.objects.filter(name__startswith=f'{PREFIX} ').delete()
+        bump_catalog_version()
+
+    def create_users(self, total):
+        # Хэш пароля считается один раз: PBKDF2 на каждого — минуты.
+        password = make_password(PASSWORD)
+        self.timed('Пользователи', lambda: self.bulk_create(User, [
+            User(
+                username=f'{PREFIX}_{index}',
+                email=f'{PREFIX}_{index}@example.com',
+                first_name=self.rng.choice(FIRST_NAMES),
+                last_name=self.rng.choice(LAST_NAMES),
+                password=password,
+            )
+            for index in range(total)
+        ]))
+        return list(User.objects.filter(
+            username__startswith=f'{PREFIX}_'
+        ).order_by('id').values_list('id', flat=True))
+
+    def create_tags(self):
+        self.timed('Теги', lambda: self.bulk_create(Tag, [
+            Tag(name=f'{PREFIX} {index}', slug=f'{PREFIX}-{index}')
+            for index in range(TAGS)
+        ]))
+        return list(Tag.objects.filter(
+            slug__startswith=f'{PREFIX}-').values_list('id', flat=True))
+
+    def get_ingredients(self, total):
+        # Реальный каталог (load_ingredients_json), если он загружен.
+        ingredients = list(Ingredient.objects.order_by('id').values_list(
+            'id', flat=True))
+        if len(ingredients) >= total:
+            return ingredients
+        self.timed('Продукты', lambda: self.bulk_create(Ingredient, [
+            Ingredient(name=f'{PREFIX} продукт {index}',
+                       measurement_unit=self.rng.choice(UNITS))
+            for index in range(total)
+        ]))
+        return list(Ingredient.objects.order_by('id').values_list(
+            'id', flat=True))
+
+    def create_recipes(self, users, total):
+        authors = Zipf(users, self.rng)
+        now = timezone.now()
+
+        def recipes():
+            # Авторы выбираются по пакету: список на все рецепты не нужен.
+            for start in range(0, total, self.batch_size):
+                batch = authors.choices(min(self.batch_size, total - start))
+                for index, author in enumerate(batch, start):
+                    yield Recipe(
+                        author_id=author,
+                        name=(f'{self.rng.choice(ADJECTIVES).capitalize()} '
+                              f'{self.rng.choice(DISHES)} №{index}'),
+                        text='Сгенерированный рецепт для нагрузочного теста.',
+                        image='recipes/bench.png',
+                        cooking_time=self.rng.randint(5, 180),
+                        pub_date=now - timedelta(
+                            seconds=self.rng.randrange(365 * 24 * 3600)),
+                    )
+
+        self.timed('Рецепты', lambda: self.bulk_create(Recipe, recipes()))
+        return list(Recipe.objects.filter(
+            author__username__startswith=f'{PREFIX}_'
+        ).order_by('id').values_list('id', flat=True))
+
+    def create_recipe_tags(self, recipes, tags):
+        tags = Zipf(tags, self.rng)
+        through = Recipe.tags.through
+        self.timed('Теги рецептов', lambda: self.bulk_create(through, (
+            through(recipe_id=recipe, tag_id=tag)
+            for recipe in recipes
+            for tag in tags.sample(self.rng.randint(1, 3))
+        )))
+
+    def create_recipe_ingredients(self, recipes, ingredients):
+        ingredients = Zipf(ingredients, self.rng)
+        # Генератор: миллион объектов целиком не держим.
+        self.timed('Продукты в рецептах', lambda: self.bulk_create(
+            RecipeIngredient, (
+                RecipeIngredient(recipe_id=recipe, ingredient_id=item,
+                                 amount=self.rng.randint(1, 500))
+                for recipe in recipes
+                for item in ingredients.sample(self.rng.randint(2, 12))
+            )))
+
+    def pairs(self, users, targets, total, exclude_self=False):
+        """Различные пары (пользователь, объект); активность
+        пользователей и популярность объектов степенные."""
+        users = Zipf(users, self.rng)
+        targets = Zipf(targets, self.rng)
+        pairs = set()
+        # Популярные пары быстро повторяются: ограничиваем число попыток.
+        for _ in range(10):
+            missing = total - len(pairs)
+            if missing <= 0:
+                break
+            pairs.update(
+                pair for pair in zip(users.choices(missing),
+                                     targets.choices(missing))
+                if not exclude_self or pair[0] != pair[1]
+            )
+        return sorted(pairs)
+
+    def create_user_recipes(self, model, users, recipes, total):
+        now = timezone.now()
+        self.timed(model._meta.verbose_name_plural, lambda: self.bulk_create(
+            model, [model(user_id=user, recipe_id=recipe,
+                          created_at=now - timedelta(
+                              seconds=self.rng.randrange(90 * 24 * 3600)))
+                    for user, recipe in self.pairs(users, recipes, total)]
+        ))
+
+    def create_follows(self, users, total):
+        self.timed('Подписки', lambda: self.bulk_create(Follow, [
+            Follow(follower_id=follower, author_id=author)
+            for follower, author in self.pairs(users, users, total,
+                                               exclude_self=True)
+        ]))
+
+    def backfill_timelines(self):
+        return sum(
+            timeline.backfill(follower, author)
+            for follower, author in Follow.objects.filter(
+                follower__username__startswith=f'{PREFIX}_'
+            ).values_list('follower_id', 'author_id').iterator()
+        )
+
+    def recount(self):
+        return sum(
+            fixed
+            for model in COUNTERS
+            for _, fixed in recount(model)
+        )
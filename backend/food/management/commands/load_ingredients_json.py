@@ -5,3 +5,5 @@ from .base_load_command import BaseLoadCommand
 
 class Command(BaseLoadCommand):
     model = Ingredient
+    fields = ('name', 'measurement_unit')
+    unique_fields = ('name', 'measurement_unit')
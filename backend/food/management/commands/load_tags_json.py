@@ -5,3 +5,6 @@ from .base_load_command import BaseLoadCommand
 
 class Command(BaseLoadCommand):
     model = Tag
+    fields = ('name', 'slug')
+    unique_fields = ('slug',)
+    update_fields = ('name',)
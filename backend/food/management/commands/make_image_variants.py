@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from library.images import (get_executor, has_variants, mark_variants,
+                            registry, safe_make_variants)
+
+
+class Command(BaseCommand):
+    help = ('Построение уменьшенных вариантов (WebP/JPEG) для уже '
+            'загруженных изображений рецептов и аватаров.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Перестроить и уже готовые варианты')
+
+    def handle(self, *args, **options):
+        executor = get_executor()
+        for model, field_name, variants in registry:
+            files = (
+                getattr(instance, field_name)
+                for instance in model.objects.exclude(
+                    **{field_name: ''}).exclude(
+                    **{f'{field_name}__isnull': True}
+                ).only(
+                    'pk', field_name, f'{field_name}_variants_source'
+                ).iterator()
+            )
+            pending = [
+                fieldfile for fieldfile in files
+                if fieldfile.storage.exists(fieldfile.name)
+                and (options['force'] or not has_variants(fieldfile))
+            ]
+            # Готовность отмечается здесь: в потоках пула свои соединения.
+            done = 0
+            for fieldfile, created in zip(pending, executor.map(
+                    safe_make_variants, pending, [variants] * len(pending),
+                    [''] * len(pending), [False] * len(pending))):
+                if created:
+                    mark_variants(fieldfile)
+                    done += 1
+            self.stdout.write(self.style.SUCCESS(
+                f'{model._meta.verbose_name_plural}.{field_name}: '
+                f'обработано {done} из {len(pending)}'
+            ))
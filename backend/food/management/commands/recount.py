@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from food.counters import COUNTERS, recount
+
+
+class Command(BaseCommand):
+    help = ('Пересчёт денормализованных счётчиков рецептов и пользователей '
+            '(избранное, корзины, рецепты, подписки).')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Сколько строк пересчитывать за один проход'
+        )
+
+    def handle(self, *args, **options):
+        for model in COUNTERS:
+            checked = fixed = 0
+            for batch_checked, batch_fixed in recount(
+                    model, options['batch_size']):
+                checked += batch_checked
+                fixed += batch_fixed
+            self.stdout.write(self.style.SUCCESS(
+                f'{model._meta.verbose_name_plural}: проверено {checked}, '
+                f'исправлено {fixed}'
+            ))
@@ -0,0 +1,25 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from food.popularity import refresh
+
+
+class Command(BaseCommand):
+    help = ('Пересчёт популярности рецептов для ?ordering=popular и '
+            'trending. По умолчанию учитываются только новые добавления '
+            'в избранное и корзину; запускается по расписанию.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Пересчитать все оценки заново (после '
+                                 'изменения периодов полураспада и весов)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = perf_counter()
+        total = refresh(full=options['full'],
+                        batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлено рецептов: {total} за '
+            f'{perf_counter() - started:.1f} с'))
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+# Индексы для поиска продуктов по началу и по подстроке названия.
+# Выражение UPPER(name::text) совпадает с тем, что Django строит
+# для lookup'ов istartswith/icontains на PostgreSQL.
+CREATE_INDEXES = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS food_ingredient_name_upper_like '
+    'ON food_ingredient (UPPER(name::text) text_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS food_ingredient_name_upper_trgm '
+    'ON food_ingredient USING gin (UPPER(name::text) gin_trgm_ops)',
+)
+DROP_INDEXES = (
+    'DROP INDEX IF EXISTS food_ingredient_name_upper_trgm',
+    'DROP INDEX IF EXISTS food_ingredient_name_upper_like',
+)
+
+
+def run_on_postgresql(statements):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0005_recipe_pub_date'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_on_postgresql(CREATE_INDEXES),
+            run_on_postgresql(DROP_INDEXES),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.23 on 2026-10-18 18:55
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+COUNTERS = {
+    'recipe': {
+        'favorites_count': ('favorite', 'recipe'),
+        'carts_count': ('shoppingcartitem', 'recipe'),
+    },
+    'user': {
+        'recipes_count': ('recipe', 'author'),
+        'followers_count': ('follow', 'author'),
+        'following_count': ('follow', 'follower'),
+    },
+}
+
+
+def fill_counters(apps, schema_editor):
+    for model_name, fields in COUNTERS.items():
+        model = apps.get_model('food', model_name)
+        model.objects.update(**{
+            field: Coalesce(Subquery(
+                apps.get_model('food', related_model).objects
+                .filter(**{relation: OuterRef('pk')})
+                .values(relation).annotate(total=Count('pk'))
+                .values('total')
+            ), 0)
+            for field, (related_model, relation) in fields.items()
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0006_ingredient_name_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В корзинах'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Подписчиков'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Подписок'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Рецептов'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations
+
+# GIN-индекс для полнотекстового поиска рецептов (food.search).
+# Выражение повторяет SQL, который Django строит для SEARCH_VECTOR.
+# На SQLite вместо него food.search создаёт индекс FTS5 после migrate.
+CREATE_INDEX = (
+    'CREATE INDEX IF NOT EXISTS food_recipe_search_idx ON food_recipe '
+    "USING gin ((setweight(to_tsvector('russian'::regconfig, "
+    "COALESCE(\"name\", '')), 'A') || "
+    "setweight(to_tsvector('russian'::regconfig, "
+    "COALESCE(\"text\", '')), 'B')))"
+)
+DROP_INDEX = 'DROP INDEX IF EXISTS food_recipe_search_idx'
+
+
+def run_on_postgresql(statement):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0008_recipe_follow_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_on_postgresql(CREATE_INDEX),
+            run_on_postgresql(DROP_INDEX),
+        ),
+    ]
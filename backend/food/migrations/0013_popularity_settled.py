@@ -0,0 +1,30 @@
+# Generated by Django 4.2.23 on 2026-10-18 20:12
+
+from django.db import migrations, models
+
+
+def reset_popularity(apps, schema_editor):
+    # Без учтённой части оценки не продолжить: следующий
+    # refresh_popularity пересчитает их полностью.
+    apps.get_model('food', 'recipepopularity').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0012_popularity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipepopularity',
+            name='settled_popular',
+            field=models.FloatField(null=True, verbose_name='Популярность (учтённая)'),
+        ),
+        migrations.AddField(
+            model_name='recipepopularity',
+            name='settled_trending',
+            field=models.FloatField(null=True, verbose_name='Набирает популярность (учтённая)'),
+        ),
+        migrations.RunPython(reset_popularity, migrations.RunPython.noop),
+    ]
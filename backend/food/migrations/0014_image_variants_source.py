@@ -0,0 +1,47 @@
+# Generated by Django 4.2.23 on 2026-10-18 20:14
+
+from django.db import migrations, models
+
+from library.images import FORMATS, variant_name
+
+# Последние варианты, которые строятся для полей (food.apps).
+LAST_VARIANTS = {
+    ('recipe', 'image'): 'thumbnail',
+    ('user', 'avatar'): 'thumbnail',
+}
+
+
+def fill_sources(apps, schema_editor):
+    # Файлы вариантов пишутся по порядку: есть последний — готовы все.
+    ext = list(FORMATS)[-1]
+    for (model_name, field_name), variant in LAST_VARIANTS.items():
+        model = apps.get_model('food', model_name)
+        storage = model._meta.get_field(field_name).storage
+        for pk, name in model.objects.exclude(
+                **{field_name: ''}).exclude(
+                **{f'{field_name}__isnull': True}
+        ).values_list('pk', field_name).iterator():
+            if storage.exists(variant_name(name, variant, ext)):
+                model.objects.filter(pk=pk).update(
+                    **{f'{field_name}_variants_source': name})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0013_popularity_settled'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_variants_source',
+            field=models.CharField(blank=True, editable=False, max_length=100, verbose_name='Изображение с вариантами'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='avatar_variants_source',
+            field=models.CharField(blank=True, editable=False, max_length=100, verbose_name='Аватар с вариантами'),
+        ),
+        migrations.RunPython(fill_sources, migrations.RunPython.noop),
+    ]
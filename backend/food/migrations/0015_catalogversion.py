@@ -0,0 +1,32 @@
+# Generated by Django 4.2.23 on 2026-10-18 20:29
+
+import time
+
+from django.db import migrations, models
+
+
+def create_version(apps, schema_editor):
+    apps.get_model('food', 'catalogversion').objects.create(
+        pk=1, version=time.time_ns())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0014_image_variants_source'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(verbose_name='Версия')),
+            ],
+            options={
+                'verbose_name': 'Версия справочников',
+                'verbose_name_plural': 'Версии справочников',
+            },
+        ),
+        migrations.RunPython(create_version, migrations.RunPython.noop),
+    ]
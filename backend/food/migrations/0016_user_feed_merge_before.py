@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-18 20:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0015_catalogversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='feed_merge_before',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Подмешивать в ленты рецепты до'),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator, RegexValidator
 from django.db import models
+from django.utils import timezone
 
 from food import constants as const
 
@@ -37,6 +38,37 @@ class User(AbstractUser):
         blank=True,
         verbose_name='Аватар',
     )
+    # Файл, для которого построены варианты (library.images).
+    avatar_variants_source = models.CharField(
+        max_length=100,
+        blank=True,
+        editable=False,
+        verbose_name='Аватар с вариантами',
+    )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Рецептов',
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Подписчиков',
+    )
+    following_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Подписок',
+    )
+    # Рецепты, опубликованные раньше, могли не раздаваться по лентам
+    # (у автора было больше FEED_FANOUT_MAX_FOLLOWERS подписчиков):
+    # лента подмешивает их при чтении (food.timeline).
+    feed_merge_before = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name='Подмешивать в ленты рецепты до',
+    )
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
@@ -73,6 +105,11 @@ class Follow(models.Model):
                 name='unique_author_follower'
             )
         ]
+        indexes = [
+            # Подписки пользователя: авторы по follower без чтения таблицы.
+            models.Index(fields=['follower', 'author'],
+                         name='follow_follower_author_idx'),
+        ]
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
 
@@ -144,6 +181,13 @@ class Recipe(models.Model):
         verbose_name='Изображение',
         help_text='Загрузите изображение рецепта'
     )
+    # Файл, для которого построены варианты (library.images).
+    image_variants_source = models.CharField(
+        max_length=100,
+        blank=True,
+        editable=False,
+        verbose_name='Изображение с вариантами',
+    )
     cooking_time = models.PositiveIntegerField(
         validators=[MinValueValidator(const.RECIPE_MIN_COOKING_TIME)],
         verbose_name='Время (мин)'
@@ -156,12 +200,43 @@ class Recipe(models.Model):
         through='RecipeIngredient',
         related_name='recipes'
     )
+    pub_date = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Дата публикации',
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном',
+    )
+    carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В корзинах',
+    )
+    # Состав изменился: похожие рецепты нужно пересчитать
+    # (build_similar_recipes).
+    similar_stale = models.BooleanField(
+        default=True,
+        editable=False,
+        verbose_name='Похожие устарели',
+    )
 
     class Meta:
         default_related_name = 'recipes'
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-id']
+        indexes = [
+            # Лента и курсорная пагинация: ORDER BY pub_date DESC, id DESC.
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_feed_idx'),
+            # Рецепты автора (фильтр author, последние рецепты в подписках).
+            models.Index(fields=['author', '-pub_date'],
+                         name='recipe_author_feed_idx'),
+            models.Index(fields=['id'], condition=models.Q(
+                similar_stale=True), name='recipe_similar_stale_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -209,6 +284,11 @@ class UserRecipeRelationBase(models.Model):
         verbose_name='Рецепт',
         related_name='%(class)ss'
     )
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        db_index=True,
+        verbose_name='Добавлено',
+    )
 
     class Meta:
         abstract = True
@@ -224,12 +304,157 @@ class UserRecipeRelationBase(models.Model):
 
 
 class Favorite(UserRecipeRelationBase):
+    # счётчик в Recipe, который отражает число таких записей
+    counter_field = 'favorites_count'
+
     class Meta(UserRecipeRelationBase.Meta):
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
 
 
 class ShoppingCartItem(UserRecipeRelationBase):
+    counter_field = 'carts_count'
+
     class Meta(UserRecipeRelationBase.Meta):
         verbose_name = 'Элемент корзины'
         verbose_name_plural = 'Корзина покупок'
+
+
+class TimelineEntry(models.Model):
+    """Рецепт в ленте подписчика автора (раздача при публикации)."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Подписчик',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Рецепт',
+    )
+    # Копии полей рецепта: отписка и лента обходятся без соединения.
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор',
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_timeline_user_recipe'
+            )
+        ]
+        indexes = [
+            # Страница ленты: WHERE user_id ORDER BY pub_date, recipe_id.
+            models.Index(fields=['user', '-pub_date', '-recipe'],
+                         name='timeline_user_feed_idx'),
+            models.Index(fields=['user', 'author'],
+                         name='timeline_user_author_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} в ленте {self.user}'
+
+
+class SimilarRecipe(models.Model):
+    """Один из ближайших по составу рецептов (build_similar_recipes)."""
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_recipes',
+        verbose_name='Рецепт',
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_to',
+        verbose_name='Похожий рецепт',
+    )
+    score = models.FloatField(verbose_name='Сходство')
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'similar'],
+                name='unique_similar_recipe'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['recipe', '-score'],
+                         name='similar_recipe_score_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.similar} похож на {self.recipe}'
+
+
+class RecipePopularity(models.Model):
+    """Популярность рецепта с затуханием (refresh_popularity).
+
+    Оценки — логарифмы сумм весов добавлений в избранное и корзину,
+    приведённых к общей эпохе (food.popularity).
+    """
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='popularity',
+        verbose_name='Рецепт',
+    )
+    popular = models.FloatField(verbose_name='Популярность')
+    trending = models.FloatField(verbose_name='Набирает популярность')
+    # Оценки по добавлениям до refreshed_at - POPULARITY_REFRESH_GRACE:
+    # к ним пересчёт только прибавляет, более поздние считаются заново.
+    settled_popular = models.FloatField(
+        null=True,
+        verbose_name='Популярность (учтённая)',
+    )
+    settled_trending = models.FloatField(
+        null=True,
+        verbose_name='Набирает популярность (учтённая)',
+    )
+    refreshed_at = models.DateTimeField(
+        db_index=True,
+        verbose_name='Пересчитано',
+    )
+
+    class Meta:
+        verbose_name = 'Популярность рецепта'
+        verbose_name_plural = 'Популярность рецептов'
+        indexes = [
+            models.Index(fields=['-popular'], name='recipe_popular_idx'),
+            models.Index(fields=['-trending'], name='recipe_trending_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe}: {self.popular:.2f}'
+
+
+class CatalogVersion(models.Model):
+    """Версия справочников тегов и продуктов (food.catalog).
+
+    Хранится в базе, чтобы изменение справочников в одном процессе
+    (например, командой загрузки) видели все остальные.
+    """
+
+    version = models.BigIntegerField(verbose_name='Версия')
+
+    class Meta:
+        verbose_name = 'Версия справочников'
+        verbose_name_plural = 'Версии справочников'
+
+    def __str__(self):
+        return str(self.version)
@@ -0,0 +1,135 @@
+"""Популярность рецептов с экспоненциальным затуханием.
+
+Добавление в избранное (вес 1) или в корзину (POPULARITY_CART_WEIGHT)
+в момент t весит w * 2 ** ((t - EPOCH) / полураспад): старые добавления
+теряют половину веса относительно новых за каждый период полураспада.
+Общий множитель, приводящий веса к текущему моменту, порядок рецептов
+не меняет, поэтому оценки не устаревают со временем, а пересчёт
+добавляет к ним только новые события (см. refresh). Хранятся
+натуральные логарифмы сумм: сами суммы переполнили бы float.
+"""
+import math
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from food.models import Favorite, Recipe, RecipePopularity, ShoppingCartItem
+
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+DAY = 24 * 60 * 60
+ORDERINGS = ('popular', 'trending')
+
+
+def log_weight(weight, created_at, half_life_days):
+    return math.log(weight) + math.log(2) * (
+        (created_at - EPOCH).total_seconds() / (half_life_days * DAY))
+
+
+def log_add(a, b):
+    """log(e ** a + e ** b) без переполнения; None — пустая сумма."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def collect(since, until):
+    """Логарифмы сумм весов добавлений из (since, until] по рецептам:
+    {id рецепта: (popular, trending)}."""
+    half_lives = (settings.POPULAR_HALF_LIFE_DAYS,
+                  settings.TRENDING_HALF_LIFE_DAYS)
+    scores = {}
+    for model, weight in ((Favorite, 1.0),
+                          (ShoppingCartItem, settings.POPULARITY_CART_WEIGHT)):
+        if weight <= 0:
+            continue
+        events = model.objects.filter(created_at__lte=until)
+        if since is not None:
+            events = events.filter(created_at__gt=since)
+        for recipe_id, created_at in events.values_list(
+                'recipe_id', 'created_at').order_by().iterator(
+                chunk_size=10000):
+            old = scores.get(recipe_id, (None, None))
+            scores[recipe_id] = tuple(
+                log_add(score, log_weight(weight, created_at, half_life))
+                for score, half_life in zip(old, half_lives)
+            )
+    return scores
+
+
+def refresh(full=False, batch_size=1000):
+    """Учитывает добавления после прошлого пересчёта; возвращает число
+    обновлённых рецептов.
+
+    created_at задаётся до фиксации транзакции, поэтому добавление со
+    временем до прошлого пересчёта может появиться уже после него.
+    Добавления старше POPULARITY_REFRESH_GRACE секунд прибавляются к
+    учтённой части оценки (settled_*) один раз, а более свежие каждый
+    раз суммируются заново поверх неё: так опоздавшие не теряются и не
+    учитываются дважды.
+
+    Удаление из избранного и корзины оценку не уменьшает: оценка — это
+    затухающая сумма добавлений. С full все оценки считаются заново по
+    текущим записям (после смены периодов полураспада или весов).
+    """
+    refreshed_at = timezone.now()
+    grace = timedelta(seconds=settings.POPULARITY_REFRESH_GRACE)
+    since = None
+    if not full:
+        since = RecipePopularity.objects.aggregate(
+            since=Max('refreshed_at'))['since']
+    if since is not None:
+        since -= grace
+    settled_until = refreshed_at - grace
+    settled = collect(since, settled_until)
+    recent = collect(settled_until, refreshed_at)
+    recipe_ids = sorted(settled.keys() | recent.keys())
+    # Одна транзакция: при сбое отметка refreshed_at не сдвинется,
+    # и добавления не потеряются и не учтутся дважды.
+    with transaction.atomic():
+        if full:
+            RecipePopularity.objects.all().delete()
+        for start in range(0, len(recipe_ids), batch_size):
+            batch = recipe_ids[start:start + batch_size]
+            existing = RecipePopularity.objects.in_bulk(batch)
+            updated, created = [], []
+            # Рецепт мог быть удалён после чтения добавлений.
+            for recipe_id in Recipe.objects.filter(
+                    id__in=batch).values_list('id', flat=True):
+                row = existing.get(recipe_id)
+                if row is None:
+                    row = RecipePopularity(recipe_id=recipe_id)
+                    created.append(row)
+                else:
+                    updated.append(row)
+                new_popular, new_trending = settled.get(
+                    recipe_id, (None, None))
+                row.settled_popular = log_add(row.settled_popular,
+                                              new_popular)
+                row.settled_trending = log_add(row.settled_trending,
+                                               new_trending)
+                recent_popular, recent_trending = recent.get(
+                    recipe_id, (None, None))
+                row.popular = log_add(row.settled_popular, recent_popular)
+                row.trending = log_add(row.settled_trending, recent_trending)
+                row.refreshed_at = refreshed_at
+            RecipePopularity.objects.bulk_update(
+                updated, ['popular', 'trending', 'settled_popular',
+                          'settled_trending', 'refreshed_at'])
+            RecipePopularity.objects.bulk_create(created)
+    return len(recipe_ids)
+
+
+def order_by_popularity(recipes, ordering):
+    """Рецепты по убыванию оценки ordering (popular или trending).
+
+    Рецепты без добавлений (нет строки RecipePopularity) — в конце.
+    """
+    return recipes.order_by(
+        F(f'popularity__{ordering}').desc(nulls_last=True), '-pub_date', '-id')
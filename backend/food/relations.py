@@ -0,0 +1,112 @@
+"""Идемпотентное добавление и удаление связей (избранное, корзина,
+подписки) одним SQL-запросом."""
+from django.core.exceptions import ValidationError
+from django.db import connections, router
+
+
+def to_target_ids(field, target_ids):
+    """id объектов target, приведённые к типу ключа; неверные — пропускаются.
+    """
+    converted = []
+    for target_id in target_ids:
+        try:
+            converted.append(field.target_field.to_python(target_id))
+        except ValidationError:
+            continue
+    return converted
+
+
+def insert_many(obj, target, target_ids):
+    """Добавляет копии obj для объектов target с id из target_ids запросом
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING; возвращает множество id,
+    для которых строка добавлена.
+
+    Объекты target выбираются из своей таблицы в том же запросе: для
+    несуществующих строки не вставляются и ошибки внешнего ключа не
+    возникает. Уже существующие связи пропускаются.
+    """
+    model = type(obj)
+    meta = model._meta
+    field = meta.get_field(target)
+    target_ids = to_target_ids(field, target_ids)
+    if not target_ids:
+        return set()
+    using = router.db_for_write(model, instance=obj)
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    fields = [other for other in meta.concrete_fields
+              if other is not field and not other.primary_key]
+    # pre_save подставляет значения по умолчанию (created_at).
+    params = [other.get_db_prep_save(other.pre_save(obj, add=True),
+                                     connection) for other in fields]
+    columns = ', '.join(quote(other.column) for other in (*fields, field))
+    values = ', '.join(['%s'] * len(fields))
+    target_pk = quote(field.target_field.column)
+    sql = (
+        f'INSERT INTO {quote(meta.db_table)} ({columns}) '
+        f'SELECT {values}, {target_pk} '
+        f'FROM {quote(field.related_model._meta.db_table)} '
+        f'WHERE {target_pk} IN ({", ".join(["%s"] * len(target_ids))}) '
+        f'ON CONFLICT DO NOTHING RETURNING {quote(field.column)}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*params, *target_ids])
+        return {row[0] for row in cursor.fetchall()}
+
+
+def insert(obj, target):
+    """Добавляет obj одним запросом (см. insert_many).
+
+    Возвращает True, если строка добавлена, False — если такая уже есть;
+    если объекта target нет — DoesNotExist его модели.
+    """
+    field = obj._meta.get_field(target)
+    related = field.related_model
+    target_id = getattr(obj, field.attname)
+    if insert_many(obj, target, [target_id]):
+        return True
+    # Строки нет — либо связь уже есть, либо нет объекта target.
+    if not related._base_manager.filter(
+            pk__in=to_target_ids(field, [target_id])).exists():
+        raise related.DoesNotExist
+    return False
+
+
+def delete_many(model, target, target_ids=None, **filters):
+    """Удаляет связи с объектами target (с id из target_ids или все)
+    запросом DELETE ... RETURNING; возвращает множество id удалённых.
+
+    filters — {поле: значение}, например user=пользователь.
+    """
+    meta = model._meta
+    field = meta.get_field(target)
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    conditions, params = [], []
+    for name, value in filters.items():
+        other = meta.get_field(name)
+        conditions.append(f'{quote(other.column)} = %s')
+        params.append(other.get_db_prep_value(
+            getattr(value, 'pk', value), connection))
+    if target_ids is not None:
+        target_ids = to_target_ids(field, target_ids)
+        if not target_ids:
+            return set()
+        conditions.append(f'{quote(field.column)} IN '
+                          f'({", ".join(["%s"] * len(target_ids))})')
+        params.extend(target_ids)
+    sql = (f'DELETE FROM {quote(meta.db_table)} '
+           f'WHERE {" AND ".join(conditions) or "1 = 1"} '
+           f'RETURNING {quote(field.column)}')
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return {row[0] for row in cursor.fetchall()}
+
+
+def delete(model, **filters):
+    """Удаляет связь одним запросом DELETE; возвращает число строк.
+
+    У моделей связей нет сигналов удаления и зависимых объектов, поэтому
+    Django не выбирает строки перед удалением.
+    """
+    return model.objects.filter(**filters).delete()[0]
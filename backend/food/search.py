@@ -0,0 +1,102 @@
+import re
+
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from food.models import Recipe
+
+# Конфигурация полнотекстового поиска PostgreSQL (стемминг, стоп-слова).
+SEARCH_CONFIG = 'russian'
+WORD = re.compile(r'\w+')
+
+# Выражение должно совпадать с индексом food_recipe_search_idx
+# (миграция 0009), иначе PostgreSQL его не использует.
+SEARCH_VECTOR = (
+    SearchVector('name', config=SEARCH_CONFIG, weight='A')
+    + SearchVector('text', config=SEARCH_CONFIG, weight='B')
+)
+
+# На SQLite (разработка и тесты) — внешний индекс FTS5 над food_recipe,
+# который поддерживают триггеры.
+FTS_TABLE = 'food_recipe_fts'
+FTS_TRIGGERS = {
+    'food_recipe_fts_insert': (
+        'AFTER INSERT ON food_recipe BEGIN '
+        'INSERT INTO food_recipe_fts (rowid, name, text) '
+        'VALUES (new.id, new.name, new.text); END'
+    ),
+    'food_recipe_fts_delete': (
+        'AFTER DELETE ON food_recipe BEGIN '
+        'INSERT INTO food_recipe_fts (food_recipe_fts, rowid, name, text) '
+        "VALUES ('delete', old.id, old.name, old.text); END"
+    ),
+    'food_recipe_fts_update': (
+        'AFTER UPDATE OF name, text ON food_recipe BEGIN '
+        'INSERT INTO food_recipe_fts (food_recipe_fts, rowid, name, text) '
+        "VALUES ('delete', old.id, old.name, old.text); "
+        'INSERT INTO food_recipe_fts (rowid, name, text) '
+        'VALUES (new.id, new.name, new.text); END'
+    ),
+}
+# Веса bm25 для name и text: совпадение в названии важнее.
+FTS_RANK = f'-bm25({FTS_TABLE}, 10.0, 1.0)'
+
+
+def install_sqlite_search(using=DEFAULT_DB_ALIAS, **kwargs):
+    """Создаёт индекс FTS5 и триггеры, если их нет (сигнал post_migrate).
+
+    Миграции на SQLite пересоздают таблицу при изменении полей и теряют
+    её триггеры, поэтому проверка выполняется после каждого migrate.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        if Recipe._meta.db_table not in connection.introspection.table_names(
+                cursor):
+            return
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' "
+            'AND tbl_name = %s', [Recipe._meta.db_table])
+        if set(FTS_TRIGGERS) <= {row[0] for row in cursor.fetchall()}:
+            return
+        cursor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+            "name, text, content='food_recipe', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2')"
+        )
+        for name, body in FTS_TRIGGERS.items():
+            cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def search_recipes(recipes, query):
+    """Рецепты, подходящие под текстовый запрос, по убыванию релевантности.
+
+    Релевантность доступна в аннотации search_rank.
+    """
+    words = WORD.findall(query)
+    if not words:
+        return recipes.none()
+    if connections[recipes.db].vendor == 'postgresql':
+        search_query = SearchQuery(query, config=SEARCH_CONFIG,
+                                   search_type='websearch')
+        recipes = recipes.alias(search=SEARCH_VECTOR).filter(
+            search=search_query
+        ).annotate(search_rank=SearchRank(SEARCH_VECTOR, search_query))
+    else:
+        # Все слова запроса, каждое — как префикс: «пирог» найдёт
+        # и «пирогами» (стемминга в FTS5 нет).
+        match = ' '.join(f'"{word}"*' for word in words)
+        # Соединение с FTS5, а не подзапрос на каждую строку: bm25()
+        # вычисляется за один проход по совпадениям.
+        recipes = recipes.extra(
+            select={'search_rank': FTS_RANK},
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = "{Recipe._meta.db_table}"."id"',
+                   f'{FTS_TABLE} MATCH %s'],
+            params=[match],
+        )
+    return recipes.order_by('-search_rank', '-pub_date', '-id')
@@ -0,0 +1,184 @@
+"""Похожие рецепты по общим продуктам и тегам.
+
+Рецепт — множество признаков (продукты и теги). Кандидаты в соседи
+ищутся по MinHash-сигнатурам с разбиением на полосы (LSH): рецепты,
+совпавшие хотя бы в одной полосе, сравниваются точно по коэффициенту
+Жаккара, и для каждого сохраняются лучшие в SimilarRecipe.
+"""
+from collections import defaultdict
+from itertools import chain
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+
+from food.models import Recipe, RecipeIngredient, SimilarRecipe
+
+# 16 полос по 4 значения: пары с J >= 0.5 становятся кандидатами
+# с вероятностью > 0.6, с J >= 0.7 — практически всегда.
+BANDS = 16
+ROWS = 4
+PRIME = (1 << 31) - 1
+# Корзина LSH из популярного сочетания продуктов может содержать десятки
+# тысяч рецептов; большие корзины сравниваются окнами этого размера.
+MAX_BUCKET = 50
+# Точный Жаккар считается для стольких лучших по оценке сигнатур
+# кандидатов на каждое место в списке соседей.
+SHORTLIST_FACTOR = 3
+SEED = 20240501
+INSERT_SQL = (
+    f'INSERT INTO {SimilarRecipe._meta.db_table} '
+    '(recipe_id, similar_id, score) VALUES (%s, %s, %s)'
+)
+
+
+class FeatureMatrix:
+    """Разреженная матрица рецепт x признак в формате CSR."""
+
+    def __init__(self, pairs):
+        pairs = np.unique(pairs, axis=0)
+        self.ids, starts = np.unique(pairs[:, 0], return_index=True)
+        self.features = pairs[:, 1]
+        self.indptr = np.append(starts, len(pairs))
+        self.position = {recipe_id: index for index, recipe_id
+                         in enumerate(self.ids.tolist())}
+
+    @staticmethod
+    def load(queryset, *fields):
+        rows = queryset.values_list(*fields).order_by().iterator(
+            chunk_size=10000)
+        return np.fromiter(chain.from_iterable(rows),
+                           dtype=np.int64).reshape(-1, 2)
+
+    @classmethod
+    def from_db(cls):
+        # Признак продукта — 2 * id, тега — 2 * id + 1.
+        ingredients = cls.load(RecipeIngredient.objects, 'recipe_id',
+                               'ingredient_id')
+        ingredients[:, 1] *= 2
+        tags = cls.load(Recipe.tags.through.objects, 'recipe_id', 'tag_id')
+        tags[:, 1] = tags[:, 1] * 2 + 1
+        return cls(np.concatenate((ingredients, tags)))
+
+    def row(self, index):
+        return self.features[self.indptr[index]:self.indptr[index + 1]]
+
+    def signatures(self):
+        """MinHash-сигнатуры всех рецептов: массив (рецепты, BANDS*ROWS)."""
+        rng = np.random.default_rng(SEED)
+        size = BANDS * ROWS
+        a = rng.integers(1, PRIME, size=size, dtype=np.int64)
+        b = rng.integers(0, PRIME, size=size, dtype=np.int64)
+        signatures = np.empty((len(self.ids), size), dtype=np.int64)
+        for column in range(size):
+            hashes = (a[column] * self.features + b[column]) % PRIME
+            signatures[:, column] = np.minimum.reduceat(
+                hashes, self.indptr[:-1])
+        return signatures
+
+
+def candidate_pairs(signatures, targets):
+    """Кандидаты в соседи для позиций targets: {позиция: {позиции}}."""
+    is_target = np.zeros(len(signatures), dtype=bool)
+    is_target[list(targets)] = True
+    candidates = defaultdict(set)
+    for band in range(BANDS):
+        keys = np.ascontiguousarray(
+            signatures[:, band * ROWS:(band + 1) * ROWS])
+        _, buckets = np.unique(
+            keys.view([('', keys.dtype)] * ROWS).ravel(), return_inverse=True)
+        order = np.argsort(buckets, kind='stable')
+        bounds = np.flatnonzero(np.diff(buckets[order])) + 1
+        for members in np.split(order, bounds):
+            if len(members) < 2 or not is_target[members].any():
+                continue
+            for start in range(0, len(members), MAX_BUCKET):
+                window = members[start:start + MAX_BUCKET].tolist()
+                for position in window:
+                    if is_target[position]:
+                        candidates[position].update(window)
+    for position, neighbours in candidates.items():
+        neighbours.discard(position)
+    return candidates
+
+
+def nearest(matrix, signatures, position, candidates, limit):
+    """limit соседей: [(сходство, -позиция)] по убыванию сходства."""
+    candidates = np.fromiter(candidates, dtype=np.int64,
+                             count=len(candidates))
+    # Доля совпавших значений сигнатур — оценка коэффициента Жаккара.
+    estimate = (signatures[candidates] == signatures[position]).sum(axis=1)
+    shortlist = candidates[np.argsort(-estimate, kind='stable')[
+        :limit * SHORTLIST_FACTOR]]
+    row = set(matrix.row(position).tolist())
+    scored = []
+    for other in shortlist.tolist():
+        other_row = matrix.row(other).tolist()
+        common = len(row.intersection(other_row))
+        scored.append(
+            (common / (len(row) + len(other_row) - common), -other))
+    # При равном сходстве выше рецепт с меньшим id.
+    return sorted(scored, reverse=True)[:limit]
+
+
+def save(matrix, signatures, candidates, positions, limit, batch_size):
+    """Сохраняет соседей рецептов positions; возвращает позиции соседей."""
+    neighbours = set()
+    positions = sorted(positions)
+    for start in range(0, len(positions), batch_size):
+        batch = positions[start:start + batch_size]
+        rows = []
+        for position in batch:
+            for score, negative in nearest(matrix, signatures, position,
+                                           candidates.get(position, ()),
+                                           limit):
+                neighbours.add(-negative)
+                rows.append((int(matrix.ids[position]),
+                             int(matrix.ids[-negative]), round(score, 4)))
+        with transaction.atomic():
+            SimilarRecipe.objects.filter(recipe_id__in=[
+                int(matrix.ids[position]) for position in batch
+            ]).delete()
+            # Без моделей: bulk_create тратит на их создание больше
+            # времени, чем весь расчёт.
+            with connection.cursor() as cursor:
+                cursor.executemany(INSERT_SQL, rows)
+    return neighbours
+
+
+def build(full=False, limit=None, batch_size=1000):
+    """Пересчитывает похожие рецепты; возвращает число обновлённых.
+
+    Без full пересчитываются изменённые рецепты (similar_stale), затем
+    их новые соседи и рецепты, у которых они были в списке.
+    """
+    limit = limit or settings.SIMILAR_RECIPES_LIMIT
+    recipes = Recipe.objects.all()
+    referrers = []
+    if not full:
+        recipes = recipes.filter(similar_stale=True)
+        referrers = list(SimilarRecipe.objects.filter(
+            similar__similar_stale=True).values_list('recipe_id', flat=True))
+    stale = list(recipes.values_list('id', flat=True))
+    # Флаг снимается до чтения состава: рецепт, изменённый во время
+    # расчёта, снова станет устаревшим и попадёт в следующий запуск.
+    for start in range(0, len(stale), batch_size):
+        Recipe.objects.filter(id__in=stale[start:start + batch_size]).update(
+            similar_stale=False)
+    matrix = FeatureMatrix.from_db()
+    stale = {matrix.position[recipe_id] for recipe_id in stale
+             if recipe_id in matrix.position}
+    if not stale:
+        return 0
+    signatures = matrix.signatures()
+    neighbours = save(matrix, signatures, candidate_pairs(signatures, stale),
+                      stale, limit, batch_size)
+    if full:
+        return len(stale)
+    affected = (neighbours | {matrix.position[recipe_id]
+                              for recipe_id in referrers
+                              if recipe_id in matrix.position}) - stale
+    if affected:
+        save(matrix, signatures, candidate_pairs(signatures, affected),
+             affected, limit, batch_size)
+    return len(stale) + len(affected)
@@ -0,0 +1,294 @@
+import io
+import json
+import tempfile
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.db import models
+from django.test import TestCase
+from django.utils import timezone
+
+from food.counters import COUNTERS, recount
+from food.importers import iter_json_array
+from food.models import (Favorite, Follow, Ingredient, Recipe,
+                         RecipeIngredient, RecipePopularity, ShoppingCartItem,
+                         SimilarRecipe, Tag, User)
+from food.popularity import order_by_popularity
+
+
+class LoadCommandTest(TestCase):
+
+    def write_file(self, content, suffix):
+        file = tempfile.NamedTemporaryFile(
+            'w', suffix=suffix, encoding='utf-8')
+        file.write(content)
+        file.flush()
+        self.addCleanup(file.close)
+        return file.name
+
+    def load(self, command, file_path, *args):
+        stdout = io.StringIO()
+        call_command(command, file_path, *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_json_array_is_read_incrementally(self):
+        items = [{'name': f'продукт {index}', 'measurement_unit': 'г'}
+                 for index in range(50)]
+        self.assertEqual(
+            list(iter_json_array(io.StringIO(json.dumps(items)),
+                                 chunk_size=7)),
+            items
+        )
+
+    def test_csv_with_reported_insert_count(self):
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+        file_path = self.write_file(
+            'соль,г\nсахар,г\nмука,г\nсахар,г\n', '.csv')
+        output = self.load('load_ingredients_json', file_path,
+                           '--batch-size', '2')
+        self.assertIn('Добавлено 2 объектов', output)
+        self.assertIn('обработано 4 строк', output)
+        self.assertEqual(Ingredient.objects.count(), 3)
+
+    def test_tags_upsert(self):
+        Tag.objects.create(name='Завтрак', slug='breakfast')
+        file_path = self.write_file(json.dumps([
+            {'name': 'Утро', 'slug': 'breakfast'},
+            {'name': 'Обед', 'slug': 'lunch'},
+        ]), '.json')
+        output = self.load('load_tags_json', file_path)
+        self.assertIn('Добавлено 1 объектов', output)
+        self.assertEqual(Tag.objects.get(slug='breakfast').name, 'Утро')
+
+    def test_tags_name_taken_by_other_slug(self):
+        Tag.objects.create(name='Завтрак', slug='breakfast')
+        file_path = self.write_file(json.dumps([
+            {'name': 'Завтрак', 'slug': 'morning'},
+            {'name': 'Обед', 'slug': 'lunch'},
+            {'name': 'Обед', 'slug': 'dinner'},
+        ]), '.json')
+        output = self.load('load_tags_json', file_path)
+        self.assertIn('Добавлено 1 объектов', output)
+        self.assertIn("'slug': 'morning'", output)
+        self.assertIn("'slug': 'dinner'", output)
+        self.assertEqual(
+            sorted(Tag.objects.values_list('slug', 'name')),
+            [('breakfast', 'Завтрак'), ('lunch', 'Обед')])
+
+    def test_tags_without_update(self):
+        Tag.objects.create(name='Завтрак', slug='breakfast')
+        file_path = self.write_file(
+            json.dumps([{'name': 'Утро', 'slug': 'breakfast'}]), '.json')
+        self.load('load_tags_json', file_path, '--no-update')
+        self.assertEqual(Tag.objects.get(slug='breakfast').name, 'Завтрак')
+
+
+class GenerateDatasetTest(TestCase):
+
+    def generate(self, *args, scale='0.05'):
+        call_command('generate_dataset', '--scale', scale, '--batch-size',
+                     '100', *args, stdout=io.StringIO())
+        return {
+            model: sorted(model.objects.values_list(*fields))
+            for model, fields in (
+                (Recipe, ('author__username', 'name', 'cooking_time')),
+                (Favorite, ('user__username', 'recipe__name')),
+                (ShoppingCartItem, ('user__username', 'recipe__name')),
+                (Follow, ('follower__username', 'author__username')),
+                (RecipeIngredient, ('recipe__name', 'ingredient__name',
+                                    'amount')),
+            )
+        }
+
+    def test_volumes_and_counters(self):
+        self.generate()
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(Recipe.objects.count(), 50)
+        # Повторяющиеся пары отбрасываются, поэтому строк может быть меньше.
+        self.assertGreater(Favorite.objects.count(), 100)
+        self.assertLessEqual(Favorite.objects.count(), 150)
+        self.assertGreater(RecipeIngredient.objects.count(), 100)
+        self.assertFalse(Follow.objects.filter(
+            author=models.F('follower')).exists())
+        for model in COUNTERS:
+            self.assertEqual(sum(fixed for _, fixed in recount(model)), 0)
+
+    def test_same_seed_same_data(self):
+        first = self.generate()
+        second = self.generate('--clear')
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, self.generate('--clear', '--seed', '1'))
+
+    def test_popularity_is_skewed(self):
+        self.generate(scale='0.3')
+        counts = sorted(
+            Recipe.objects.values_list('favorites_count', flat=True),
+            reverse=True
+        )
+        # Десятая часть рецептов собирает больше трети избранного.
+        self.assertGreater(sum(counts[:len(counts) // 10]),
+                           sum(counts) / 3)
+
+
+class SimilarRecipesTest(TestCase):
+    # Рецепт -> номера продуктов.
+    COMPOSITION = {
+        'base': (0, 1, 2, 3, 4, 5),
+        'close': (0, 1, 2, 3, 4, 6),
+        'further': (0, 1, 2, 3, 7, 8),
+        'other': (10, 11, 12, 13, 14, 15),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        cls.tag = Tag.objects.create(name='Обед', slug='lunch')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Продукт {index}',
+                                      measurement_unit='г')
+            for index in range(16)
+        ]
+        cls.recipes = {}
+        for name, composition in cls.COMPOSITION.items():
+            recipe = Recipe.objects.create(
+                author=author, name=name, text='Описание',
+                image='recipes/test.png', cooking_time=10)
+            recipe.tags.set([cls.tag])
+            cls.set_composition(recipe, composition)
+            cls.recipes[name] = recipe
+
+    @classmethod
+    def set_composition(cls, recipe, composition):
+        recipe.ingredients_in_recipe.all().delete()
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=cls.ingredients[index],
+                             amount=1)
+            for index in composition
+        )
+
+    def build(self, *args):
+        stdout = io.StringIO()
+        call_command('build_similar_recipes', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def similar(self, name):
+        return list(SimilarRecipe.objects.filter(
+            recipe=self.recipes[name]).order_by('-score').values_list(
+            'similar__name', 'score'))
+
+    def test_full_build(self):
+        self.assertIn('Пересчитано рецептов: 4', self.build('--full'))
+        similar = self.similar('base')
+        # Жаккар по продуктам и общему тегу: 6 / 8 и 5 / 9.
+        self.assertEqual(similar[0], ('close', 0.75))
+        self.assertNotIn('other', [name for name, _ in similar])
+        self.assertFalse(Recipe.objects.filter(similar_stale=True).exists())
+
+    def test_incremental_build(self):
+        self.build('--full')
+        other = self.recipes['other']
+        self.set_composition(other, self.COMPOSITION['base'])
+        Recipe.objects.filter(pk=other.pk).update(similar_stale=True)
+        output = self.build()
+        self.assertNotIn('Пересчитано рецептов: 0', output)
+        self.assertEqual(self.similar('base')[0], ('other', 1.0))
+        self.assertEqual(self.similar('other')[0], ('base', 1.0))
+        self.assertIn('Пересчитано рецептов: 0', self.build())
+
+
+class PopularityTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        cls.users = [
+            User.objects.create_user(username=f'user{index}',
+                                     email=f'user{index}@example.com',
+                                     password='pass')
+            for index in range(6)
+        ]
+        cls.recipes = {
+            name: Recipe.objects.create(
+                author=author, name=name, text='Описание',
+                image='recipes/test.png', cooking_time=10)
+            for name in ('classic', 'fresh', 'cart', 'none')
+        }
+        now = timezone.now()
+        # classic: 6 добавлений месяц назад — 3 по popular, ~0 по trending;
+        # fresh: 2 свежих; cart: одно добавление в корзину с весом 0.5.
+        Favorite.objects.bulk_create(
+            Favorite(user=user, recipe=cls.recipes['classic'],
+                     created_at=now - timedelta(days=30))
+            for user in cls.users
+        )
+        Favorite.objects.bulk_create(
+            Favorite(user=user, recipe=cls.recipes['fresh'],
+                     created_at=now - timedelta(hours=1))
+            for user in cls.users[:2]
+        )
+        ShoppingCartItem.objects.create(user=cls.users[0],
+                                        recipe=cls.recipes['cart'])
+
+    def refresh(self, *args):
+        stdout = io.StringIO()
+        call_command('refresh_popularity', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def ordered(self, ordering):
+        return list(order_by_popularity(
+            Recipe.objects.all(), ordering).values_list('name', flat=True))
+
+    def scores(self):
+        return {
+            recipe_id: (popular, trending)
+            for recipe_id, popular, trending
+            in RecipePopularity.objects.values_list(
+                'recipe_id', 'popular', 'trending')
+        }
+
+    def test_orderings(self):
+        self.assertIn('Обновлено рецептов: 3', self.refresh('--full'))
+        self.assertEqual(self.ordered('popular'),
+                         ['classic', 'fresh', 'cart', 'none'])
+        self.assertEqual(self.ordered('trending'),
+                         ['fresh', 'cart', 'classic', 'none'])
+
+    def test_incremental_matches_full(self):
+        self.refresh()
+        for user in self.users[2:]:
+            Favorite.objects.create(user=user, recipe=self.recipes['cart'])
+        self.assertIn('Обновлено рецептов: 1', self.refresh())
+        incremental = self.scores()
+        self.refresh('--full')
+        for recipe_id, scores in self.scores().items():
+            for expected, actual in zip(scores, incremental[recipe_id]):
+                self.assertAlmostEqual(expected, actual)
+        self.assertEqual(self.ordered('trending')[0], 'cart')
+        # Свежие добавления пересчитываются заново, а не прибавляются.
+        full = self.scores()
+        self.refresh()
+        self.assertEqual(self.scores(), full)
+
+    def test_late_commit_counted_once(self):
+        self.refresh()
+        # Добавление со временем до пересчёта, зафиксированное после него.
+        Favorite.objects.create(
+            user=self.users[3], recipe=self.recipes['cart'],
+            created_at=timezone.now() - timedelta(minutes=1))
+        self.refresh()
+        self.refresh()
+        incremental = self.scores()
+        self.refresh('--full')
+        for recipe_id, scores in self.scores().items():
+            for expected, actual in zip(scores, incremental[recipe_id]):
+                self.assertAlmostEqual(expected, actual)
+
+    def test_removal_counted_on_full_refresh(self):
+        self.refresh()
+        Favorite.objects.filter(recipe=self.recipes['classic']).delete()
+        self.refresh()
+        self.assertEqual(self.ordered('popular')[0], 'classic')
+        self.refresh('--full')
+        self.assertEqual(self.ordered('popular')[-2:], ['none', 'classic'])
@@ -0,0 +1,120 @@
+from django.conf import settings
+from django.db.models import F, Q
+from django.db.models.functions import Now
+
+from food.models import Follow, Recipe, TimelineEntry, User
+
+
+def is_fanned_out(followers_count):
+    return followers_count <= settings.FEED_FANOUT_MAX_FOLLOWERS
+
+
+def follower_batches(author_id, batch_size=None):
+    """id подписчиков автора пакетами по batch_size."""
+    batch_size = batch_size or settings.FEED_FANOUT_BATCH_SIZE
+    followers = Follow.objects.filter(author_id=author_id).order_by(
+        'follower_id').values_list('follower_id', flat=True)
+    last_id = 0
+    while True:
+        batch = list(followers.filter(follower_id__gt=last_id)[:batch_size])
+        if batch:
+            yield batch
+        if len(batch) < batch_size:
+            return
+        last_id = batch[-1]
+
+
+def fan_out(recipe, batch_size=None):
+    """Раздаёт рецепт в ленты подписчиков автора пакетами.
+
+    Возвращает число подписчиков; рецепты популярных авторов не
+    раздаются (см. feed_keys). Вызывается после коммита рецепта, чтобы
+    не удлинять транзакцию создания.
+    """
+    # Автор загружен вместе с запросом: счётчик без лишнего SELECT.
+    if not is_fanned_out(recipe.author.followers_count):
+        return 0
+    total = 0
+    for batch in follower_batches(recipe.author_id, batch_size):
+        TimelineEntry.objects.bulk_create([
+            TimelineEntry(user_id=follower_id, recipe_id=recipe.pk,
+                          author_id=recipe.author_id,
+                          pub_date=recipe.pub_date)
+            for follower_id in batch
+        ], ignore_conflicts=True)
+        total += len(batch)
+    return total
+
+
+def unfollowed(author_id):
+    """После отписки от автора.
+
+    Рецепты, опубликованные, пока у автора было больше
+    FEED_FANOUT_MAX_FOLLOWERS подписчиков, не раздавались, а
+    подмешивались при чтении. Когда подписчиков становится не больше
+    порога, рецепты до этого момента продолжают подмешиваться (см.
+    feed_keys): раздавать их всем подписчикам в запросе отписки слишком
+    дорого.
+    """
+    User.objects.filter(
+        pk=author_id,
+        followers_count=settings.FEED_FANOUT_MAX_FOLLOWERS,
+    ).update(feed_merge_before=Now())
+
+
+def backfill(user_id, author_id, limit=None):
+    """Добавляет в ленту последние рецепты автора (после подписки)."""
+    followers_count = User.objects.filter(
+        pk=author_id).values_list('followers_count', flat=True).get()
+    if not is_fanned_out(followers_count):
+        return 0
+    recipes = Recipe.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-id').values_list('id', 'pub_date')
+    entries = TimelineEntry.objects.bulk_create([
+        TimelineEntry(user_id=user_id, recipe_id=recipe_id,
+                      author_id=author_id, pub_date=pub_date)
+        for recipe_id, pub_date in recipes[
+            :limit or settings.FEED_BACKFILL_LIMIT]
+    ], ignore_conflicts=True)
+    return len(entries)
+
+
+def remove(user_id, author_id):
+    """Убирает из ленты рецепты автора (после отписки)."""
+    return TimelineEntry.objects.filter(
+        user_id=user_id, author_id=author_id).delete()[0]
+
+
+def after_key(key, date_field, id_field):
+    pub_date, recipe_id = key
+    return (Q(**{f'{date_field}__lt': pub_date})
+            | Q(**{date_field: pub_date, f'{id_field}__lt': recipe_id}))
+
+
+def feed_keys(user, limit, after=None):
+    """Ключи (pub_date, id рецепта) ленты user по убыванию, после after.
+
+    Лента сливается из записей TimelineEntry и последних рецептов
+    популярных авторов, которые не раздаются при публикации (и рецептов
+    до feed_merge_before авторов, бывших популярными). Обе выборки идут
+    по индексам и ограничены limit.
+    """
+    entries = TimelineEntry.objects.filter(user=user)
+    popular = Recipe.objects.filter(
+        Q(author__followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS)
+        | Q(pub_date__lt=F('author__feed_merge_before')),
+        author__in=Follow.objects.filter(follower=user).filter(
+            Q(author__followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS)
+            | Q(author__feed_merge_before__isnull=False)
+        ).values('author'),
+    )
+    if after is not None:
+        entries = entries.filter(after_key(after, 'pub_date', 'recipe_id'))
+        popular = popular.filter(after_key(after, 'pub_date', 'id'))
+    # Множество: рецепт мог попасть в ленту до того, как автор стал
+    # популярным.
+    keys = set(entries.order_by('-pub_date', '-recipe_id').values_list(
+        'pub_date', 'recipe_id')[:limit])
+    keys.update(popular.order_by('-pub_date', '-id').values_list(
+        'pub_date', 'id')[:limit])
+    return sorted(keys, reverse=True)[:limit]
@@ -1,18 +1,20 @@
 # backend/library/base64ImageField.py
 
-import base64
 import uuid
 
 from django.core.files.base import ContentFile
 from rest_framework import serializers
 
+from library.images import ImageError, decode_in_pool
+
 
 class Base64ImageField(serializers.ImageField):
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
+            try:
+                content, ext = decode_in_pool(data)
+            except ImageError as error:
+                raise serializers.ValidationError(str(error))
             filename = f'{uuid.uuid4()}.{ext}'
-            data = ContentFile(base64.b64decode(imgstr), name=filename)
+            data = ContentFile(content, name=filename)
         return super().to_internal_value(data)
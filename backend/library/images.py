@@ -0,0 +1,297 @@
+# backend/library/images.py
+
+import base64
+import binascii
+import io
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from threading import Lock
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Вариант -> (ширина, высота, обрезать ли до точного размера).
+VARIANTS = {
+    'card': (600, 600, False),
+    'thumbnail': (150, 150, True),
+    'avatar': (96, 96, True),
+}
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+UPLOAD_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+VARIANTS_DIR = 'variants'
+
+# (модель, поле, варианты) — поля, для которых строятся варианты.
+registry = []
+
+
+class ImageError(ValueError):
+    pass
+
+
+_executors = {}
+_executor_lock = Lock()
+
+
+def get_pool(name, workers):
+    """Пул потоков name из workers потоков, общий для процесса."""
+    executor = _executors.get(name)
+    if executor is None:
+        with _executor_lock:
+            executor = _executors.get(name)
+            if executor is None:
+                executor = _executors[name] = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix=name)
+    return executor
+
+
+def get_executor():
+    """Пул потоков для фоновых вариантов изображений.
+
+    Число потоков ограничено IMAGE_WORKERS: одновременно строятся
+    варианты не больше IMAGE_WORKERS картинок.
+    """
+    return get_pool('images', settings.IMAGE_WORKERS)
+
+
+def get_decode_executor():
+    """Отдельный пул для декодирования загрузок: запрос ждёт его с
+    таймаутом, и очередь фоновых задач не должна входить в это время.
+
+    Одновременно декодируется не больше IMAGE_DECODE_WORKERS картинок,
+    сколько бы запросов ни пришло.
+    """
+    return get_pool('images-decode', settings.IMAGE_DECODE_WORKERS)
+
+
+def check_size(width, height):
+    if (max(width, height) > settings.IMAGE_MAX_SIDE
+            or width * height > settings.IMAGE_MAX_PIXELS):
+        raise ImageError(
+            f'Слишком большое изображение: {width}x{height}. Допустимо не '
+            f'больше {settings.IMAGE_MAX_SIDE} пикселей по стороне.'
+        )
+
+
+def decode_image(data):
+    """Декодирует base64 data URI; возвращает (байты, расширение).
+
+    Размеры проверяются по заголовку до распаковки пикселей.
+    """
+    try:
+        _, encoded = data.split(';base64,', 1)
+        content = base64.b64decode(encoded, validate=True)
+    except (ValueError, binascii.Error):
+        raise ImageError('Некорректные данные изображения.')
+    try:
+        with Image.open(io.BytesIO(content)) as image:
+            check_size(*image.size)
+            image.load()
+            ext = UPLOAD_FORMATS.get(image.format)
+    except (OSError, Image.DecompressionBombError):
+        raise ImageError('Загрузите корректное изображение.')
+    if ext is None:
+        raise ImageError('Неподдерживаемый формат изображения.')
+    return content, ext
+
+
+def decode_in_pool(data):
+    # Запущенное декодирование по таймауту не прервать, поэтому его время
+    # ограничивается заранее: размером данных здесь и размерами по
+    # заголовку в decode_image.
+    if len(data) > settings.IMAGE_MAX_BYTES * 4 // 3 + 64:
+        raise ImageError(
+            f'Слишком большой файл изображения. Допустимо не больше '
+            f'{settings.IMAGE_MAX_BYTES // (1024 * 1024)} МБ.'
+        )
+    future = get_decode_executor().submit(decode_image, data)
+    try:
+        return future.result(timeout=settings.IMAGE_DECODE_TIMEOUT)
+    except TimeoutError:
+        future.cancel()
+        raise ImageError('Изображение обрабатывается слишком долго.')
+
+
+def variant_name(name, variant, ext):
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, VARIANTS_DIR, f'{stem}_{variant}.{ext}')
+
+
+def resize(image, variant):
+    width, height, crop = VARIANTS[variant]
+    if crop:
+        return ImageOps.fit(image, (width, height), Image.LANCZOS)
+    image = image.copy()
+    image.thumbnail((width, height), Image.LANCZOS)
+    return image
+
+
+def to_rgb(image):
+    if image.mode == 'RGB':
+        return image
+    rgba = image.convert('RGBA')
+    background = Image.new('RGB', rgba.size, 'white')
+    background.paste(rgba, mask=rgba.getchannel('A'))
+    return background
+
+
+def source_field(fieldfile):
+    """Поле модели с именем файла, для которого построены варианты."""
+    return f'{fieldfile.field.name}_variants_source'
+
+
+def make_variants(fieldfile, variants):
+    """Строит WebP и JPEG всех вариантов; возвращает имена файлов."""
+    storage = fieldfile.storage
+    created = []
+    with storage.open(fieldfile.name) as file, Image.open(file) as image:
+        check_size(*image.size)
+        image = to_rgb(ImageOps.exif_transpose(image))
+        for variant in variants:
+            resized = resize(image, variant)
+            for ext, (image_format, options) in FORMATS.items():
+                name = variant_name(fieldfile.name, variant, ext)
+                buffer = io.BytesIO()
+                resized.save(buffer, image_format, **options)
+                if storage.exists(name):
+                    storage.delete(name)
+                buffer.seek(0)
+                created.append(storage.save(name, buffer))
+    return created
+
+
+def mark_variants(fieldfile):
+    """Записывает, что варианты fieldfile готовы: их URL строятся без
+    обращений к хранилищу."""
+    instance = fieldfile.instance
+    # Файл могли заменить, пока строились варианты.
+    type(instance)._base_manager.filter(
+        pk=instance.pk, **{fieldfile.field.name: fieldfile.name}
+    ).update(**{source_field(fieldfile): fieldfile.name})
+
+
+def delete_variants(storage, name, variants):
+    for variant in variants:
+        for ext in FORMATS:
+            storage.delete(variant_name(name, variant, ext))
+
+
+def has_variants(fieldfile):
+    return bool(fieldfile) and (
+        getattr(fieldfile.instance, source_field(fieldfile)) == fieldfile.name)
+
+
+def safe_make_variants(fieldfile, variants, old_name='', mark=True):
+    """Строит варианты fieldfile (и с mark отмечает их готовыми) и удаляет
+    варианты прежнего файла old_name."""
+    try:
+        created = make_variants(fieldfile, variants)
+        if mark:
+            mark_variants(fieldfile)
+    except Exception:
+        logger.exception('Не удалось построить варианты %s', fieldfile.name)
+        return []
+    if old_name and old_name != fieldfile.name:
+        safe_delete_variants(fieldfile.storage, old_name, variants)
+    return created
+
+
+def safe_delete_variants(storage, name, variants):
+    try:
+        delete_variants(storage, name, variants)
+    except Exception:
+        logger.exception('Не удалось удалить варианты %s', name)
+
+
+def run_in_pool(task, *args):
+    try:
+        return task(*args)
+    finally:
+        # Соединение потока пула закрывается по тем же правилам
+        # (CONN_MAX_AGE), что и после запроса.
+        close_old_connections()
+
+
+def schedule(task, *args):
+    """После коммита выполняет task в пуле (или сразу при
+    IMAGE_VARIANTS_SYNC)."""
+    if settings.IMAGE_VARIANTS_SYNC:
+        transaction.on_commit(lambda: task(*args))
+    else:
+        transaction.on_commit(
+            lambda: get_executor().submit(run_in_pool, task, *args))
+
+
+def variant_url(fieldfile, variant, ext='jpg'):
+    """URL варианта; пока вариант не готов — URL оригинала."""
+    if not fieldfile:
+        return ''
+    if has_variants(fieldfile):
+        return fieldfile.storage.url(
+            variant_name(fieldfile.name, variant, ext))
+    return fieldfile.url
+
+
+def variant_urls(fieldfile, variants, request=None):
+    """{вариант: {формат: URL}} или None, если варианты ещё не готовы."""
+    if not has_variants(fieldfile):
+        return None
+    build = request.build_absolute_uri if request else str
+    return {
+        variant: {
+            ext: build(fieldfile.storage.url(
+                variant_name(fieldfile.name, variant, ext)))
+            for ext in FORMATS
+        }
+        for variant in variants
+    }
+
+
+def register(model, field_name, variants):
+    """Строит варианты при каждой загрузке нового файла в поле модели.
+
+    У модели должно быть поле <field_name>_variants_source (см.
+    source_field). Варианты заменённого или удалённого файла удаляются.
+    """
+    registry.append((model, field_name, variants))
+    uid = f'image-variants:{model._meta.label}.{field_name}'
+    source = f'{field_name}_variants_source'
+    storage = model._meta.get_field(field_name).storage
+
+    def mark_new_file(sender, instance, **kwargs):
+        fieldfile = getattr(instance, field_name)
+        # Ещё не сохранённый в хранилище файл — новая загрузка.
+        if fieldfile and not fieldfile._committed:
+            instance._new_images = {
+                *getattr(instance, '_new_images', ()), field_name}
+        elif not fieldfile and getattr(instance, source):
+            # Файл убран из поля: его варианты больше не нужны.
+            schedule(safe_delete_variants, storage, getattr(instance, source),
+                     variants)
+            setattr(instance, source, '')
+
+    def process_new_file(sender, instance, **kwargs):
+        new_images = getattr(instance, '_new_images', set())
+        if field_name in new_images:
+            new_images.discard(field_name)
+            schedule(safe_make_variants, getattr(instance, field_name),
+                     variants, getattr(instance, source))
+
+    def delete_files(sender, instance, **kwargs):
+        name = getattr(instance, source)
+        if name:
+            schedule(safe_delete_variants, storage, name, variants)
+
+    pre_save.connect(mark_new_file, sender=model, weak=False, dispatch_uid=uid)
+    post_save.connect(process_new_file, sender=model, weak=False,
+                      dispatch_uid=uid)
+    post_delete.connect(delete_files, sender=model, weak=False,
+                        dispatch_uid=uid)
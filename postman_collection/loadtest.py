@@ -0,0 +1,298 @@
+"""Нагрузочный тест API по сценариям из Postman-коллекции.
+
+Виртуальные пользователи регистрируются, получают токены и в течение
+--duration секунд выполняют взвешенные сценарии: лента, фильтр по тегам,
+избранное, корзина, скачивание списка покупок, подписки, поиск продуктов.
+В конце печатается пропускная способность и p50/p95/p99 по эндпоинтам.
+
+    pip install -r requirements.txt
+    python loadtest.py --users 20 --duration 60
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import sys
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+try:
+    import aiohttp
+except ImportError:
+    sys.exit('Нужен aiohttp: pip install -r requirements.txt')
+
+COLLECTION = Path(__file__).with_name('foodgram.postman_collection.json')
+PASSWORD = 'Load-test-pa$$word'
+# Переменные вида {{firstRecipeId}} и числовые id в путях коллекции.
+ID_PATTERN = re.compile(r'/(\{\{\w+\}\}|\d+)/')
+
+
+def normalize(path):
+    path = path.replace('{{baseUrl}}', '').split('?')[0]
+    while ID_PATTERN.search(path):
+        path = ID_PATTERN.sub('/{id}/', path)
+    return path
+
+
+def load_collection(path):
+    """Базовый URL и множество (метод, шаблон пути) из коллекции."""
+    with open(path, encoding='utf-8') as file:
+        collection = json.load(file)
+    endpoints = set()
+
+    def walk(items):
+        for item in items:
+            if 'item' in item:
+                walk(item['item'])
+                continue
+            url = item['request']['url']
+            endpoints.add((item['request']['method'],
+                           normalize(url['raw'] if isinstance(url, dict)
+                                     else url)))
+
+    walk(collection['item'])
+    variables = {variable['key']: variable['value']
+                 for variable in collection.get('variable', [])}
+    return variables.get('baseUrl', 'http://127.0.0.1:8000'), endpoints
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.client_errors = defaultdict(int)
+
+    def add(self, key, latency, status):
+        self.latencies[key].append(latency)
+        if status is None or status >= 500:
+            self.errors[key] += 1
+        elif status >= 400:
+            self.client_errors[key] += 1
+
+    @staticmethod
+    def percentile(values, fraction):
+        return values[min(len(values) - 1, int(len(values) * fraction))]
+
+    def report(self, elapsed):
+        lines = [f'{"эндпоинт":<44} {"запр.":>7} {"в сек":>7} '
+                 f'{"4xx":>5} {"ошиб.":>5} {"p50":>8} {"p95":>8} {"p99":>8}']
+        total = 0
+        for key in sorted(self.latencies):
+            values = sorted(self.latencies[key])
+            total += len(values)
+            lines.append(
+                f'{" ".join(key):<44} {len(values):>7} '
+                f'{len(values) / elapsed:>7.1f} '
+                f'{self.client_errors[key]:>5} {self.errors[key]:>5} '
+                + ' '.join(f'{self.percentile(values, fraction):>6.1f}мс'
+                           for fraction in (0.5, 0.95, 0.99))
+            )
+        lines.append(f'Всего {total} запросов за {elapsed:.1f} с: '
+                     f'{total / elapsed:.1f} в секунду, ошибок '
+                     f'{sum(self.errors.values())}')
+        return '\n'.join(lines)
+
+
+class VirtualUser:
+    def __init__(self, session, base_url, stats, rng, catalog):
+        self.session = session
+        self.base_url = base_url
+        self.stats = stats
+        self.rng = rng
+        self.catalog = catalog
+        self.headers = {}
+        self.user_id = None
+
+    async def request(self, method, template, path=None, **kwargs):
+        """Запрос с замером времени; шаблон пути — ключ статистики."""
+        started = time.perf_counter()
+        status = body = None
+        try:
+            async with self.session.request(
+                    method, self.base_url + (path or template),
+                    headers=self.headers, **kwargs) as response:
+                status = response.status
+                body = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+        self.stats.add((method, template),
+                       (time.perf_counter() - started) * 1000, status)
+        if status and status < 300 and body and body[:1] in b'{[':
+            return json.loads(body)
+        return None
+
+    async def register(self, username):
+        await self.request('POST', '/api/users/', json={
+            'email': f'{username}@example.com',
+            'username': username,
+            'first_name': 'Нагрузка',
+            'last_name': 'Тестовая',
+            'password': PASSWORD,
+        })
+        token = await self.request('POST', '/api/auth/token/login/', json={
+            'email': f'{username}@example.com', 'password': PASSWORD})
+        if not token:
+            raise RuntimeError(f'Не удалось получить токен для {username}')
+        self.headers = {'Authorization': f'Token {token["auth_token"]}'}
+        me = await self.request('GET', '/api/users/me/')
+        self.user_id = me['id']
+
+    def recipe_id(self):
+        return self.rng.choice(self.catalog['recipes'])
+
+    async def browse_feed(self):
+        for page in range(1, self.rng.randint(1, 3) + 1):
+            await self.request('GET', '/api/recipes/',
+                               params={'page': page})
+        await self.request('GET', '/api/recipes/{id}/',
+                           f'/api/recipes/{self.recipe_id()}/')
+
+    async def filter_by_tags(self):
+        tags = self.rng.sample(self.catalog['tags'],
+                               min(2, len(self.catalog['tags'])))
+        await self.request('GET', '/api/recipes/',
+                           params=[('tags', tag) for tag in tags])
+
+    async def toggle(self, relation, filter_name):
+        """Добавить рецепт, открыть отфильтрованную ленту и в половине
+        случаев убрать рецепт обратно."""
+        template = f'/api/recipes/{{id}}/{relation}/'
+        path = f'/api/recipes/{self.recipe_id()}/{relation}/'
+        await self.request('POST', template, path)
+        await self.request('GET', '/api/recipes/', params={filter_name: 1})
+        if self.rng.random() < 0.5:
+            await self.request('DELETE', template, path)
+
+    async def favorite(self):
+        await self.toggle('favorite', 'is_favorited')
+
+    async def shopping_cart(self):
+        await self.toggle('shopping_cart', 'is_in_shopping_cart')
+
+    async def download_shopping_cart(self):
+        await self.request('GET', '/api/recipes/download_shopping_cart/')
+
+    async def subscribe(self):
+        author = self.rng.choice(self.catalog['authors'])
+        template = '/api/users/{id}/subscribe/'
+        path = f'/api/users/{author}/subscribe/'
+        await self.request('POST', template, path)
+        await self.request('GET', '/api/users/subscriptions/',
+                           params={'recipes_limit': 3})
+        if self.rng.random() < 0.5:
+            await self.request('DELETE', template, path)
+
+    async def search_ingredients(self):
+        name = self.rng.choice(self.catalog['ingredients'])
+        for length in range(1, min(len(name), 4) + 1):
+            await self.request('GET', '/api/ingredients/',
+                               params={'name': name[:length]})
+
+
+# Сценарий -> (вес, эндпоинты коллекции, которые он воспроизводит).
+SCENARIOS = {
+    'browse_feed': (40, {('GET', '/api/recipes/'),
+                         ('GET', '/api/recipes/{id}/')}),
+    'filter_by_tags': (20, {('GET', '/api/recipes/')}),
+    'favorite': (10, {('POST', '/api/recipes/{id}/favorite/'),
+                      ('DELETE', '/api/recipes/{id}/favorite/')}),
+    'shopping_cart': (10, {('POST', '/api/recipes/{id}/shopping_cart/'),
+                           ('DELETE', '/api/recipes/{id}/shopping_cart/')}),
+    'download_shopping_cart': (
+        5, {('GET', '/api/recipes/download_shopping_cart/')}),
+    'subscribe': (10, {('POST', '/api/users/{id}/subscribe/'),
+                       ('DELETE', '/api/users/{id}/subscribe/'),
+                       ('GET', '/api/users/subscriptions/')}),
+    'search_ingredients': (5, {('GET', '/api/ingredients/')}),
+}
+
+
+async def discover(session, base_url):
+    """Теги, рецепты, авторы и продукты, с которыми работают сценарии."""
+    async def get(path, **params):
+        async with session.get(base_url + path, params=params) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    tags = await get('/api/tags/')
+    recipes = (await get('/api/recipes/', limit=100))['results']
+    ingredients = await get('/api/ingredients/')
+    if not recipes or not tags:
+        raise RuntimeError('В базе нет рецептов или тегов: заполните её '
+                           'командой generate_dataset.')
+    return {
+        'tags': [tag['slug'] for tag in tags],
+        'recipes': [recipe['id'] for recipe in recipes],
+        'authors': sorted({recipe['author']['id'] for recipe in recipes}),
+        'ingredients': [item['name'] for item in ingredients][:200]
+        or ['а'],
+    }
+
+
+async def run_user(user, deadline, think_time):
+    names = list(SCENARIOS)
+    weights = [SCENARIOS[name][0] for name in names]
+    while time.monotonic() < deadline:
+        scenario = user.rng.choices(names, weights)[0]
+        await getattr(user, scenario)()
+        if think_time:
+            await asyncio.sleep(user.rng.uniform(0, think_time))
+
+
+async def main(options):
+    base_url, endpoints = load_collection(options.collection)
+    base_url = (options.base_url or base_url).rstrip('/')
+    missing = {endpoint for _, used in SCENARIOS.values()
+               for endpoint in used} - endpoints
+    if missing:
+        print(f'Нет в коллекции: {sorted(missing)}', file=sys.stderr)
+    rng = random.Random(options.seed)
+    run_id = uuid.uuid4().hex[:8]
+    connector = aiohttp.TCPConnector(limit=options.users)
+    timeout = aiohttp.ClientTimeout(total=options.timeout)
+    async with aiohttp.ClientSession(connector=connector,
+                                     timeout=timeout) as session:
+        catalog = await discover(session, base_url)
+        setup_stats = Stats()
+        users = [
+            VirtualUser(session, base_url, setup_stats,
+                        random.Random(rng.random()), catalog)
+            for _ in range(options.users)
+        ]
+        await asyncio.gather(*(
+            user.register(f'loadtest_{run_id}_{index}')
+            for index, user in enumerate(users)
+        ))
+        print(f'Создано пользователей loadtest_{run_id}_*: {len(users)}')
+        stats = Stats()
+        for user in users:
+            user.stats = stats
+        started = time.monotonic()
+        await asyncio.gather(*(
+            run_user(user, started + options.duration, options.think_time)
+            for user in users
+        ))
+        print(stats.report(time.monotonic() - started))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--base-url',
+                        help='По умолчанию baseUrl из коллекции')
+    parser.add_argument('--collection', default=COLLECTION)
+    parser.add_argument('--users', type=int, default=10,
+                        help='Число одновременных виртуальных пользователей')
+    parser.add_argument('--duration', type=float, default=30,
+                        help='Длительность нагрузки, секунды')
+    parser.add_argument('--think-time', type=float, default=0,
+                        help='Максимальная пауза между сценариями, секунды')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))